@@ -1,21 +1,160 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
+from typing import Union, TYPE_CHECKING
+from contextlib import asynccontextmanager
+
+from sqlalchemy import create_engine, make_url, event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import QueuePool, NullPool, AsyncAdaptedQueuePool
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
+from starlette.concurrency import run_in_threadpool
 
 from .utils.secret_data import DATABASE_URL, TEST_DATABASE_URL, TEST_MODE
+from .utils.config import (
+    DATABASE_URL_OVERRIDE, ASYNC_DATABASE,
+    DATABASE_POOL_SIZE, DATABASE_MAX_OVERFLOW, DATABASE_POOL_TIMEOUT,
+    DATABASE_POOL_RECYCLE, DATABASE_POOL_PRE_PING,
+)
+from .utils.pool import PoolMonitor, instrumented_pool_class
+from .utils.compression import message_text
+from .utils.queries import track_queries
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
 
 class Base(DeclarativeBase):
     pass
 
-engine = create_engine(url=TEST_DATABASE_URL) if TEST_MODE else create_engine(url=DATABASE_URL)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str):
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+def pool_options(url, monitor: PoolMonitor) -> dict:
+    url = make_url(url)
+    pool_class = url.get_dialect().get_pool_class(url)
+
+    # aiosqlite on a file defaults to NullPool here (newer SQLAlchemy pools it too).
+    if pool_class is NullPool and url.drivername == "sqlite+aiosqlite" and url.database not in (None, "", ":memory:"):
+        pool_class = AsyncAdaptedQueuePool
+
+    options = {
+        "poolclass": instrumented_pool_class(pool_class, monitor),
+        "pool_recycle": DATABASE_POOL_RECYCLE,
+        "pool_pre_ping": DATABASE_POOL_PRE_PING,
+    }
+
+    # Sizing only applies to queue pools; SQLite's in-memory pools don't take it.
+    if issubclass(pool_class, QueuePool):
+        options.update(pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_MAX_OVERFLOW,
+                       pool_timeout=DATABASE_POOL_TIMEOUT)
+
+    return options
+
+# Deletes cascade in the database (ON DELETE CASCADE), which SQLite only enforces when
+# foreign keys are switched on, per connection.
+def enforce_foreign_keys(engine):
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
+
+# SQL functions the schema relies on: message_text() in the full-text triggers decompresses
+# message bodies (see models/message.py).
+def register_functions(engine):
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.create_function("message_text", 3, message_text, deterministic=True)
+
+database_url = DATABASE_URL_OVERRIDE or (TEST_DATABASE_URL if TEST_MODE else DATABASE_URL)
+
+pool_monitors = {"sync": PoolMonitor()}
+
+engine = create_engine(url=database_url, **pool_options(database_url, pool_monitors["sync"]))
+pool_monitors["sync"].attach(engine)
+enforce_foreign_keys(engine)
+register_functions(engine)
+track_queries(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = None
+AsyncSessionLocal = None
+
+if ASYNC_DATABASE:
+    # Only imported here: the async extension needs greenlet, which sync deployments lack.
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    pool_monitors["async"] = PoolMonitor()
+    async_engine = create_async_engine(url=to_async_url(database_url),
+                                       **pool_options(to_async_url(database_url), pool_monitors["async"]))
+    pool_monitors["async"].attach(async_engine.sync_engine)
+    enforce_foreign_keys(async_engine.sync_engine)
+    register_functions(async_engine.sync_engine)
+    track_queries(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=async_engine)
+
 def get_engine():
     return engine
 
+# insert() with the dialect's ON CONFLICT support for whatever `db` is bound to.
+def dialect_insert(db: Session, model):
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql.insert(model)
+
+    return sqlite.insert(model)
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
 
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_session():
+    if ASYNC_DATABASE:
+        async with AsyncSessionLocal() as db:
+            yield db
+        return
+
+    db = SessionLocal()
+    try:
+        yield db
+
+    finally:
+        db.close()
+
+# For handlers that outlive their queries (WebSockets, long polls) and must not
+# keep a pooled connection checked out while they wait.
+session_scope = asynccontextmanager(get_session)
+
+
+# Repositories are written once against the synchronous Session API. This proxy turns
+# each of their methods into a coroutine: with an AsyncSession the call runs through
+# run_sync on the async driver, otherwise it's moved to the threadpool, so in neither
+# mode does a database round trip block the event loop.
+class AsyncRepository:
+    def __init__(self, db: Union[Session, "AsyncSession"], repository_class: type):
+        self.db = db
+        self.repository_class = repository_class
+
+    def __getattr__(self, name: str):
+        method = getattr(self.repository_class, name)
+
+        async def call(*args, **kwargs):
+            if isinstance(self.db, Session):
+                return await run_in_threadpool(method, self.repository_class(self.db), *args, **kwargs)
+
+            return await self.db.run_sync(lambda session: method(self.repository_class(session), *args, **kwargs))
+
+        return call
@@ -0,0 +1,250 @@
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from typing import AsyncIterator, Callable, Optional
+
+from sqlalchemy import select, delete, exists, and_
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import NoResultFound
+from starlette.concurrency import run_in_threadpool
+
+from .exceptions import (
+    AttachmentNotFoundError, AttachmentTooLargeError,
+    MessageNotFoundError, ForbiddenError,
+)
+from ..database import dialect_insert
+from ..models.attachment import Blob, Upload, Attachment
+from ..models.message import Message
+from ..models.participant import Participant
+from ..models.chat import Chat, utc_now
+from ..schemas.attachment import BlobSchema, AttachmentCreateSchema, AttachmentSchema
+from ..utils.config import ATTACHMENTS_DIR, ATTACHMENT_CHUNK_SIZE, ATTACHMENT_MAX_SIZE
+
+
+# Files on local disk, named by the SHA-256 of their content: <root>/ab/cd/abcd... An upload
+# is written to <root>/tmp while it's hashed and then renamed to its name, or dropped if that
+# content is stored already. All disk work runs in the threadpool, one chunk at a time, so
+# neither the event loop nor memory ever holds more than a chunk of a file.
+class BlobStore:
+    def __init__(self, root: str = ATTACHMENTS_DIR, chunk_size: int = ATTACHMENT_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    async def receive(self, chunks: AsyncIterator[bytes], max_size: int) -> tuple[str, int, str]:
+        file = await run_in_threadpool(self.__open_temporary)
+        digest = hashlib.sha256()
+        buffer = bytearray()
+        size = 0
+
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise AttachmentTooLargeError(f"Attachments may be at most {max_size} bytes.")
+
+                buffer += chunk
+                if len(buffer) >= self.chunk_size:
+                    await run_in_threadpool(self.__write, file, digest, buffer)
+                    buffer.clear()
+
+            await run_in_threadpool(self.__write, file, digest, buffer)
+            await run_in_threadpool(self.__close, file)
+        except BaseException:
+            await run_in_threadpool(self.__close, file)
+            await run_in_threadpool(self.discard, file.name)
+            raise
+
+        return digest.hexdigest(), size, file.name
+
+    def __open_temporary(self):
+        directory = os.path.join(self.root, "tmp")
+        os.makedirs(directory, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=directory, delete=False)
+
+    @staticmethod
+    def __write(file, digest, data: bytearray):
+        # hashlib and file writes release the GIL for large buffers.
+        digest.update(data)
+        file.write(data)
+
+    @staticmethod
+    def __close(file):
+        if not file.closed:
+            file.flush()
+            os.fsync(file.fileno())
+            file.close()
+
+    # keep() and remove() are called by AttachmentRepository inside the transaction that
+    # writes or deletes the blob's row, see there.
+    def keep(self, temp_path: str, sha256: str):
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.unlink(temp_path)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def remove(self, sha256: str):
+        self.discard(self.path(sha256))
+
+    @staticmethod
+    def discard(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    async def stat(self, sha256: str) -> Optional[os.stat_result]:
+        try:
+            return await run_in_threadpool(os.stat, self.path(sha256))
+        except FileNotFoundError:
+            return None
+
+
+blob_store = BlobStore()
+
+
+# A blob's file is put in place or removed while the transaction writing or deleting its row
+# holds that row, so an upload and the purge job racing over the same content can't leave a
+# row without a file: whichever comes second waits for the other's commit.
+class AttachmentRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def add_blob(self, sha256: str, size: int, user_id: int, store_file: Callable[[], None]) -> BlobSchema:
+        # Uploading content that is stored already only refreshes created_at, which keeps
+        # the blob from being collected before the uploader attaches it.
+        now = utc_now()
+        statement = (dialect_insert(self.db, Blob).values(sha256=sha256, size=size, created_at=now)
+                     .on_conflict_do_update(index_elements=[Blob.sha256], set_={"created_at": now}))
+        blob_id = self.db.scalar(statement.returning(Blob.id))
+        self.db.execute(dialect_insert(self.db, Upload).values(blob_id=blob_id, user_id=user_id)
+                        .on_conflict_do_nothing(index_elements=[Upload.blob_id, Upload.user_id]))
+        store_file()
+        self.db.commit()
+
+        return BlobSchema(sha256=sha256, size=size)
+
+    def find_message_sender(self, message_id: int) -> Optional[int]:
+        return (self.db.query(Participant.user_id)
+                .join(Message, Message.sender_id == Participant.id)
+                .join(Chat, and_(Chat.id == Message.chat_id, Chat.deleted_at.is_(None)))
+                .filter(Message.id == message_id)
+                .scalar())
+
+    def add_attachment(self, message_id: int, user_id: int,
+                       create_schema: AttachmentCreateSchema) -> AttachmentSchema:
+        # Only a blob the user uploaded themselves.
+        blob = (self.db.query(Blob)
+                .join(Upload, and_(Upload.blob_id == Blob.id, Upload.user_id == user_id))
+                .filter(Blob.sha256 == create_schema.sha256)
+                .first())
+
+        if blob is None:
+            raise NoResultFound()
+
+        attachment = Attachment(message_id=message_id, blob_id=blob.id,
+                                filename=create_schema.filename, content_type=create_schema.content_type)
+        self.db.add(attachment)
+        self.db.flush()
+        schema = AttachmentSchema(id=attachment.id, message_id=message_id, sha256=blob.sha256, size=blob.size,
+                                  filename=attachment.filename, content_type=attachment.content_type)
+        self.db.commit()
+
+        return schema
+
+    def __visible_attachments(self, user_id: int):
+        # Attachments of messages in the user's chats, with their blob.
+        return (self.db.query(Attachment.id, Attachment.message_id, Blob.sha256, Blob.size,
+                              Attachment.filename, Attachment.content_type)
+                .join(Blob, Blob.id == Attachment.blob_id)
+                .join(Message, Message.id == Attachment.message_id)
+                .join(Participant, and_(Participant.chat_id == Message.chat_id, Participant.user_id == user_id))
+                .join(Chat, and_(Chat.id == Message.chat_id, Chat.deleted_at.is_(None))))
+
+    def find_message_attachments(self, message_id: int, user_id: int) -> list[AttachmentSchema]:
+        rows = (self.__visible_attachments(user_id)
+                .filter(Attachment.message_id == message_id)
+                .order_by(Attachment.id))
+
+        return [AttachmentSchema.model_validate(row) for row in rows]
+
+    def find_attachment(self, id: int, user_id: int) -> AttachmentSchema:
+        row = self.__visible_attachments(user_id).filter(Attachment.id == id).first()
+
+        if row is None:
+            raise NoResultFound()
+
+        return AttachmentSchema.model_validate(row)
+
+    def delete_orphan_blobs(self, older_than: float, batch_size: int,
+                            remove_file: Callable[[str], None]) -> int:
+        cutoff = utc_now() - timedelta(seconds=older_than)
+        orphans = (select(Blob.id)
+                   .where(Blob.created_at < cutoff, ~exists().where(Attachment.blob_id == Blob.id))
+                   .limit(batch_size))
+        # created_at is checked again on the row itself: on PostgreSQL a delete that waited for
+        # an upload of the same content re-reads it, and leaves the blob alone.
+        removed = self.db.scalars(delete(Blob)
+                                  .where(Blob.id.in_(orphans), Blob.created_at < cutoff)
+                                  .returning(Blob.sha256)).all()
+        for sha256 in removed:
+            remove_file(sha256)
+        self.db.commit()
+
+        return len(removed)
+
+
+class AttachmentService:
+    def __init__(self, repository: AttachmentRepository, store: BlobStore = blob_store,
+                 max_size: int = ATTACHMENT_MAX_SIZE):
+        self.repository = repository
+        self.store = store
+        self.max_size = max_size
+
+    async def upload(self, user_id: int, chunks: AsyncIterator[bytes], length: Optional[int] = None) -> BlobSchema:
+        if length is not None and length > self.max_size:
+            raise AttachmentTooLargeError(f"Attachments may be at most {self.max_size} bytes.")
+
+        sha256, size, temp_path = await self.store.receive(chunks, self.max_size)
+
+        try:
+            return await self.repository.add_blob(sha256, size, user_id, lambda: self.store.keep(temp_path, sha256))
+        except BaseException:
+            await run_in_threadpool(self.store.discard, temp_path)
+            raise
+
+    async def attach(self, message_id: int, user_id: int, create_schema: AttachmentCreateSchema) -> AttachmentSchema:
+        sender_id = await self.repository.find_message_sender(message_id)
+
+        if sender_id is None:
+            raise MessageNotFoundError()
+
+        if sender_id != user_id:
+            raise ForbiddenError("Only the sender can attach files to a message.")
+
+        try:
+            return await self.repository.add_attachment(message_id, user_id, create_schema)
+        except NoResultFound:
+            # The same answer whether someone else uploaded it or nobody did.
+            raise AttachmentNotFoundError("You haven't uploaded anything with this hash.")
+
+    async def get_message_attachments(self, message_id: int, user_id: int) -> list[AttachmentSchema]:
+        return await self.repository.find_message_attachments(message_id, user_id)
+
+    async def open_attachment(self, id: int, user_id: int) -> tuple[AttachmentSchema, str, os.stat_result]:
+        try:
+            attachment = await self.repository.find_attachment(id, user_id)
+        except NoResultFound:
+            raise AttachmentNotFoundError()
+
+        stat = await self.store.stat(attachment.sha256)
+        if stat is None:
+            raise AttachmentNotFoundError("Attachment content is missing.")
+
+        return attachment, self.store.path(attachment.sha256), stat
@@ -0,0 +1,371 @@
+import json
+import logging
+import os
+import queue
+import re
+import select
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from typing import Any, Iterator, Optional
+
+from sqlalchemy import make_url
+from sqlalchemy.exc import NoResultFound
+
+from .realtime import ChatHub, hub as chat_hub
+from ..database import SessionLocal, database_url
+from ..utils.config import REALTIME_BROKER, REALTIME_BROKER_URL, REALTIME_BROKER_CHANNEL
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+logger = logging.getLogger("messenger.broker")
+
+
+# Where services publish chat events. Subscribers in this process always get an event
+# straight from the hub; a broker backend also hands it to the hubs of the other workers.
+class Broker(ABC):
+    name: str
+
+    def __init__(self, hub: ChatHub):
+        self.hub = hub
+        self.counters = Counter(published=0)
+        self.__lock = threading.Lock()
+
+    def count(self, name: str, amount: int = 1):
+        with self.__lock:
+            self.counters[name] += amount
+
+    def publish(self, chat_id: int, event: dict[str, Any]):
+        self.count("published")
+        self.hub.deliver(chat_id, [event])
+
+    @abstractmethod
+    def start(self): ...
+
+    @abstractmethod
+    def stop(self): ...
+
+    def stats(self) -> dict[str, Any]:
+        with self.__lock:
+            return {"backend": self.name, **self.counters}
+
+
+class InMemoryBroker(Broker):
+    name = "memory"
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+# Base of the cross-process backends. publish() only queues the event; one sender thread
+# drains the queue, groups what it took by chat (keeping each chat's order) and sends every
+# group as one payload, or several if it doesn't fit in max_payload. Under load a drain takes
+# many events, so notifications are batched exactly when it pays off. A receiver thread
+# hands payloads from other workers to the local hub. A single sender and a single
+# receiver keep every chat's events from one worker in order on every other worker;
+# events of one chat published by different workers are ordered by arrival.
+#
+# An event too big for one payload is never dropped: a join of many users is split into
+# joins of fewer, and a long message is sent by reference, as a "message_ref" event the
+# receivers replace with the message read back from the database.
+class RelayBroker(Broker):
+    max_payload: int
+
+    def __init__(self, hub: ChatHub):
+        super().__init__(hub)
+        self.origin = uuid.uuid4().hex
+        self.counters.update(sent=0, payloads=0, received=0, oversized=0, errors=0, dropped=0)
+        self.__outbox: queue.SimpleQueue = queue.SimpleQueue()
+        self.__stopping = threading.Event()
+        self.__threads: list[threading.Thread] = []
+
+    @abstractmethod
+    def open(self): ...
+
+    @abstractmethod
+    def close(self): ...
+
+    @abstractmethod
+    def send(self, payload: bytes): ...
+
+    @abstractmethod
+    def receive(self, timeout: float) -> list[bytes]: ...
+
+    def publish(self, chat_id: int, event: dict[str, Any]):
+        super().publish(chat_id, event)
+        self.__outbox.put((chat_id, event))
+
+    def start(self):
+        self.open()
+        self.__stopping.clear()
+        self.__threads = [threading.Thread(target=self.__send_loop, name=f"{self.name}-broker-sender", daemon=True),
+                          threading.Thread(target=self.__receive_loop, name=f"{self.name}-broker-receiver", daemon=True)]
+        for thread in self.__threads:
+            thread.start()
+
+    def stop(self):
+        self.__stopping.set()
+        self.__outbox.put(None)
+        for thread in self.__threads:
+            thread.join(timeout=5)
+        self.__threads = []
+        self.close()
+
+    def __drain(self) -> list[tuple[int, dict]]:
+        items = [self.__outbox.get()]
+        while True:
+            try:
+                items.append(self.__outbox.get_nowait())
+            except queue.Empty:
+                return [item for item in items if item is not None]
+
+    def encode(self, chat_id: int, events: list[dict]) -> Iterator[bytes]:
+        head = f'{{"origin":"{self.origin}","chat_id":{chat_id},"events":['.encode()
+        chunk, size = [], len(head) + 2
+
+        for event in events:
+            for encoded in self.fit(event, self.max_payload - len(head) - 2):
+                if chunk and size + len(encoded) + 1 > self.max_payload:
+                    yield head + b",".join(chunk) + b"]}"
+                    chunk, size = [], len(head) + 2
+
+                chunk.append(encoded)
+                size += len(encoded) + 1
+
+        if chunk:
+            yield head + b",".join(chunk) + b"]}"
+
+    def fit(self, event: dict, room: int) -> list[bytes]:
+        encoded = json.dumps(event, separators=(",", ":")).encode()
+        if len(encoded) <= room:
+            return [encoded]
+
+        self.count("oversized")
+        if event["type"] == "participants_added" and len(event["user_ids"]) > 1:
+            half = len(event["user_ids"]) // 2
+            return (self.fit({**event, "user_ids": event["user_ids"][:half]}, room)
+                    + self.fit({**event, "user_ids": event["user_ids"][half:]}, room))
+        if event["type"] == "message":
+            return self.fit({"type": "message_ref", "message_id": event["message"]["id"]}, room)
+
+        self.count("dropped")
+        logger.error("%s event is %d bytes, over the %d byte limit, and can't be split; dropped",
+                     event["type"], len(encoded), room)
+        return []
+
+    def resolve(self, events: list[dict]) -> list[dict]:
+        ids = [event["message_id"] for event in events if event["type"] == "message_ref"]
+        if not ids:
+            return events
+
+        # Imported here, as messages.py publishes through this module.
+        from .messages import MessageRepository
+
+        messages = {}
+        db = SessionLocal()
+        try:
+            for id in ids:
+                try:
+                    messages[id] = MessageRepository(db).find_message(id).model_dump(mode="json")
+                except NoResultFound:
+                    pass
+        finally:
+            db.close()
+
+        # Messages deleted since they were sent are left out.
+        resolved = []
+        for event in events:
+            if event["type"] != "message_ref":
+                resolved.append(event)
+            elif event["message_id"] in messages:
+                resolved.append({"type": "message", "message": messages[event["message_id"]]})
+
+        return resolved
+
+    def __send_loop(self):
+        while not self.__stopping.is_set():
+            batches = defaultdict(list)
+            for chat_id, event in self.__drain():
+                batches[chat_id].append(event)
+
+            for chat_id, events in batches.items():
+                for payload in self.encode(chat_id, events):
+                    try:
+                        self.send(payload)
+                    except Exception:
+                        self.count("errors")
+                        logger.exception("couldn't send events of chat %d", chat_id)
+                        continue
+                    self.count("payloads")
+                self.count("sent", len(events))
+
+    def __receive_loop(self):
+        while not self.__stopping.is_set():
+            try:
+                payloads = self.receive(timeout=0.5)
+            except Exception:
+                if self.__stopping.is_set():
+                    return
+                self.count("errors")
+                logger.exception("couldn't receive events, retrying")
+                time.sleep(1)
+                continue
+
+            # One bad payload costs only itself, not the receiver thread.
+            for payload in payloads:
+                try:
+                    message = json.loads(payload)
+                    if message["origin"] == self.origin:
+                        continue
+
+                    self.count("received", len(message["events"]))
+                    self.hub.deliver(message["chat_id"], self.resolve(message["events"]))
+                except Exception:
+                    self.count("errors")
+                    logger.exception("couldn't deliver a payload of %d bytes, skipped", len(payload))
+
+
+# Workers of one host. Each binds a datagram socket named after itself in a shared
+# directory and sends every payload to all the other sockets there. Sockets left behind by
+# a worker that died refuse datagrams and are removed.
+class UnixSocketBroker(RelayBroker):
+    name = "unix"
+    max_payload = 60_000
+    # A peer whose receive buffer stays full this long misses the payload.
+    send_timeout = 0.1
+
+    def __init__(self, hub: ChatHub, directory: str):
+        super().__init__(hub)
+        self.directory = directory
+        self.path = os.path.join(directory, f"{self.origin}.sock")
+        self.__receiver: Optional[socket.socket] = None
+        self.__sender: Optional[socket.socket] = None
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.__receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.__receiver.bind(self.path)
+        self.__sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.__sender.settimeout(self.send_timeout)
+
+    def close(self):
+        for sock in (self.__receiver, self.__sender):
+            if sock is not None:
+                sock.close()
+        self.__receiver = self.__sender = None
+
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def peers(self) -> list[str]:
+        return [entry.path for entry in os.scandir(self.directory)
+                if entry.name.endswith(".sock") and entry.path != self.path]
+
+    def send(self, payload: bytes):
+        for peer in self.peers():
+            try:
+                self.__sender.sendto(payload, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                try:
+                    os.unlink(peer)
+                except FileNotFoundError:
+                    pass
+            except TimeoutError:
+                self.count("dropped")
+
+    def receive(self, timeout: float) -> list[bytes]:
+        self.__receiver.settimeout(timeout)
+        try:
+            return [self.__receiver.recv(self.max_payload)]
+        except TimeoutError:
+            return []
+
+
+# Workers on any number of hosts, through the database: NOTIFY on one connection, LISTEN
+# on another. Needs psycopg2. PostgreSQL delivers the notifications of one session in
+# order, and drops none while the listening connection stays up.
+class PostgresBroker(RelayBroker):
+    name = "postgres"
+    # NOTIFY payloads must be shorter than 8000 bytes.
+    max_payload = 7_900
+
+    def __init__(self, hub: ChatHub, dsn: str, channel: str):
+        if psycopg2 is None:
+            raise RuntimeError("REALTIME_BROKER=postgres needs psycopg2.")
+        if not re.fullmatch(r"[a-z_][a-z0-9_]*", channel):
+            raise ValueError(f"'{channel}' isn't a valid channel name.")
+
+        super().__init__(hub)
+        self.dsn = dsn
+        self.channel = channel
+        self.__listener = None
+        self.__notifier = None
+
+    def __connect(self):
+        connection = psycopg2.connect(self.dsn)
+        connection.autocommit = True
+        return connection
+
+    def __listen(self):
+        self.__listener = self.__connect()
+        with self.__listener.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+
+    def open(self):
+        self.__listen()
+        self.__notifier = self.__connect()
+
+    def close(self):
+        for connection in (self.__listener, self.__notifier):
+            if connection is not None and not connection.closed:
+                connection.close()
+
+    def send(self, payload: bytes):
+        if self.__notifier.closed:
+            self.__notifier = self.__connect()
+
+        with self.__notifier.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload.decode()))
+
+    def receive(self, timeout: float) -> list[bytes]:
+        if self.__listener.closed:
+            # Notifications sent while the connection was down are lost. The notifier
+            # reconnects by itself, in send().
+            self.__listen()
+
+        if not select.select([self.__listener], [], [], timeout)[0]:
+            return []
+
+        self.__listener.poll()
+        payloads = [notify.payload.encode() for notify in self.__listener.notifies]
+        self.__listener.notifies.clear()
+        return payloads
+
+
+def create_broker(backend: str, url: str, hub: ChatHub) -> Broker:
+    if backend == "memory":
+        return InMemoryBroker(hub)
+
+    if backend == "unix":
+        return UnixSocketBroker(hub, url or os.path.join(tempfile.gettempdir(), "messenger-events"))
+
+    if backend == "postgres":
+        dsn = url or make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        return PostgresBroker(hub, dsn, REALTIME_BROKER_CHANNEL)
+
+    raise ValueError(f"Unknown broker '{backend}', expected memory, unix or postgres.")
+
+
+broker = create_broker(REALTIME_BROKER, REALTIME_BROKER_URL, chat_hub)
@@ -0,0 +1,70 @@
+from typing import Optional
+
+from sqlalchemy import insert, update, select, func, literal, true
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select, ColumnElement
+
+from ..models.change import Change
+
+ENTITIES = ("chat", "participant", "message", "user")
+COLUMNS = ["entity", "entity_id", "chat_id", "user_id", "deleted", "txid"]
+# Arbitrary key of the PostgreSQL advisory lock that serializes numbering changes.
+LOCK_KEY = 7_102_342
+SEQUENCE_BATCH_SIZE = 1000
+
+
+# Changes are numbered for /sync in the order they become visible, not the order they're
+# written: on PostgreSQL a transaction holding a lower id may commit after one holding a
+# higher id, and a client that had seen the higher one would never see the other. So rows
+# are written without a seq, tagged with the writing transaction, and sequence_changes
+# numbers them once every transaction that could still write a row before them is over,
+# i.e. those older than the oldest transaction still running. Writers never wait on each
+# other; only the numbering, done by readers of the log, is serialized. SQLite serializes
+# writers anyway, so every committed row is ready.
+def transaction_id(db: Session) -> ColumnElement:
+    if db.get_bind().dialect.name == "postgresql":
+        return func.txid_current()
+
+    return literal(0)
+
+
+def change(entity: str, id: int, chat_id: Optional[int] = None, user_id: Optional[int] = None,
+           deleted: bool = False) -> dict:
+    return {"entity": entity, "entity_id": id, "chat_id": chat_id, "user_id": user_id, "deleted": deleted}
+
+
+def record_changes(db: Session, *changes: dict):
+    if not changes:
+        return
+
+    db.execute(insert(Change).values(txid=transaction_id(db)), list(changes))
+
+
+# For changes to many rows at once (every member of a deleted chat, every participation of
+# a deleted user); rows selects the values of COLUMNS but txid.
+def record_changes_from(db: Session, rows: Select):
+    db.execute(insert(Change).from_select(COLUMNS, rows.add_columns(transaction_id(db))))
+
+
+# Numbers every change that is ready and returns the newest seq.
+def sequence_changes(db: Session, batch_size: int = SEQUENCE_BATCH_SIZE) -> int:
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(select(func.pg_advisory_xact_lock(LOCK_KEY)))
+        ready = Change.txid < func.txid_snapshot_xmin(func.txid_current_snapshot())
+    else:
+        ready = true()
+
+    newest = db.scalar(select(func.max(Change.seq))) or 0
+    while True:
+        pending = db.scalars(select(Change.id)
+                             .where(Change.seq.is_(None), ready)
+                             .order_by(Change.id)
+                             .limit(batch_size)).all()
+        if pending:
+            db.execute(update(Change), [{"id": id, "seq": newest + number} for number, id in enumerate(pending, 1)])
+            newest += len(pending)
+        if len(pending) < batch_size:
+            break
+    db.commit()
+
+    return newest
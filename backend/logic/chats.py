@@ -1,39 +1,60 @@
-from sqlalchemy.orm import Session
+from typing import Optional
+from datetime import datetime
+
+from sqlalchemy import and_, or_, select, literal, true
+from sqlalchemy.orm import Session, aliased
 from sqlalchemy.exc import NoResultFound
 
 from .exceptions import  (
-    ChatNotFoundError,
+    ChatNotFoundError, InvalidCursorError,
 )
 
-from ..models.chat import Chat
+from ..models.chat import Chat, utc_now
+from ..models.message import Message
+from ..models.participant import Participant
+from ..models.user import User
 from ..schemas.chat import ( 
     ChatSchema, ChatCreateSchema,
     ChatUpdateSchema, CreatePublicChatSchema,
-    CreatePrivateChatSchema
+    CreatePrivateChatSchema, ChatSummarySchema,
+    LastMessageSchema, InboxPageSchema,
 )
+from ..utils.utils import encode_cursor, decode_cursor
+from ..utils.cache import TTLCache, EntityCache
+from ..utils.config import ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, PURGE_INLINE_LIMIT
+from .particpants import chat_participants_cache
+from .changes import change, record_changes, record_changes_from
+from .purge import Purger, purger as chat_purger
+
+# id -> ChatSchema, read through by find_chat.
+chat_cache = EntityCache("chat", TTLCache(maxsize=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL))
 
 class ChatRepository:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, cache: EntityCache = chat_cache):
         self.db = db
+        self.cache = cache
 
     def __to_chat(self, chat_schema: ChatCreateSchema) -> Chat:
         return Chat(name=chat_schema.name, type=chat_schema.type)
     
     def __to_chat_schema(self, chat: Chat) -> ChatSchema:
-        return ChatSchema(id=chat.id, name=chat.name, 
-                          type=chat.type, created_at=chat.created_at,
-                          updated_at=chat.updated_at)
+        return ChatSchema.model_validate(chat)
     
     def add_chat(self, create_schema: ChatCreateSchema) -> ChatSchema:
         chat = self.__to_chat(create_schema)
         
         self.db.add(chat)
+        self.db.flush()
+        record_changes(self.db, change("chat", chat.id, chat_id=chat.id))
         self.db.commit()
 
         return self.__to_chat_schema(chat)
     
     def find_chat(self, id: int) -> ChatSchema:
-        chat = self.db.query(Chat).filter(Chat.id == id).first()
+        return self.cache.get_or_load(id, lambda: self.__load_chat(id))
+
+    def __load_chat(self, id: int) -> ChatSchema:
+        chat = self.db.query(Chat).filter(Chat.id == id, Chat.deleted_at.is_(None)).first()
 
         if chat is None:
             raise NoResultFound()
@@ -41,15 +62,53 @@ class ChatRepository:
         return self.__to_chat_schema(chat)
     
     def find_chats_by_name(self, name: str) -> list[ChatSchema]:
-        chats = self.db.query(Chat).filter(Chat.name == name)
+        chats = self.db.query(Chat).filter(Chat.name == name, Chat.deleted_at.is_(None))
 
         if chats is [] or chats is None:
             raise NoResultFound()
 
         return [self.__to_chat_schema(chat) for chat in chats]
     
+    def find_user_chats(self, user_id: int, limit: int,
+                        after: Optional[tuple[datetime, int]] = None) -> list[ChatSummarySchema]:
+        # One query per page however many chats the user is in: the membership row,
+        # the chat's denormalized summary and its last message with the sender's name.
+        sender = aliased(Participant)
+        chats = (self.db.query(Chat, Participant, Message, User)
+                 .join(Participant, and_(Participant.chat_id == Chat.id, Participant.user_id == user_id))
+                 .outerjoin(Message, Message.id == Chat.last_message_id)
+                 .outerjoin(sender, sender.id == Message.sender_id)
+                 .outerjoin(User, User.id == sender.user_id)
+                 .filter(Chat.deleted_at.is_(None)))
+
+        if after is not None:
+            activity, chat_id = after
+            chats = chats.filter(or_(Chat.last_activity_at < activity,
+                                     and_(Chat.last_activity_at == activity, Chat.id < chat_id)))
+
+        chats = chats.order_by(Chat.last_activity_at.desc(), Chat.id.desc()).limit(limit)
+
+        return [self.__to_chat_summary_schema(chat, participant, message, sender_user)
+                for chat, participant, message, sender_user in chats]
+
+    def __to_chat_summary_schema(self, chat: Chat, participant: Participant,
+                                 message: Optional[Message], sender_user) -> ChatSummarySchema:
+        last_message = None
+        if message is not None:
+            last_message = LastMessageSchema(id=message.id, sender_id=message.sender_id, chat_id=message.chat_id,
+                                             text=message.text, created_at=message.created_at,
+                                             sender_user_id=sender_user.id if sender_user else None,
+                                             sender_name=sender_user.name if sender_user else None)
+
+        return ChatSummarySchema(id=chat.id, name=chat.name, type=chat.type,
+                                 created_at=chat.created_at, updated_at=chat.updated_at,
+                                 last_activity_at=chat.last_activity_at, member_count=chat.member_count,
+                                 unread_count=participant.unread_count,
+                                 last_read_message_id=participant.last_read_message_id,
+                                 last_message=last_message)
+
     def update_chat(self, id: int, update_schema: ChatUpdateSchema) -> ChatSchema:
-        chat = self.db.query(Chat).filter(Chat.id == id).first()
+        chat = self.db.query(Chat).filter(Chat.id == id, Chat.deleted_at.is_(None)).first()
 
         if chat is None:
             raise NoResultFound()
@@ -58,54 +117,91 @@ class ChatRepository:
         chat.type = update_schema.type if update_schema.type else chat.type
 
         self.db.merge(chat)
+        record_changes(self.db, change("chat", id, chat_id=id))
         self.db.commit()
+        self.cache.invalidate(id)
 
         return self.__to_chat_schema(chat)
     
-    def delete_chat(self, id: int) -> ChatSchema:
-        chat = self.db.query(Chat).filter(Chat.id == id).first()
+    def delete_chat(self, id: int, inline_limit: int = PURGE_INLINE_LIMIT) -> ChatSchema:
+        chat = self.db.query(Chat).filter(Chat.id == id, Chat.deleted_at.is_(None)).first()
 
         if chat is None:
             raise NoResultFound()   
 
-        self.db.delete(chat)
+        deleted_chat = self.__to_chat_schema(chat)
+        # One row per member: the chat leaves their syncs along with their membership.
+        record_changes_from(self.db, select(literal("chat"), literal(id), literal(id), Participant.user_id, true())
+                                     .where(Participant.chat_id == id))
+
+        # Participants and messages go through ON DELETE CASCADE. A chat with a long history
+        # is only marked here and purged in batches by the background job.
+        if self.db.query(Message.id).filter(Message.chat_id == id).offset(inline_limit).first() is not None:
+            chat.deleted_at = utc_now()
+        else:
+            self.db.delete(chat)
         self.db.commit()
+        self.cache.invalidate(id)
+        chat_participants_cache.invalidate(id)
 
-        return self.__to_chat_schema(chat)
+        return deleted_chat
     
 
 class ChatService:
-    def __init__(self, repository: ChatRepository):
+    def __init__(self, repository: ChatRepository, purger: Purger = chat_purger):
         self.repository = repository
+        self.purger = purger
 
-    def add_chat(self, chat_data: ChatCreateSchema) -> ChatSchema:
+    async def add_chat(self, chat_data: ChatCreateSchema) -> ChatSchema:
         chat_data.name = chat_data.name if chat_data.name else "Chat Name"
-        return self.repository.add_chat(chat_data)
+        return await self.repository.add_chat(chat_data)
 
-    def get_chat(self, id: int) -> ChatSchema:
+    async def get_chat(self, id: int) -> ChatSchema:
         try:
-            return self.repository.find_chat(id)
+            return await self.repository.find_chat(id)
         
         except NoResultFound:
             raise ChatNotFoundError()
         
-    def get_chats_by_name(self, name: str) -> list[ChatSchema]:
+    async def get_chats_by_name(self, name: str) -> list[ChatSchema]:
         try:
-            return self.repository.find_chats_by_name(name)
+            return await self.repository.find_chats_by_name(name)
         
         except NoResultFound:
             raise ChatNotFoundError(message=f"No chats under the name '{name}'.")
     
-    def update_chat(self, id: int, chat_data: ChatUpdateSchema) -> ChatSchema:
+    async def get_inbox(self, user_id: int, limit: int, cursor: Optional[str] = None) -> InboxPageSchema:
+        try:
+            after = None
+            if cursor:
+                activity, chat_id = decode_cursor(cursor, str, int)
+                after = (datetime.fromisoformat(activity), chat_id)
+        except (ValueError, TypeError):
+            raise InvalidCursorError()
+
+        chats = await self.repository.find_user_chats(user_id, limit + 1, after)
+        has_more = len(chats) > limit
+        chats = chats[:limit]
+
+        if not has_more:
+            return InboxPageSchema(chats=chats)
+
+        return InboxPageSchema(chats=chats,
+                               next_cursor=encode_cursor(chats[-1].last_activity_at.isoformat(), chats[-1].id))
+
+    async def update_chat(self, id: int, chat_data: ChatUpdateSchema) -> ChatSchema:
         try:
-            return self.repository.update_chat(id, chat_data)
+            return await self.repository.update_chat(id, chat_data)
         
         except NoResultFound:
             raise ChatNotFoundError()
         
-    def delete_chat(self, id: int):
+    async def delete_chat(self, id: int):
         try:
-            return self.repository.delete_chat(id)
+            deleted_chat = await self.repository.delete_chat(id)
         
         except NoResultFound:
-            raise ChatNotFoundError()
\ No newline at end of file
+            raise ChatNotFoundError()
+
+        self.purger.wake()
+        return deleted_chat
\ No newline at end of file
@@ -0,0 +1,126 @@
+import asyncio
+from typing import AsyncIterator, Optional
+
+from sqlalchemy.exc import NoResultFound
+
+from .exceptions import InvalidCursorError
+from .realtime import ChatHub, Connection, hub as chat_hub
+from .messages import MessageRepository
+from .particpants import ParticipantRepository
+from .sync import SyncRepository
+from ..database import AsyncRepository, session_scope
+from ..schemas.message import MessageSchema
+from ..schemas.event import EventSchema, EventPageSchema
+from ..utils.utils import encode_cursor, decode_cursor
+from ..utils.config import EVENTS_BATCH_LIMIT, EVENTS_KEEPALIVE
+
+
+# New and edited messages in the caller's chats for clients that can't hold a WebSocket.
+# The cursor is the change-log seq (see logic/changes.py) of the last message handed out,
+# so it follows the order messages became visible, not the order their ids were handed
+# out. While it waits, a request is only a hub subscriber: it holds no session and no
+# thread. Any hub event in the user's chats (from this worker or, through the broker,
+# another one) just wakes it up to read the changes after its cursor again. On PostgreSQL
+# a change is numbered only once every older transaction is over; one still held back
+# then is read on the next wake-up or keep-alive.
+class EventService:
+    def __init__(self, hub: ChatHub = chat_hub, limit: int = EVENTS_BATCH_LIMIT):
+        self.hub = hub
+        self.limit = limit
+
+    @staticmethod
+    def __decode(cursor: str) -> int:
+        try:
+            return decode_cursor(cursor, int)[0]
+        except ValueError:
+            raise InvalidCursorError()
+
+    def __page(self, messages: list[tuple[int, MessageSchema]], after_seq: int) -> EventPageSchema:
+        return EventPageSchema(events=[EventSchema(message=message) for _, message in messages],
+                               cursor=encode_cursor(messages[-1][0] if messages else after_seq))
+
+    async def __open(self, user_id: int,
+                     after_seq: Optional[int]) -> tuple[Connection, int, list[tuple[int, MessageSchema]]]:
+        # Subscribed before reading, so a message committed in between still wakes us up.
+        async with session_scope() as db:
+            try:
+                participations = await AsyncRepository(db, ParticipantRepository).find_user_participations(user_id)
+            except NoResultFound:
+                participations = []
+
+            connection = self.hub.connect(None, user_id, [participation.chat_id for participation in participations])
+
+            try:
+                if after_seq is None:
+                    # A client without a cursor starts from now.
+                    return connection, await AsyncRepository(db, SyncRepository).sequence_changes(), []
+
+                messages = await AsyncRepository(db, MessageRepository).find_user_messages(user_id, after_seq,
+                                                                                           self.limit)
+                return connection, after_seq, messages
+            except BaseException:
+                self.hub.disconnect(connection)
+                raise
+
+    async def __fetch(self, user_id: int, after_seq: int) -> list[tuple[int, MessageSchema]]:
+        async with session_scope() as db:
+            return await AsyncRepository(db, MessageRepository).find_user_messages(user_id, after_seq, self.limit)
+    @staticmethod
+    async def __wait(connection: Connection, timeout: float) -> bool:
+        # True when there may be something new: an event arrived, or the hub dropped this
+        # subscriber for falling behind (overflow policy "disconnect") and it will hear
+        # nothing more, which the caller sees in connection.kicked after reading once more.
+        waiters = [asyncio.ensure_future(connection.queue.get()), asyncio.ensure_future(connection.kicked.wait())]
+        done, pending = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in pending:
+            waiter.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        while not connection.queue.empty():
+            connection.queue.get_nowait()
+        return bool(done)
+
+    async def poll(self, user_id: int, cursor: Optional[str], timeout: float) -> EventPageSchema:
+        after_seq = self.__decode(cursor) if cursor else None
+        if after_seq is None:
+            timeout = 0
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        connection, after_seq, messages = await self.__open(user_id, after_seq)
+
+        try:
+            while not messages and not connection.kicked.is_set():
+                remaining = deadline - loop.time()
+                if remaining <= 0 or not await self.__wait(connection, remaining):
+                    break
+                messages = await self.__fetch(user_id, after_seq)
+        finally:
+            self.hub.disconnect(connection)
+
+        return self.__page(messages, after_seq)
+
+    def stream(self, user_id: int, cursor: Optional[str], keepalive: float = EVENTS_KEEPALIVE) -> AsyncIterator[str]:
+        # The cursor is checked here, before the response starts, so a bad one is still a 400.
+        return self.__stream(user_id, self.__decode(cursor) if cursor else None, keepalive)
+
+    async def __stream(self, user_id: int, after_seq: Optional[int], keepalive: float) -> AsyncIterator[str]:
+        connection, after_seq, messages = await self.__open(user_id, after_seq)
+
+        try:
+            while True:
+                for after_seq, message in messages:
+                    yield (f"id: {encode_cursor(after_seq)}\nevent: message\n"
+                           f"data: {EventSchema(message=message).model_dump_json()}\n\n")
+
+                if connection.kicked.is_set():
+                    # The client reconnects with Last-Event-ID and resumes from there.
+                    return
+
+                # A full batch means more are waiting already.
+                if len(messages) < self.limit and not await self.__wait(connection, keepalive):
+                    yield ": keep-alive\n\n"
+
+                messages = await self.__fetch(user_id, after_seq)
+        finally:
+            self.hub.disconnect(connection)
@@ -15,11 +15,21 @@ class InvalidEmailError(AppError):
         super().__init__(message, error_code)
 
 
+class ServerBusyError(AppError):
+    def __init__(self, message: str = "Server is busy, try again later.", error_code: int = 503):
+        super().__init__(message, error_code)
+
+
 class UserAlreadyRegisteredError(AppError):
     def __init__(self, message: str = "Such e-mail has already been registered.", error_code: int = 400):
         super().__init__(message, error_code)
 
 
+class InvalidTokenError(AppError):
+    def __init__(self, message: str = "Invalid/Corrupted Token.", error_code: int = 401):
+        super().__init__(message, error_code)
+
+
 class UserNotFoundError(AppError):
     def __init__(self, message: str = "User not found.", error_code: int = 404):
         super().__init__(message, error_code)
@@ -41,4 +51,29 @@ class ParticipantAlreadyExistsError(AppError):
 
 class MessageNotFoundError(AppError):
     def __init__(self, message: str = "Message not found.", error_code: int = 400):
-        super().__init__(message, error_code)
\ No newline at end of file
+        super().__init__(message, error_code)
+
+
+class BatchTooLargeError(AppError):
+    def __init__(self, message: str = "Batch is too large.", error_code: int = 413):
+        super().__init__(message, error_code)
+
+
+class InvalidCursorError(AppError):
+    def __init__(self, message: str = "Pagination cursor is invalid.", error_code: int = 400):
+        super().__init__(message, error_code)
+
+
+class AttachmentNotFoundError(AppError):
+    def __init__(self, message: str = "Attachment not found.", error_code: int = 404):
+        super().__init__(message, error_code)
+
+
+class AttachmentTooLargeError(AppError):
+    def __init__(self, message: str = "Attachment is too large.", error_code: int = 413):
+        super().__init__(message, error_code)
+
+
+class ForbiddenError(AppError):
+    def __init__(self, message: str = "You aren't allowed to do this.", error_code: int = 403):
+        super().__init__(message, error_code)
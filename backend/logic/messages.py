@@ -1,34 +1,152 @@
+import re
+import asyncio
+import logging
+from typing import Any, Optional
+from collections import Counter, defaultdict
+
+import hashlib
+from sqlalchemy import func, literal_column, table, column, and_, or_, insert, update, case, select, bindparam, text
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import NoResultFound
 
 from .exceptions import (
-    MessageNotFoundError,   
+    MessageNotFoundError, ParticipantNotFoundError,
+    InvalidCursorError, BatchTooLargeError, ForbiddenError,
 ) 
+from .broker import Broker, broker as chat_broker
+from .particpants import chat_participants_cache
+from .changes import change, record_changes, sequence_changes
+from ..database import AsyncRepository, session_scope, dialect_insert
 
-from ..models.message import Message
+from ..models.message import Message, MessageDictionary, SEARCH_REBUILD
+from ..models.change import Change
+from ..models.participant import Participant
+from ..models.chat import Chat, utc_now
+from ..models.user import User
 from ..schemas.message import (
     MessageSchema, MessageCreateSchema,
-    MessageUpdateSchema,
+    MessageUpdateSchema, MessagePageSchema,
+    MessageSearchPageSchema, MessageBatchResultSchema,
+)
+from ..utils.utils import encode_cursor, decode_cursor
+from ..utils.cache import EntityCache
+from ..utils.compression import TextCodec, message_codec
+from ..utils.config import (
+    SEARCH_LANGUAGE, MESSAGE_BATCH_MAX_SIZE, MESSAGE_GROUP_COMMIT,
+    MESSAGE_GROUP_COMMIT_DELAY_MS, MESSAGE_GROUP_COMMIT_SIZE,
+    MESSAGE_COMPRESSION_DICTIONARY,
 )
 
+logger = logging.getLogger("messenger.messages")
+
+messages_fts = table("messages_fts", column("rowid"))
+messages_search = table("messages", column("id"), column("search_vector"))
+
 class MessageRepository:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, participants_cache: EntityCache = chat_participants_cache):
         self.db = db
+        self.participants_cache = participants_cache
 
-    def __to_message(self, create_schema: MessageCreateSchema) -> Message:
-        return Message(**create_schema.model_dump())
+    def __to_message(self, create_schema: MessageCreateSchema, chat_id: int) -> Message:
+        return Message(**create_schema.model_dump(), chat_id=chat_id)
     
     def __to_message_schema(self, message: Message) -> MessageSchema:
-        return MessageSchema(id=message.id, sender_id=message.sender_id, text=message.text)
+        return MessageSchema.model_validate(message)
     
     def add_message(self, create_schema: MessageCreateSchema) -> MessageSchema:
-        message = self.__to_message(create_schema)
+        chat_id = (self.db.query(Participant.chat_id)
+                   .join(Chat, and_(Chat.id == Participant.chat_id, Chat.deleted_at.is_(None)))
+                   .join(User, and_(User.id == Participant.user_id, User.deleted_at.is_(None)))
+                   .filter(Participant.id == create_schema.sender_id).scalar())
+
+        if chat_id is None:
+            raise NoResultFound()
+
+        message = self.__to_message(create_schema, chat_id)
 
         self.db.add(message)
+        self.db.flush()
+        self.__index_compressed([message])
+        self.__count_unread({chat_id: Counter([create_schema.sender_id])})
+        self.__record_activity({chat_id: message.id})
+        record_changes(self.db, change("message", message.id, chat_id=chat_id))
         self.db.commit()
+        self.participants_cache.invalidate(chat_id)
 
         return self.__to_message_schema(message)
     
+    def __index_compressed(self, messages: list[Message]):
+        # PostgreSQL's search vector trigger only sees the text column, which is empty for
+        # compressed bodies, so their vector is written here. SQLite's triggers decompress.
+        rows = [{"message_id": message.id, "body": message.text}
+                for message in messages if message.text_encoding is not None]
+        if not rows or self.db.get_bind().dialect.name != "postgresql":
+            return
+
+        self.db.execute(update(messages_search)
+                        .where(messages_search.c.id == bindparam("message_id"))
+                        .values(search_vector=func.to_tsvector(SEARCH_LANGUAGE, bindparam("body"))),
+                        rows)
+
+    def __count_unread(self, chat_senders: dict[int, Counter]):
+        # One UPDATE per chat, inside the caller's transaction: every participant gains
+        # the chat's new messages minus the ones they sent themselves. Being relative
+        # (unread_count + n), concurrent sends never overwrite each other's increments.
+        for chat_id, senders in chat_senders.items():
+            own = case(dict(senders), value=Participant.id, else_=0)
+            (self.db.query(Participant)
+             .filter(Participant.chat_id == chat_id)
+             .update({Participant.unread_count: Participant.unread_count + senders.total() - own},
+                     synchronize_session=False))
+
+    def __record_activity(self, last_message_ids: dict[int, int]):
+        # The guard keeps a slower, older insert from moving last_message_id backwards.
+        # updated_at is pinned because it tracks edits of the chat itself.
+        for chat_id, message_id in last_message_ids.items():
+            (self.db.query(Chat)
+             .filter(Chat.id == chat_id, func.coalesce(Chat.last_message_id, 0) < message_id)
+             .update({Chat.last_message_id: message_id, Chat.last_activity_at: utc_now(),
+                      Chat.updated_at: Chat.updated_at}, synchronize_session=False))
+
+    def find_sender_chats(self, sender_ids: set[int]) -> dict[int, int]:
+        # Senders of deleted chats or deleted users are left out, as if they were gone already.
+        senders = (self.db.query(Participant.id, Participant.chat_id)
+                   .join(Chat, and_(Chat.id == Participant.chat_id, Chat.deleted_at.is_(None)))
+                   .join(User, and_(User.id == Participant.user_id, User.deleted_at.is_(None)))
+                   .filter(Participant.id.in_(sender_ids)))
+        return {sender_id: chat_id for sender_id, chat_id in senders}
+
+    def add_messages(self, create_schemas: list[MessageCreateSchema],
+                     sender_chats: dict[int, int]) -> list[MessageSchema]:
+        rows = [{"sender_id": create_schema.sender_id, "chat_id": sender_chats[create_schema.sender_id],
+                 **Message.encode_text(create_schema.text)}
+                for create_schema in create_schemas]
+
+        # Sent as multi-row INSERT ... RETURNING in one transaction. Ids are handed out in
+        # VALUES order, so sorting by id restores parameter order; asking SQLAlchemy for
+        # sort_by_parameter_order instead makes SQLite fall back to one INSERT per row.
+        # Schemas are built before the commit expires the returned objects.
+        inserted = self.db.scalars(insert(Message).returning(Message), rows).all()
+        self.__index_compressed(inserted)
+        messages = sorted((self.__to_message_schema(message) for message in inserted),
+                          key=lambda message: message.id)
+
+        chat_senders = defaultdict(Counter)
+        last_message_ids = {}
+        for message in messages:
+            chat_senders[message.chat_id][message.sender_id] += 1
+            last_message_ids[message.chat_id] = message.id
+        self.__count_unread(chat_senders)
+        self.__record_activity(last_message_ids)
+        record_changes(self.db, *(change("message", message.id, chat_id=message.chat_id) for message in messages))
+
+        self.db.commit()
+        # Unread counts are part of the cached participant lists.
+        for chat_id in chat_senders:
+            self.participants_cache.invalidate(chat_id)
+
+        return messages
+
     def find_message(self, id: int) -> MessageSchema:
         message = self.db.query(Message).filter(Message.id == id).first()
 
@@ -37,22 +155,96 @@ class MessageRepository:
         
         return self.__to_message_schema(message)
     
-    def find_message_by_text(self, text: str) -> MessageSchema:
-        message = self.db.query(Message).filter(Message.text.contains(text)).first()
+    def find_chat_messages(self, chat_id: int, limit: int,
+                           before_id: Optional[int] = None,
+                           after_id: Optional[int] = None,
+                           user_id: Optional[int] = None) -> list[MessageSchema]:
+        messages = (self.db.query(Message)
+                    .join(Chat, and_(Chat.id == Message.chat_id, Chat.deleted_at.is_(None)))
+                    .filter(Message.chat_id == chat_id))
 
-        if message is None:
-            raise NoResultFound()
-        
-        return self.__to_message_schema(message)
+        # Nothing for a user who isn't in the chat.
+        if user_id is not None:
+            messages = messages.join(Participant, and_(Participant.chat_id == chat_id, Participant.user_id == user_id))
 
-    def find_messages_by_text(self, text: str) -> list[MessageSchema]:
-        messages = self.db.query(Message).filter(text in Message.text)
+        if after_id is not None:
+            messages = messages.filter(Message.id > after_id).order_by(Message.id.asc())
+        else:
+            if before_id is not None:
+                messages = messages.filter(Message.id < before_id)
+            messages = messages.order_by(Message.id.desc())
 
-        if messages.count() == 0 or messages is None:
-            raise NoResultFound()
-        
         return [self.__to_message_schema(message)
-                for message in messages]
+                for message in messages.limit(limit)]
+    
+    def is_chat_member(self, user_id: int, chat_id: int) -> bool:
+        participation = (self.db.query(Participant.id)
+                         .join(Chat, and_(Chat.id == Participant.chat_id, Chat.deleted_at.is_(None)))
+                         .filter(Participant.user_id == user_id, Participant.chat_id == chat_id)
+                         .first())
+
+        return participation is not None
+
+    # The messages sent or edited after the change seq after_seq in the user's live chats,
+    # each once, in its latest state, with the seq of its latest change.
+    def find_user_messages(self, user_id: int, after_seq: int, limit: int) -> list[tuple[int, MessageSchema]]:
+        sequence_changes(self.db)
+        chat_ids = (select(Participant.chat_id)
+                    .join(Chat, and_(Chat.id == Participant.chat_id, Chat.deleted_at.is_(None)))
+                    .where(Participant.user_id == user_id))
+        latest = (select(Change.entity_id, func.max(Change.seq).label("seq"))
+                  .where(Change.entity == "message", Change.seq > after_seq, Change.chat_id.in_(chat_ids))
+                  .group_by(Change.entity_id)
+                  .subquery())
+        rows = (self.db.query(latest.c.seq, Message)
+                .join(Message, Message.id == latest.c.entity_id)
+                .order_by(latest.c.seq.asc())
+                .limit(limit))
+
+        return [(seq, self.__to_message_schema(message)) for seq, message in rows]
+
+    def rebuild_search_index(self):
+        for statement in SEARCH_REBUILD.get(self.db.get_bind().dialect.name, []):
+            self.db.execute(text(statement))
+        self.db.commit()
+
+    def __match_and_rank(self, text: str):
+        # Both branches produce a rank where lower is better, like SQLite's bm25().
+        if self.db.get_bind().dialect.name == "postgresql":
+            query = func.plainto_tsquery(SEARCH_LANGUAGE, text)
+            search_vector = literal_column("messages.search_vector")
+            return search_vector.op("@@")(query), -func.ts_rank_cd(search_vector, query)
+
+        # Quote every word so user input can't use FTS5 query syntax; '*' makes it a prefix match.
+        words = re.findall(r"\w+", text)
+        query = " ".join(f'"{word}"*' for word in words)
+        return literal_column("messages_fts").op("MATCH")(query), func.bm25(literal_column("messages_fts"))
+
+    def search_messages(self, user_id: int, text: str, limit: int,
+                        after: Optional[tuple[float, int]] = None) -> list[tuple[MessageSchema, float]]:
+        if not re.search(r"\w", text):
+            return []
+
+        match, rank = self.__match_and_rank(text)
+        rank = rank.label("rank")
+
+        messages = (self.db.query(Message, rank)
+                    .join(Participant, and_(Participant.chat_id == Message.chat_id,
+                                            Participant.user_id == user_id))
+                    .join(Chat, and_(Chat.id == Message.chat_id, Chat.deleted_at.is_(None)))
+                    .filter(match))
+
+        if self.db.get_bind().dialect.name != "postgresql":
+            messages = messages.join(messages_fts, messages_fts.c.rowid == Message.id)
+
+        if after is not None:
+            after_rank, after_id = after
+            messages = messages.filter(or_(rank > after_rank, and_(rank == after_rank, Message.id < after_id)))
+
+        messages = messages.order_by(rank.asc(), Message.id.desc()).limit(limit)
+
+        return [(self.__to_message_schema(message), message_rank)
+                for message, message_rank in messages]
     
     def update_message(self, id: int, update_schema: MessageUpdateSchema) -> MessageSchema:
         message = self.db.query(Message).filter(Message.id == id).first()
@@ -60,9 +252,13 @@ class MessageRepository:
         if message is None:
             raise NoResultFound()
         
-        message.text = update_schema.text if update_schema.text else message.text
+        if update_schema.text:
+            message.text = update_schema.text
 
         self.db.merge(message)
+        self.db.flush()
+        self.__index_compressed([message])
+        record_changes(self.db, change("message", id, chat_id=message.chat_id))
         self.db.commit()
 
         return self.__to_message_schema(message)
@@ -74,46 +270,262 @@ class MessageRepository:
         if message is None:
             raise NoResultFound()
         
+        # Whoever hadn't read up to this message has one unread message less.
+        (self.db.query(Participant)
+         .filter(Participant.chat_id == message.chat_id,
+                 Participant.id != message.sender_id,
+                 func.coalesce(Participant.last_read_message_id, 0) < message.id,
+                 Participant.unread_count > 0)
+         .update({Participant.unread_count: Participant.unread_count - 1}, synchronize_session=False))
+
+        previous_id = (select(func.max(Message.id))
+                       .where(Message.chat_id == message.chat_id, Message.id != message.id)
+                       .scalar_subquery())
+        (self.db.query(Chat)
+         .filter(Chat.id == message.chat_id, Chat.last_message_id == message.id)
+         .update({Chat.last_message_id: previous_id, Chat.updated_at: Chat.updated_at}, synchronize_session=False))
+
         self.db.delete(message)
+        record_changes(self.db, change("message", id, chat_id=message.chat_id, deleted=True))
         self.db.commit()
+        self.participants_cache.invalidate(message.chat_id)
 
         return self.__to_message_schema(message)
+
+    def add_dictionary(self, encoding: str, data: bytes) -> int:
+        sha256 = hashlib.sha256(data).hexdigest()
+        self.db.execute(dialect_insert(self.db, MessageDictionary)
+                        .values(encoding=encoding, sha256=sha256, data=data)
+                        .on_conflict_do_nothing(index_elements=[MessageDictionary.sha256]))
+        self.db.commit()
+
+        return self.db.query(MessageDictionary.id).filter(MessageDictionary.sha256 == sha256).scalar()
+
+    def find_dictionaries(self) -> list[tuple[int, bytes]]:
+        return [(id, data) for id, data in self.db.query(MessageDictionary.id, MessageDictionary.data)]
+
+
+# Makes every registered dictionary readable and, with MESSAGE_COMPRESSION_DICTIONARY set,
+# registers that file and compresses new bodies with it. Runs at startup, after migrations.
+def load_message_dictionaries(db: Session, path: str = MESSAGE_COMPRESSION_DICTIONARY,
+                              codec: TextCodec = message_codec):
+    repository = MessageRepository(db)
+    active_id = None
+
+    if path and codec.encoding != "none":
+        with open(path, "rb") as file:
+            active_id = repository.add_dictionary(codec.encoding, file.read())
+
+    for id, data in repository.find_dictionaries():
+        codec.add_dictionary(id, data, active=id == active_id)
+    logger.info("loaded %d message dictionaries, compressing with %s", len(codec.dictionaries), active_id)
     
 
+# Group commit for single sends. Messages sent on one event loop within `delay` seconds of
+# the first (or until max_size are waiting) are written by one add_messages call: one
+# transaction and one commit for the whole group, while every sender still awaits its
+# own message or error. If the group's transaction fails, its messages are retried one
+# at a time, so a message that can't be stored only fails its own request.
+class MessageCommitter:
+    def __init__(self, delay: float = MESSAGE_GROUP_COMMIT_DELAY_MS / 1000,
+                 max_size: int = MESSAGE_GROUP_COMMIT_SIZE):
+        self.delay = delay
+        self.max_size = max_size
+        self.counters = Counter(messages=0, groups=0, retried=0)
+        self.__pending: list[tuple[MessageCreateSchema, asyncio.Future]] = []
+        self.__timer: Optional[asyncio.TimerHandle] = None
+        self.__commits: set[asyncio.Task] = set()
+
+    async def add_message(self, create_schema: MessageCreateSchema) -> MessageSchema:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.__pending.append((create_schema, future))
+
+        if len(self.__pending) >= self.max_size:
+            self.__flush()
+        elif self.__timer is None:
+            self.__timer = loop.call_later(self.delay, self.__flush)
+
+        return await future
+
+    def __flush(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+        group, self.__pending = self.__pending, []
+        # Held until done: the loop only keeps weak references to tasks.
+        commit = asyncio.get_running_loop().create_task(self.__commit(group))
+        self.__commits.add(commit)
+        commit.add_done_callback(self.__commits.discard)
+
+    @staticmethod
+    def __settle(future: asyncio.Future, result: Any = None, error: Optional[BaseException] = None):
+        # A sender that went away (cancelled request) gets nothing; its message stays sent.
+        if future.done():
+            return
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def __commit(self, group: list[tuple[MessageCreateSchema, asyncio.Future]]):
+        self.counters["groups"] += 1
+        self.counters["messages"] += len(group)
+
+        try:
+            async with session_scope() as db:
+                repository = AsyncRepository(db, MessageRepository)
+                sender_chats = await repository.find_sender_chats({data.sender_id for data, _ in group})
+                known = [(data, future) for data, future in group if data.sender_id in sender_chats]
+                messages = await repository.add_messages([data for data, _ in known], sender_chats) if known else []
+        except Exception:
+            logger.warning("group of %d messages failed, retrying them one by one", len(group), exc_info=True)
+            self.counters["retried"] += len(group)
+            for data, future in group:
+                await self.__commit_one(data, future)
+            return
+
+        for data, future in group:
+            if data.sender_id not in sender_chats:
+                self.__settle(future, error=NoResultFound())
+        for (_, future), message in zip(known, messages):
+            self.__settle(future, message)
+
+    async def __commit_one(self, create_schema: MessageCreateSchema, future: asyncio.Future):
+        try:
+            async with session_scope() as db:
+                message = await AsyncRepository(db, MessageRepository).add_message(create_schema)
+        except Exception as error:
+            self.__settle(future, error=error)
+        else:
+            self.__settle(future, message)
+
+    def stats(self) -> dict[str, Any]:
+        groups = self.counters["groups"]
+        return {
+            **self.counters,
+            "average_group": round(self.counters["messages"] / groups, 2) if groups else 0,
+            "pending": len(self.__pending),
+            "delay_ms": self.delay * 1000,
+            "max_size": self.max_size,
+        }
+
+
+message_committer = MessageCommitter() if MESSAGE_GROUP_COMMIT else None
+
+
 class MessageService:
-    def __init__(self, repository: MessageRepository):
+    def __init__(self, repository: MessageRepository, broker: Broker = chat_broker,
+                 committer: Optional[MessageCommitter] = message_committer):
         self.repository = repository
+        self.broker = broker
+        self.committer = committer
 
-    def add_message(self, message_data: MessageCreateSchema) -> MessageSchema:
-        return self.repository.add_message(message_data)
+    async def add_message(self, message_data: MessageCreateSchema) -> MessageSchema:
+        try:
+            if self.committer is not None:
+                message = await self.committer.add_message(message_data)
+            else:
+                message = await self.repository.add_message(message_data)
+        except NoResultFound:
+            raise ParticipantNotFoundError("Sender isn't a participant of any chat.")
+
+        self.broker.publish(message.chat_id, {"type": "message", "message": message.model_dump(mode="json")})
+        return message
     
-    def get_message(self, id: int) -> MessageSchema:
+    async def add_messages(self, messages_data: list[MessageCreateSchema],
+                           max_size: int = MESSAGE_BATCH_MAX_SIZE) -> MessageBatchResultSchema:
+        if len(messages_data) > max_size:
+            raise BatchTooLargeError(f"Batch holds {len(messages_data)} messages, the limit is {max_size}.")
+
+        if not messages_data:
+            return MessageBatchResultSchema(ids=[])
+
+        sender_chats = await self.repository.find_sender_chats({message.sender_id for message in messages_data})
+        unknown_senders = {message.sender_id for message in messages_data} - sender_chats.keys()
+
+        if unknown_senders:
+            raise ParticipantNotFoundError(f"Unknown sender ids: {sorted(unknown_senders)}.")
+
+        messages = await self.repository.add_messages(messages_data, sender_chats)
+
+        for message in messages:
+            self.broker.publish(message.chat_id, {"type": "message", "message": message.model_dump(mode="json")})
+
+        return MessageBatchResultSchema(ids=[message.id for message in messages])
+
+    async def get_message(self, id: int) -> MessageSchema:
         try:
-            return self.repository.find_message(id)
+            return await self.repository.find_message(id)
         except:
             raise MessageNotFoundError()
         
-    def get_message_by_text(self, text: str) -> MessageSchema:
+    async def get_chat_history(self, user_id: int, chat_id: int, limit: int,
+                               before: Optional[str] = None,
+                               after: Optional[str] = None) -> MessagePageSchema:
+        if before and after:
+            raise InvalidCursorError("Pass either 'before' or 'after', not both.")
+
         try:
-            return self.repository.find_message_by_text(text)
-        except:
-            raise MessageNotFoundError()
+            before_id = decode_cursor(before, int)[0] if before else None
+            after_id = decode_cursor(after, int)[0] if after else None
+        except ValueError:
+            raise InvalidCursorError()
+
+        # One extra row tells whether there is another page in the direction we're seeking.
+        # The page only has the chat's messages for its participants; only when it's empty
+        # does it take another look to tell an outsider from the end of the history.
+        messages = await self.repository.find_chat_messages(chat_id, limit + 1, before_id, after_id, user_id)
+        if not messages and not await self.repository.is_chat_member(user_id, chat_id):
+            raise ForbiddenError("Only the chat's participants can read its messages.")
+
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+
+        if after_id is None:
+            messages.reverse()
+            has_older = has_more
+        else:
+            has_older = True
+
+        if not messages:
+            return MessagePageSchema(messages=[], next_cursor=after)
+
+        return MessagePageSchema(
+            messages=messages,
+            prev_cursor=encode_cursor(messages[0].id) if has_older else None,
+            next_cursor=encode_cursor(messages[-1].id),
+        )
         
-    def get_messages_by_text(self, text: str) -> list[MessageSchema]:
+    async def search_messages(self, user_id: int, text: str, limit: int,
+                              cursor: Optional[str] = None) -> MessageSearchPageSchema:
         try:
-            return self.repository.find_messages_by_text(text)
-        except:
-            raise MessageNotFoundError()
+            after = tuple(decode_cursor(cursor, (int, float), int)) if cursor else None
+        except ValueError:
+            raise InvalidCursorError()
+
+        results = await self.repository.search_messages(user_id, text, limit + 1, after)
+        has_more = len(results) > limit
+        results = results[:limit]
+
+        if not has_more:
+            return MessageSearchPageSchema(messages=[message for message, _ in results])
+
+        last_message, last_rank = results[-1]
+        return MessageSearchPageSchema(messages=[message for message, _ in results],
+                                       next_cursor=encode_cursor(last_rank, last_message.id))
         
-    def edit_message(self, id: int, edit_data: MessageUpdateSchema) -> MessageSchema:
+    async def edit_message(self, id: int, edit_data: MessageUpdateSchema) -> MessageSchema:
         try:
-            return self.repository.update_message(id, edit_data)
+            return await self.repository.update_message(id, edit_data)
         except:
             raise MessageNotFoundError()
         
-    def remove_message(self, id: int) -> MessageSchema:
+    async def remove_message(self, id: int) -> MessageSchema:
         try:
-            return self.repository.delete_message(id)
+            return await self.repository.delete_message(id)
         except:
             raise MessageNotFoundError()
         
@@ -1,31 +1,124 @@
+from typing import Optional
+
+from sqlalchemy import select, literal, func, update, and_
 from sqlalchemy.orm import Session, Query
-from sqlalchemy.exc import NoResultFound, IntegrityError
+from sqlalchemy.exc import NoResultFound
 
 from .exceptions import  ( 
     ParticipantNotFoundError, ParticipantAlreadyExistsError, 
-    ChatNotFoundError, UserNotFoundError, AppError,
+    ChatNotFoundError, UserNotFoundError, BatchTooLargeError, ForbiddenError,
+)
+from ..schemas.chat import PUBLIC_CHAT
+from ..schemas.participant import (
+    ParticipantCreateSchema, ParticipantSchema, ParticipationSchema,
+    ParticipantsInviteResultSchema,
 )
-from ..schemas.participant import ParticipantCreateSchema, ParticipantSchema, ParticipationSchema
 from ..models.participant import Participant
+from ..models.message import Message
+from ..models.user import User
+from ..models.chat import Chat
+from .broker import Broker, broker as chat_broker
+from .changes import change, record_changes
+from ..database import dialect_insert
+from ..utils.cache import TTLCache, EntityCache
+from ..utils.config import PARTICIPANT_BATCH_MAX_SIZE, ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL
+
+# chat id -> list[ParticipantSchema], read through by find_chat_participants.
+chat_participants_cache = EntityCache("chat_participants", TTLCache(maxsize=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL))
 
 class ParticipantRepository:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, cache: EntityCache = chat_participants_cache):
         self.db = db
+        self.cache = cache
 
     def __to_participant(self, data: ParticipantCreateSchema) -> Participant:
         return Participant(user_id=data.user_id, chat_id=data.chat_id)
     
     def __to_participant_schema(self, participant: Participant):
-        return ParticipantSchema(id=participant.id, user_id=participant.user_id, chat_id=participant.chat_id)
+        return ParticipantSchema.model_validate(participant)
+
+    def __change_member_count(self, chat_id: int, delta: int):
+        (self.db.query(Chat)
+         .filter(Chat.id == chat_id)
+         .update({Chat.member_count: Chat.member_count + delta, Chat.updated_at: Chat.updated_at},
+                 synchronize_session=False))
+
+    def __record_membership(self, participants: list[Participant], deleted: bool = False):
+        # Member counts changed too, hence the chat.
+        chat_id = participants[0].chat_id
+        record_changes(self.db, *(change("participant", participant.id, chat_id=chat_id,
+                                         user_id=participant.user_id, deleted=deleted)
+                                  for participant in participants),
+                       change("chat", chat_id, chat_id=chat_id))
+
+    def __leave_chat(self, participant: Participant):
+        self.__change_member_count(participant.chat_id, -1)
+        self.db.delete(participant)
+        self.db.flush()
+
+        # The participant's messages went with them, possibly including the chat's last one.
+        latest_message = (select(func.max(Message.id))
+                          .where(Message.chat_id == participant.chat_id)
+                          .scalar_subquery())
+        (self.db.query(Chat)
+         .filter(Chat.id == participant.chat_id)
+         .update({Chat.last_message_id: latest_message, Chat.updated_at: Chat.updated_at},
+                 synchronize_session=False))
+        self.__record_membership([participant], deleted=True)
 
     def add_participant(self, create_schema: ParticipantCreateSchema) -> ParticipantSchema:
         participant = self.__to_participant(create_schema) 
 
         self.db.add(participant)
+        self.__change_member_count(create_schema.chat_id, 1)
+        self.db.flush()
+        self.__record_membership([participant])
         self.db.commit()
+        self.cache.invalidate(create_schema.chat_id)
 
         return self.__to_participant_schema(participant)
 
+    def add_participants(self, chat_id: int, user_ids: list[int]) -> ParticipantsInviteResultSchema:
+        if self.db.query(Chat.id).filter(Chat.id == chat_id, Chat.deleted_at.is_(None)).first() is None:
+            raise NoResultFound()
+
+        requested = set(user_ids)
+        known_users = {id for (id,) in self.db.query(User.id).filter(User.id.in_(requested), User.deleted_at.is_(None))}
+
+        # INSERT ... SELECT ... ON CONFLICT DO NOTHING: the unique (user_id, chat_id)
+        # constraint filters out existing members inside the same statement.
+        # New members start with the history marked as read.
+        latest_message = select(func.max(Message.id)).where(Message.chat_id == chat_id).scalar_subquery()
+        statement = (dialect_insert(self.db, Participant)
+                     .from_select(["user_id", "chat_id", "last_read_message_id"],
+                                  select(User.id, literal(chat_id), latest_message).where(User.id.in_(known_users)))
+                     .on_conflict_do_nothing(index_elements=["user_id", "chat_id"])
+                     .returning(Participant.id, Participant.user_id))
+        rows = self.db.execute(statement).all() if known_users else []
+        added = {user_id for _, user_id in rows}
+        if added:
+            self.__change_member_count(chat_id, len(added))
+            self.__record_membership([Participant(id=id, user_id=user_id, chat_id=chat_id) for id, user_id in rows])
+        self.db.commit()
+        if added:
+            self.cache.invalidate(chat_id)
+
+        return ParticipantsInviteResultSchema(added=sorted(added),
+                                              already_participating=sorted(known_users - added),
+                                              missing_users=sorted(requested - known_users))
+
+    def find_chat_access(self, chat_id: int, user_id: int) -> tuple[str, bool]:
+        # (type of the chat, whether the user is in it)
+        is_member = (select(Participant.id)
+                     .where(Participant.chat_id == Chat.id, Participant.user_id == user_id)
+                     .exists())
+        access = self.db.query(Chat.type, is_member).filter(Chat.id == chat_id, Chat.deleted_at.is_(None)).first()
+
+        if access is None:
+            raise NoResultFound()
+
+        return access[0], access[1]
+
     def find_participant(self, id: int) -> ParticipantSchema:
         participant = self.db.query(Participant).filter(Participant.id == id).first()
 
@@ -34,9 +127,13 @@ class ParticipantRepository:
         
         return self.__to_participant_schema(participant)
     
+    # Participations in chats that aren't deleted, not even as tombstones waiting for the purge.
+    def __live_participations(self) -> Query:
+        return self.db.query(Participant).join(Chat, and_(Chat.id == Participant.chat_id, Chat.deleted_at.is_(None)))
+
     def find_participation(self, user_id: int, chat_id: int) -> ParticipantSchema:
-        participation = self.db.query(Participant).filter(Participant.user_id == user_id,
-                                                          Participant.chat_id == chat_id)
+        participation = self.__live_participations().filter(Participant.user_id == user_id,
+                                                             Participant.chat_id == chat_id).first()
         
         if participation is None:
             raise NoResultFound()
@@ -44,31 +141,73 @@ class ParticipantRepository:
         return self.__to_participant_schema(participation)
     
     def find_chat_participants(self, chat_id: int) -> list[ParticipantSchema]:
-        participants = self.db.query(Participant).filter(Participant.chat_id == chat_id)
+        return self.cache.get_or_load(chat_id, lambda: self.__load_chat_participants(chat_id))
+
+    def __load_chat_participants(self, chat_id: int) -> list[ParticipantSchema]:
+        # Deleted users have left every chat, even before their rows are purged.
+        participants = [self.__to_participant_schema(participant)
+                        for participant in (self.__live_participations()
+                                            .join(User, and_(User.id == Participant.user_id,
+                                                             User.deleted_at.is_(None)))
+                                            .filter(Participant.chat_id == chat_id))]
 
-        if participants is None or participants.count() == 0:
+        if not participants:
             raise NoResultFound()
         
-        return [self.__to_participant_schema(participant) 
-                for participant in participants]
+        return participants
     
     def find_user_participations(self, user_id: int) -> list[ParticipantSchema]:
-        participations = self.db.query(Participant).filter(Participant.user_id == user_id)
+        participations = [self.__to_participant_schema(participation)
+                          for participation in self.__live_participations().filter(Participant.user_id == user_id)]
 
-        if participations is None or participations.count() == 0:
+        if not participations:
             raise NoResultFound()
 
-        return [self.__to_participant_schema(participation)
-                for participation in participations]
+        return participations
     
+    def mark_read(self, user_id: int, chat_id: int, message_id: Optional[int] = None) -> ParticipantSchema:
+        participant = (self.__live_participations()
+                       .filter(Participant.user_id == user_id, Participant.chat_id == chat_id)
+                       .with_for_update(of=Participant)
+                       .first())
+
+        if participant is None:
+            raise NoResultFound()
+
+        latest_id = self.db.query(func.max(Message.id)).filter(Message.chat_id == chat_id).scalar()
+        message_id = latest_id if message_id is None or latest_id is None else min(message_id, latest_id)
+
+        if message_id is None:
+            return self.__to_participant_schema(participant)
+
+        # The cursor only moves forward. The row is locked above, so a concurrent send or
+        # delete has either committed its +1/-1 already, and its message is seen by the
+        # recount below, or waits for this transaction and applies it to the recounted
+        # value. SQLite serializes writers anyway.
+        unread = (select(func.count(Message.id))
+                  .where(Message.chat_id == chat_id, Message.id > message_id, Message.sender_id != participant.id)
+                  .scalar_subquery())
+        moved = self.db.execute(update(Participant)
+                                .where(Participant.id == participant.id,
+                                       func.coalesce(Participant.last_read_message_id, 0) < message_id)
+                                .values(last_read_message_id=message_id, unread_count=unread)).rowcount
+        if moved:
+            # Read state is synced across the user's devices.
+            record_changes(self.db, change("participant", participant.id, chat_id=chat_id, user_id=user_id))
+        self.db.commit()
+        self.cache.invalidate(chat_id)
+
+        return self.__to_participant_schema(participant)
+
     def delete_participant(self, id: int) -> ParticipantSchema:
         participant = self.db.query(Participant).filter(Participant.id == id).first()
 
         if participant is None:
             raise NoResultFound()
 
-        self.db.delete(participant)
+        self.__leave_chat(participant)
         self.db.commit()
+        self.cache.invalidate(participant.chat_id)
 
         return self.__to_participant_schema(participant)
     
@@ -79,70 +218,115 @@ class ParticipantRepository:
         if participation is None:
             raise NoResultFound()
         
-        self.db.delete(participation)
+        self.__leave_chat(participation)
         self.db.commit()
+        self.cache.invalidate(participation.chat_id)
 
         return self.__to_participant_schema(participation)
     
 
 class ParticipantService:
-    def __init__(self, repository: ParticipantRepository):
+    def __init__(self, repository: ParticipantRepository, broker: Broker = chat_broker):
         self.repository = repository
+        self.broker = broker
+
+    def __publish_removal(self, participant: ParticipantSchema):
+        self.broker.publish(participant.chat_id, {"type": "participant_removed", "chat_id": participant.chat_id,
+                                                  "user_id": participant.user_id})
+
+    async def __added_participant(self, result: ParticipantsInviteResultSchema,
+                                  participation_data: ParticipantCreateSchema) -> ParticipantSchema:
+        if result.missing_users:
+            raise UserNotFoundError()
+        if result.already_participating:
+            raise ParticipantAlreadyExistsError()
+
+        return await self.get_participation(participation_data.user_id, participation_data.chat_id)
+
+    async def add_participant(self, participation_data: ParticipantCreateSchema) -> ParticipantSchema:
+        result = await self.add_participants(participation_data.chat_id, [participation_data.user_id])
+        return await self.__added_participant(result, participation_data)
+
+    async def invite_participant(self, inviter_id: int, participation_data: ParticipantCreateSchema) -> ParticipantSchema:
+        result = await self.invite_participants(inviter_id, participation_data.chat_id, [participation_data.user_id])
+        return await self.__added_participant(result, participation_data)
+
+    async def add_participants(self, chat_id: int, user_ids: list[int],
+                               max_size: int = PARTICIPANT_BATCH_MAX_SIZE) -> ParticipantsInviteResultSchema:
+        if len(user_ids) > max_size:
+            raise BatchTooLargeError(f"Can't invite {len(user_ids)} users at once, the limit is {max_size}.")
+
+        try:
+            result = await self.repository.add_participants(chat_id, user_ids)
+        except NoResultFound:
+            raise ChatNotFoundError()
 
-    def add_participant(self, participation_data: ParticipantCreateSchema) -> ParticipantSchema:
+        if result.added:
+            self.broker.publish(chat_id, {"type": "participants_added", "chat_id": chat_id, "user_ids": result.added})
+        return result
+
+    async def invite_participants(self, inviter_id: int, chat_id: int,
+                                  user_ids: list[int]) -> ParticipantsInviteResultSchema:
         try:
-            return self.repository.add_participant(participation_data)
-        except IntegrityError as e:
-            error_message = str(e).lower()
-
-            if "foreign key constraint" in error_message:
-                if "user_id" in error_message:
-                    raise UserNotFoundError()
-                elif "chat_id" in error_message:
-                    raise ChatNotFoundError()
-                else:
-                    raise AppError(str(e))
-
-            elif "unique constraint" in error_message:
-                raise ParticipantAlreadyExistsError()
-
-            else:
-                raise AppError(str(e))
-            
-
-    def get_chat_participants(self, chat_id: int) -> list[ParticipantSchema]:
+            chat_type, is_member = await self.repository.find_chat_access(chat_id, inviter_id)
+        except NoResultFound:
+            raise ChatNotFoundError()
+
+        if chat_type != PUBLIC_CHAT:
+            raise ForbiddenError("Only public chats take invitations.")
+        if not is_member:
+            raise ForbiddenError("Only the chat's participants can invite others to it.")
+
+        return await self.add_participants(chat_id, user_ids)
+
+    async def mark_read(self, user_id: int, chat_id: int, message_id: Optional[int] = None) -> ParticipantSchema:
         try:
-            return self.repository.find_chat_participants(chat_id)
+            participant = await self.repository.mark_read(user_id, chat_id, message_id)
+        except NoResultFound:
+            raise ParticipantNotFoundError("User isn't participating in this chat.")
+
+        self.broker.publish(chat_id, {"type": "read", "chat_id": chat_id, "user_id": user_id,
+                                      "message_id": participant.last_read_message_id})
+        return participant
+
+    async def get_chat_participants(self, chat_id: int) -> list[ParticipantSchema]:
+        try:
+            return await self.repository.find_chat_participants(chat_id)
         except NoResultFound:
             raise ParticipantNotFoundError(f"Chat with id = {chat_id} doesn't exist or has no participants.")
         
-    def get_participant(self, id: int) -> ParticipantSchema:
+    async def get_participant(self, id: int) -> ParticipantSchema:
         try:
-            return self.repository.find_participant(id)
+            return await self.repository.find_participant(id)
         except NoResultFound:
             raise ParticipantNotFoundError()
 
-    def remove_participant(self, id: int) -> ParticipantSchema:
+    async def remove_participant(self, id: int) -> ParticipantSchema:
         try:
-            return self.repository.delete_participant(id)
+            participant = await self.repository.delete_participant(id)
         except NoResultFound:
             raise ParticipantNotFoundError()
-        
 
-    def get_user_participations(self, user_id: int) -> list[ParticipantSchema]:
+        self.__publish_removal(participant)
+        return participant
+
+    async def get_user_participations(self, user_id: int) -> list[ParticipantSchema]:
         try:
-            return self.repository.find_user_participations(user_id)
+            return await self.repository.find_user_participations(user_id)
         except NoResultFound:
             raise ParticipantNotFoundError("User isn't currently participating in any of the chats.")
     
-    def get_participation(self, user_id: int, chat_id: int) -> ParticipantSchema:
+    async def get_participation(self, user_id: int, chat_id: int) -> ParticipantSchema:
         try:
-            return self.repository.find_participation(user_id, chat_id)
+            return await self.repository.find_participation(user_id, chat_id)
         except NoResultFound:
             raise ParticipantNotFoundError()
         
-    def remove_participation(self, participation: ParticipationSchema) -> ParticipantSchema:
+    async def remove_participation(self, participation: ParticipationSchema) -> ParticipantSchema:
         try:
-            return self.repository.delete_participation(participation)
+            participant = await self.repository.delete_participation(participation)
         except NoResultFound:
-            raise ParticipantNotFoundError()
\ No newline at end of file
+            raise ParticipantNotFoundError()
+
+        self.__publish_removal(participant)
+        return participant
\ No newline at end of file
@@ -0,0 +1,77 @@
+import asyncio
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+
+from passlib.hash import bcrypt
+
+from .exceptions import ServerBusyError
+from ..utils.config import PASSWORD_HASHER_WORKERS, PASSWORD_HASHER_MAX_PENDING
+
+def hash_password(password: str) -> str:
+    return bcrypt.hash(password)
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    return bcrypt.verify(password, hashed_password)
+
+
+# bcrypt is ~100-300 ms of pure CPU per call, so it runs in its own processes where it
+# can neither hold the GIL nor stall the event loop. The pending limit is checked before
+# submitting: under a login storm extra callers fail fast instead of queueing for seconds.
+# The processes are started by a fork server (spawned where there is none) rather than
+# forked from a worker: a fork of a process running an event loop, a database pool and
+# threads copies their locks and sockets in whatever state they are in at that moment.
+class PasswordHasher:
+    def __init__(self, max_workers: int = PASSWORD_HASHER_WORKERS, max_pending: int = PASSWORD_HASHER_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.pending = 0
+        self.counters = Counter(hashed=0, verified=0, rejected=0)
+        self.__executor: Optional[ProcessPoolExecutor] = None
+
+    def __get_executor(self) -> ProcessPoolExecutor:
+        if self.__executor is None:
+            self.__executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                  mp_context=multiprocessing.get_context(self.start_method))
+
+        return self.__executor
+
+    async def __submit(self, function, *args):
+        if self.pending >= self.max_pending:
+            self.counters["rejected"] += 1
+            raise ServerBusyError()
+
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.__get_executor(), function, *args)
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        hashed_password = await self.__submit(hash_password, password)
+        self.counters["hashed"] += 1
+        return hashed_password
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        is_valid = await self.__submit(verify_password, password, hashed_password)
+        self.counters["verified"] += 1
+        return is_valid
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.counters,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "workers": self.max_workers,
+            "start_method": self.start_method,
+        }
+
+    def shutdown(self):
+        if self.__executor is not None:
+            self.__executor.shutdown(cancel_futures=True)
+            self.__executor = None
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,226 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from typing import Any, Optional
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+
+from .particpants import chat_participants_cache
+from .sync import SyncRepository
+from .attachments import AttachmentRepository, BlobStore, blob_store
+from ..database import AsyncRepository, session_scope
+from ..models.chat import Chat
+from ..models.user import User
+from ..models.participant import Participant
+from ..models.message import Message
+from ..utils.cache import EntityCache
+from ..utils.config import (
+    PURGE_BATCH_SIZE, PURGE_INTERVAL, CHANGE_LOG_RETENTION,
+    ATTACHMENT_ORPHAN_TTL,
+)
+
+logger = logging.getLogger("messenger.purge")
+
+
+# Removes tombstoned chats and users (deleted_at set) a bounded batch at a time. Every
+# call deletes at most batch_size rows of one table in one transaction and reports what
+# it deleted and whether the entity is gone, so no lock or transaction outlives a batch.
+class PurgeRepository:
+    def __init__(self, db: Session, participants_cache: EntityCache = chat_participants_cache):
+        self.db = db
+        self.participants_cache = participants_cache
+
+    def find_pending(self) -> list[tuple[str, int]]:
+        chats = self.db.scalars(select(Chat.id).where(Chat.deleted_at.isnot(None)).order_by(Chat.deleted_at))
+        users = self.db.scalars(select(User.id).where(User.deleted_at.isnot(None)).order_by(User.deleted_at))
+
+        return [("chat", id) for id in chats] + [("user", id) for id in users]
+
+    def __delete_batch(self, model, condition, batch_size: int) -> int:
+        batch = select(model.id).where(condition).limit(batch_size)
+        return self.db.execute(delete(model).where(model.id.in_(batch))).rowcount
+
+    def purge_chat(self, chat_id: int, batch_size: int) -> tuple[dict[str, int], bool]:
+        # Messages first, then members: each row then goes without cascading to others.
+        for model, condition in ((Message, Message.chat_id == chat_id),
+                                 (Participant, Participant.chat_id == chat_id)):
+            deleted = self.__delete_batch(model, condition, batch_size)
+            if deleted:
+                self.db.commit()
+                return {model.__tablename__: deleted}, False
+
+        deleted = self.db.execute(delete(Chat).where(Chat.id == chat_id, Chat.deleted_at.isnot(None))).rowcount
+        self.db.commit()
+        return {"chats": deleted}, True
+
+    def purge_user(self, user_id: int, batch_size: int) -> tuple[dict[str, int], bool]:
+        participant_ids = select(Participant.id).where(Participant.user_id == user_id)
+        deleted = self.__delete_batch(Message, Message.sender_id.in_(participant_ids), batch_size)
+        if deleted:
+            self.db.commit()
+            return {"messages": deleted}, False
+
+        participations = self.db.execute(select(Participant.id, Participant.chat_id)
+                                         .where(Participant.user_id == user_id).limit(batch_size)).all()
+        if participations:
+            chat_ids = [chat_id for _, chat_id in participations]
+            self.db.execute(delete(Participant).where(Participant.id.in_([id for id, _ in participations])))
+
+            # Their messages are gone, possibly including some chats' last one. Unread
+            # counters of the other members are left to the next mark_read, which recounts.
+            latest_message = select(func.max(Message.id)).where(Message.chat_id == Chat.id).scalar_subquery()
+            (self.db.query(Chat)
+             .filter(Chat.id.in_(chat_ids))
+             .update({Chat.member_count: Chat.member_count - 1, Chat.last_message_id: latest_message,
+                      Chat.updated_at: Chat.updated_at}, synchronize_session=False))
+            self.db.commit()
+
+            for chat_id in chat_ids:
+                self.participants_cache.invalidate(chat_id)
+            return {"participants": len(participations)}, False
+
+        deleted = self.db.execute(delete(User).where(User.id == user_id, User.deleted_at.isnot(None))).rowcount
+        self.db.commit()
+        return {"users": deleted}, True
+
+
+class PurgeJob:
+    def __init__(self, kind: str, id: int):
+        self.kind = kind
+        self.id = id
+        self.deleted: Counter[str] = Counter()
+        self.batches = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "id": self.id,
+            "batches": self.batches,
+            "deleted": dict(self.deleted),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# Background loop of one worker process. It wakes up every `interval` seconds, or right
+# away when a deletion is queued, and purges every tombstoned entity batch by batch with
+# a fresh session per batch, yielding to the event loop in between. Several workers may
+# purge the same entity at once; the batches are idempotent, so they only share the work.
+# Changes older than `retention` seconds leave the change log the same way.
+class Purger:
+    def __init__(self, batch_size: int = PURGE_BATCH_SIZE, interval: float = PURGE_INTERVAL,
+                 retention: float = CHANGE_LOG_RETENTION, history: int = 50,
+                 store: BlobStore = blob_store, orphan_ttl: float = ATTACHMENT_ORPHAN_TTL):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retention = retention
+        self.store = store
+        self.orphan_ttl = orphan_ttl
+        self.counters = Counter(batches=0, completed=0, errors=0)
+        self.deleted: Counter[str] = Counter()
+        self.running: dict[tuple[str, int], PurgeJob] = {}
+        self.finished: deque[PurgeJob] = deque(maxlen=history)
+        self.__wakeup: Optional[asyncio.Event] = None
+        self.__task: Optional[asyncio.Task] = None
+
+    async def purge(self, kind: str, id: int):
+        job = self.running.setdefault((kind, id), PurgeJob(kind, id))
+        finished = False
+
+        while not finished:
+            async with session_scope() as db:
+                repository = AsyncRepository(db, PurgeRepository)
+                deleted, finished = await getattr(repository, f"purge_{kind}")(id, self.batch_size)
+
+            job.batches += 1
+            job.deleted.update(deleted)
+            self.counters["batches"] += 1
+            self.deleted.update(deleted)
+            await asyncio.sleep(0)
+
+        job.finished_at = time.time()
+        self.counters["completed"] += 1
+        self.finished.append(self.running.pop((kind, id)))
+        logger.info("purged %s %d in %d batches: %s", kind, id, job.batches, dict(job.deleted))
+
+    async def run_once(self) -> int:
+        async with session_scope() as db:
+            pending = await AsyncRepository(db, PurgeRepository).find_pending()
+
+        for kind, id in pending:
+            await self.purge(kind, id)
+
+        await self.prune_changes()
+        await self.remove_orphan_blobs()
+        return len(pending)
+
+    async def prune_changes(self):
+        # Only numbered changes are pruned; number those nobody has synced since.
+        async with session_scope() as db:
+            await AsyncRepository(db, SyncRepository).sequence_changes()
+
+        while True:
+            async with session_scope() as db:
+                pruned = await AsyncRepository(db, SyncRepository).prune_changes(self.retention, self.batch_size)
+
+            if pruned:
+                self.deleted.update({"changes": pruned})
+            if pruned < self.batch_size:
+                return
+            await asyncio.sleep(0)
+
+    async def remove_orphan_blobs(self):
+        while True:
+            async with session_scope() as db:
+                removed = await AsyncRepository(db, AttachmentRepository).delete_orphan_blobs(
+                    self.orphan_ttl, self.batch_size, self.store.remove)
+
+            if removed:
+                self.deleted.update({"blobs": removed})
+            if removed < self.batch_size:
+                return
+            await asyncio.sleep(0)
+
+    async def __run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                self.counters["errors"] += 1
+                logger.exception("purge failed, retrying in %s s", self.interval)
+
+            try:
+                await asyncio.wait_for(self.__wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.__wakeup.clear()
+
+    def start(self):
+        self.__wakeup = asyncio.Event()
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            await asyncio.gather(self.__task, return_exceptions=True)
+            self.__task = None
+
+    def wake(self):
+        if self.__wakeup is not None:
+            self.__wakeup.set()
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            **self.counters,
+            "deleted": dict(self.deleted),
+            "running": [job.stats() for job in self.running.values()],
+            "finished": [job.stats() for job in self.finished],
+            "batch_size": self.batch_size,
+        }
+
+
+purger = Purger()
@@ -0,0 +1,174 @@
+import asyncio
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Callable, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from ..utils.config import REALTIME_QUEUE_SIZE, REALTIME_OVERFLOW_POLICY
+
+OVERFLOW_POLICIES = ("drop_oldest", "disconnect")
+
+
+# A subscriber of the hub. Without a websocket it's only a queue of events for a handler
+# that waits on it itself (GET /events).
+class Connection:
+    def __init__(self, websocket: Optional[WebSocket], user_id: int, max_queue: int, count: Callable[[str], None]):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.count = count
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.kicked = asyncio.Event()
+        self.dropped = 0
+
+    async def __send_events(self):
+        while True:
+            event = await self.queue.get()
+            await self.websocket.send_json(event)
+            self.count("sent")
+
+    async def __receive_until_closed(self):
+        try:
+            while True:
+                await self.websocket.receive_text()
+        except WebSocketDisconnect:
+            return
+
+    async def run(self):
+        tasks = [asyncio.create_task(self.__send_events()),
+                 asyncio.create_task(self.__receive_until_closed()),
+                 asyncio.create_task(self.kicked.wait())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Wait for the cancellations to land, so no task outlives the connection and
+            # failures of the ones that ended on their own are retrieved, not logged as lost.
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Fans chat events out to the WebSockets of this process. Every connection owns a
+# bounded queue drained by its own sender task, so publishing never awaits a socket:
+# a slow client only fills its own queue, and once it's full the overflow policy decides.
+class ChatHub:
+    def __init__(self, max_queue: int = REALTIME_QUEUE_SIZE, overflow_policy: str = REALTIME_OVERFLOW_POLICY):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}.")
+
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.counters = Counter(published=0, enqueued=0, sent=0, dropped=0, disconnected=0)
+        self.__subscriptions: dict[int, set[Connection]] = defaultdict(set)
+        self.__connections: dict[Connection, set[int]] = {}
+        self.__user_connections: dict[int, set[Connection]] = defaultdict(set)
+        self.__lock = threading.Lock()
+
+    # Connections on any event loop and broker threads count here.
+    def count(self, name: str):
+        with self.__lock:
+            self.counters[name] += 1
+
+    def connect(self, websocket: Optional[WebSocket], user_id: int, chat_ids: list[int]) -> Connection:
+        connection = Connection(websocket, user_id, self.max_queue, self.count)
+
+        with self.__lock:
+            self.__connections[connection] = set(chat_ids)
+            self.__user_connections[user_id].add(connection)
+            for chat_id in chat_ids:
+                self.__subscriptions[chat_id].add(connection)
+
+        return connection
+
+    def disconnect(self, connection: Connection):
+        with self.__lock:
+            for chat_id in self.__connections.pop(connection, ()):
+                self.__unsubscribe(connection, chat_id)
+
+            connections = self.__user_connections.get(connection.user_id)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    del self.__user_connections[connection.user_id]
+
+    def __unsubscribe(self, connection: Connection, chat_id: int):
+        subscribers = self.__subscriptions.get(chat_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.__subscriptions[chat_id]
+
+    def subscribe(self, user_id: int, chat_id: int):
+        with self.__lock:
+            for connection in self.__user_connections.get(user_id, ()):
+                self.__connections[connection].add(chat_id)
+                self.__subscriptions[chat_id].add(connection)
+
+    def unsubscribe(self, user_id: int, chat_id: int):
+        with self.__lock:
+            for connection in self.__user_connections.get(user_id, ()):
+                self.__connections[connection].discard(chat_id)
+                self.__unsubscribe(connection, chat_id)
+
+    def deliver(self, chat_id: int, events: list[dict[str, Any]]):
+        # Membership events also move the open sockets of that user: new members get the
+        # join itself and everything after it, removed ones still see their removal.
+        for event in events:
+            if event["type"] == "participants_added":
+                for user_id in event["user_ids"]:
+                    self.subscribe(user_id, chat_id)
+
+            self.publish(chat_id, event)
+
+            if event["type"] == "participant_removed":
+                self.unsubscribe(event["user_id"], chat_id)
+
+    def publish(self, chat_id: int, event: dict[str, Any]):
+        # Called from request handlers that may run in the threadpool, so every
+        # queue is touched only from the event loop its connection lives on.
+        with self.__lock:
+            subscribers = list(self.__subscriptions.get(chat_id, ()))
+
+        self.count("published")
+        for connection in subscribers:
+            connection.loop.call_soon_threadsafe(self.__offer, connection, event)
+
+    def __offer(self, connection: Connection, event: dict[str, Any]):
+        if connection.kicked.is_set():
+            return
+
+        if connection.queue.full():
+            if self.overflow_policy == "disconnect":
+                self.count("disconnected")
+                connection.kicked.set()
+                self.disconnect(connection)
+                return
+
+            connection.queue.get_nowait()
+            connection.dropped += 1
+            self.count("dropped")
+
+        connection.queue.put_nowait(event)
+        self.count("enqueued")
+
+    def stats(self) -> dict[str, Any]:
+        with self.__lock:
+            connections = sum(1 for connection in self.__connections if connection.websocket is not None)
+            listeners = len(self.__connections) - connections
+            chats = len(self.__subscriptions)
+            queued = sum(connection.queue.qsize() for connection in self.__connections)
+            counters = dict(self.counters)
+
+        return {
+            **counters,
+            "connections": connections,
+            "listeners": listeners,
+            "subscribed_chats": chats,
+            "queued": queued,
+            "max_queue": self.max_queue,
+            "overflow_policy": self.overflow_policy,
+        }
+
+
+hub = ChatHub()
@@ -0,0 +1,74 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import Annotated
+
+from sqlalchemy.orm import Session
+
+from ..tokens import get_current_user, get_current_user_unpooled
+from ..exceptions import AppError
+from ..users import UserSchema
+from ..attachments import (
+    AttachmentRepository, AttachmentService,
+    BlobSchema, AttachmentCreateSchema, AttachmentSchema,
+)
+
+from ...database import get_session, AsyncRepository
+from ...utils.responses import ModelResponse, BlobResponse
+from ...utils.config import ATTACHMENT_CHUNK_SIZE
+
+router = APIRouter(tags=["Attachment"])
+
+def get_attachment_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, AttachmentRepository)
+
+def get_attachment_service(repository: AttachmentRepository = Depends(get_attachment_repository)) -> AttachmentService:
+    return AttachmentService(repository)
+
+ServiceDependency = Annotated[AttachmentService, Depends(get_attachment_service)]
+UserDependency = Annotated[UserSchema, Depends(get_current_user)]
+# An upload may take minutes; the pooled session isn't touched until the file is on disk.
+UploaderDependency = Annotated[UserSchema, Depends(get_current_user_unpooled)]
+
+# The request body is the file itself, streamed to disk as it arrives. The returned hash
+# is what POST /messages/{id}/attachments refers to, as often as the uploader sends the file.
+@router.post('/attachments/', response_model=BlobSchema, status_code=201)
+async def upload_attachment(request: Request,
+                            user: UploaderDependency,
+                            service: ServiceDependency):
+    length = request.headers.get("content-length")
+
+    try:
+        blob = await service.upload(user.id, request.stream(), int(length) if length and length.isdigit() else None)
+        return ModelResponse(blob, status_code=201)
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+
+@router.get('/attachments/{id}', status_code=200)
+async def download_attachment(id: int,
+                              user: UserDependency,
+                              service: ServiceDependency):
+    try:
+        attachment, path, stat = await service.open_attachment(id, user.id)
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+
+    return BlobResponse(path, attachment.sha256, stat, media_type=attachment.content_type,
+                        filename=attachment.filename, chunk_size=ATTACHMENT_CHUNK_SIZE)
+
+@router.post('/messages/{id}/attachments', response_model=AttachmentSchema, status_code=201)
+async def attach_file(id: int,
+                      attachment_data: AttachmentCreateSchema,
+                      user: UserDependency,
+                      service: ServiceDependency):
+    try:
+        return ModelResponse(await service.attach(id, user.id, attachment_data), status_code=201)
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+
+@router.get('/messages/{id}/attachments', response_model=list[AttachmentSchema], status_code=200)
+async def get_message_attachments(id: int,
+                                  user: UserDependency,
+                                  service: ServiceDependency):
+    try:
+        return ModelResponse(await service.get_message_attachments(id, user.id))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
@@ -1,10 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Annotated, Optional
 
 from sqlalchemy.orm import Session
 
 from ..tokens import get_current_user
-from ..exceptions import AppError
+from ..exceptions import AppError, UserNotFoundError
 from ..chats import ( 
     ChatRepository, ChatService,
     ChatCreateSchema, ChatSchema,
@@ -14,43 +14,68 @@ from ..chats import (
 from ..particpants import (
     ParticipantRepository, ParticipantService,
     ParticipantCreateSchema, ParticipantSchema,
-    ParticipationSchema, 
+    ParticipationSchema, ParticipantsInviteResultSchema,
+)
+from ..messages import (
+    MessageRepository, MessageService,
+    MessagePageSchema,
 )
 
-from ...database import get_db
+from ...database import get_session, AsyncRepository
+from ...utils.responses import ModelResponse
 from ...schemas.user import UserSchema
+from ...schemas.participant import ParticipantsInviteSchema, ReadCursorSchema
 router = APIRouter(tags=["Chat"], prefix="/chats")
 
-def get_chat_repository(db: Session = Depends(get_db)) -> ChatRepository:
-    return ChatRepository(db)
+def get_chat_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, ChatRepository)
 
 def get_chat_service(repository: ChatRepository = Depends(get_chat_repository)) -> ChatService:
     return ChatService(repository)
 
-def get_participant_repository(db: Session = Depends(get_db)) -> ParticipantRepository:
-    return ParticipantRepository(db)
+def get_participant_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, ParticipantRepository)
 
 def get_participant_service(repository: ChatRepository = Depends(get_participant_repository)) -> ParticipantService:
     return ParticipantService(repository)
 
+def get_message_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, MessageRepository)
+
+def get_message_service(repository: MessageRepository = Depends(get_message_repository)) -> MessageService:
+    return MessageService(repository)
+
 ChatServiceDependency = Annotated[ChatService, Depends(get_chat_service)]
 ParticipantServiceDependency = Annotated[ParticipantService, Depends(get_participant_service)]
+MessageServiceDependency = Annotated[MessageService, Depends(get_message_service)]
 UserDependency = Annotated[UserSchema, Depends(get_current_user)]
 
 UpdateSchema = Annotated[ChatUpdateSchema, Depends()]
 
+async def add_creator_and_invitee(chat: ChatSchema, user_id: int, invited_user_id: Optional[int],
+                                  participant_service: ParticipantService, chat_service: ChatService):
+    result = await participant_service.add_participants(chat.id, [user_id, invited_user_id]
+                                                        if invited_user_id is not None else [user_id])
+
+    if result.missing_users:
+        # Nobody to talk to: don't leave the chat behind.
+        await chat_service.delete_chat(chat.id)
+        raise UserNotFoundError("Invited user doesn't exist.")
+
+
 @router.post('/private', response_model=ChatSchema, status_code=201)
 async def create_private_chat(chat_data: CreatePrivateChatSchema,
                               invited_user_id: int,
                               user: UserDependency, 
                               participant_service: ParticipantServiceDependency,
                               chat_service: ChatServiceDependency) -> ChatSchema:
-    chat = chat_service.add_chat(chat_data)
-
-    participant_service.add_participant(ParticipantCreateSchema(user_id=user.id, chat_id=chat.id))
-    participant_service.add_participant(ParticipantCreateSchema(user_id=invited_user_id, chat_id=chat.id))
+    try:
+        chat = await chat_service.add_chat(chat_data)
+        await add_creator_and_invitee(chat, user.id, invited_user_id, participant_service, chat_service)
 
-    return chat
+        return ModelResponse(chat, status_code=201)
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
 
 
 @router.post('/public', response_model=ChatSchema, status_code=201)
@@ -59,32 +84,46 @@ async def create_public_chat(chat_data: CreatePublicChatSchema,
                              participant_service: ParticipantServiceDependency,
                              chat_service: ChatServiceDependency,
                              invited_user_id: Optional[int] = None) -> ChatSchema:
-    chat = chat_service.add_chat(chat_data)
-
-    participant_service.add_participant(ParticipantCreateSchema(user_id=user.id, chat_id=chat.id))
-    if invited_user_id:
-        participant_service.add_participant(ParticipantCreateSchema(user_id=user.id, chat_id=chat.id))
+    try:
+        chat = await chat_service.add_chat(chat_data)
+        await add_creator_and_invitee(chat, user.id, invited_user_id, participant_service, chat_service)
 
-    return chat
+        return ModelResponse(chat, status_code=201)
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
 
 
 @router.post('/public/add')
 async def add_user_to_public_chat(participant_schema: ParticipantCreateSchema,
                                   user: UserDependency,
-                                  chat_service: ChatServiceDependency,
                                   participant_service: ParticipantServiceDependency) -> ParticipantSchema:
     try:
-        chat_service.get_chat(participant_schema.chat_id)
-        return participant_service.add_participant(user_id=participant_schema.user_id, chat_id=participant_schema.chat_id)
+        return ModelResponse(await participant_service.invite_participant(user.id, participant_schema))
 
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
+@router.get('/participations', response_model=list[ParticipantSchema])
+async def get_user_participations(user_id: int,
+                                  service: ParticipantServiceDependency):
+    try:
+        return ModelResponse(await service.get_user_participations(user_id))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+    
+@router.get('/participation', response_model=ParticipantSchema, status_code=200)
+async def get_user_participations(user_id: int,
+                                  service: ParticipantServiceDependency):
+    try:
+        return ModelResponse(await service.get_participation(user_id))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+
 @router.get('/{id}', response_model=ChatSchema, status_code=200)
 async def get_chat(id: int,
                    service: ChatServiceDependency) -> ChatSchema:
     try:
-        return service.get_chat(id)
+        return ModelResponse(await service.get_chat(id))
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
 
@@ -92,7 +131,7 @@ async def get_chat(id: int,
 async def update_chat(id: int, chat_data: UpdateSchema,
                       service: ChatServiceDependency) -> ChatSchema:
     try:
-        return service.update_chat(id, chat_data)
+        return ModelResponse(await service.update_chat(id, chat_data))
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
@@ -100,16 +139,51 @@ async def update_chat(id: int, chat_data: UpdateSchema,
 async def delete_chat(id: int,
                       service: ChatServiceDependency):
     try:
-        service.delete_chat(id)
+        await service.delete_chat(id)
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message) 
     
 
+@router.get('/{id}/messages', response_model=MessagePageSchema, status_code=200)
+async def get_chat_history(id: int,
+                           user: UserDependency,
+                           service: MessageServiceDependency,
+                           before: Optional[str] = None,
+                           after: Optional[str] = None,
+                           limit: int = Query(default=50, ge=1, le=200)) -> MessagePageSchema:
+    try:
+        return ModelResponse(await service.get_chat_history(user.id, id, limit, before=before, after=after))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+    
+
+@router.post('/{id}/participants', response_model=ParticipantsInviteResultSchema, status_code=200)
+async def invite_chat_participants(id: int,
+                                   invite_data: ParticipantsInviteSchema,
+                                   user: UserDependency,
+                                   service: ParticipantServiceDependency) -> ParticipantsInviteResultSchema:
+    try:
+        return ModelResponse(await service.invite_participants(user.id, id, invite_data.user_ids))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+    
+
+@router.post('/{id}/read', response_model=ParticipantSchema, status_code=200)
+async def mark_chat_read(id: int,
+                         user: UserDependency,
+                         service: ParticipantServiceDependency,
+                         cursor: Optional[ReadCursorSchema] = None) -> ParticipantSchema:
+    try:
+        return ModelResponse(await service.mark_read(user.id, id, cursor.message_id if cursor else None))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+    
+
 @router.get('/{id}/participants', response_model=list[ParticipantSchema])
 async def get_chat_participants(chat_id: int,
                                 service: ParticipantServiceDependency):
     try:
-        return service.get_chat_participants(chat_id)
+        return ModelResponse(await service.get_chat_participants(chat_id))
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
@@ -117,7 +191,7 @@ async def get_chat_participants(chat_id: int,
 async def get_chat_participant(id: int,
                                       service: ParticipantServiceDependency):
     try:
-        return service.get_participant(id)
+        return ModelResponse(await service.get_participant(id))
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
@@ -125,31 +199,15 @@ async def get_chat_participant(id: int,
 async def remove_chat_participant(id: int,
                                          service: ParticipantServiceDependency):
     try:
-        service.remove_participant(id)
+        await service.remove_participant(id)
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
 
 
-@router.get('/participations', response_model=list[ParticipantSchema])
-async def get_user_participations(user_id: int,
-                                  service: ParticipantServiceDependency):
-    try:
-        return service.get_user_participations(user_id)
-    except AppError as e:
-        raise HTTPException(status_code=e.error_code, detail=e.message)
-    
-@router.get('/participation', response_model=ParticipantSchema, status_code=200)
-async def get_user_participations(user_id: int,
-                                  service: ParticipantServiceDependency):
-    try:
-        return service.get_participation(user_id)
-    except AppError as e:
-        raise HTTPException(status_code=e.error_code, detail=e.message)
-
 @router.delete('/participation', status_code=204)
 async def remove_chat_participation(participation: ParticipationSchema,
                                            service: ParticipantServiceDependency):
     try:
-        service.remove_participation(participation)
+        await service.remove_participation(participation)
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
\ No newline at end of file
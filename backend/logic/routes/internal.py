@@ -0,0 +1,44 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from ..realtime import hub
+from ..broker import broker
+from ..passwords import password_hasher
+from ..users import authenticated_users, user_cache
+from ..chats import chat_cache
+from ..particpants import chat_participants_cache
+from ..purge import PurgeRepository, purger
+from ..messages import message_committer
+from ...database import pool_monitors, get_session, AsyncRepository
+
+router = APIRouter(tags=["Internal"], prefix="/internal")
+
+@router.get('/realtime', status_code=200)
+async def get_realtime_stats():
+    return {**hub.stats(), "broker": broker.stats()}
+
+@router.get('/passwords', status_code=200)
+async def get_password_hasher_stats():
+    return password_hasher.stats()
+
+@router.get('/caches', status_code=200)
+async def get_cache_stats():
+    return {"authenticated_users": authenticated_users.stats(),
+            "users": user_cache.stats(),
+            "chats": chat_cache.stats(),
+            "chat_participants": chat_participants_cache.stats()}
+
+@router.get('/group-commit', status_code=200)
+async def get_group_commit_stats():
+    if message_committer is None:
+        return {"enabled": False}
+    return {"enabled": True, **message_committer.stats()}
+
+@router.get('/database/pool', status_code=200)
+async def get_database_pool_stats():
+    return {name: monitor.stats() for name, monitor in pool_monitors.items()}
+
+@router.get('/purge', status_code=200)
+async def get_purge_progress(db: Session = Depends(get_session)):
+    pending = await AsyncRepository(db, PurgeRepository).find_pending()
+    return {**purger.stats(), "pending": [{"kind": kind, "id": id} for kind, id in pending]}
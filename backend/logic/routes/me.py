@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Annotated, Optional
+
+from sqlalchemy.orm import Session
+
+from ..tokens import get_current_user
+from ..exceptions import AppError
+from ..users import UserSchema
+from ..chats import (
+    ChatRepository, ChatService,
+    InboxPageSchema,
+)
+
+from ...database import get_session, AsyncRepository
+from ...utils.responses import ModelResponse
+
+router = APIRouter(tags=["Me"], prefix="/me")
+
+def get_chat_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, ChatRepository)
+
+def get_chat_service(repository: ChatRepository = Depends(get_chat_repository)) -> ChatService:
+    return ChatService(repository)
+
+ChatServiceDependency = Annotated[ChatService, Depends(get_chat_service)]
+UserDependency = Annotated[UserSchema, Depends(get_current_user)]
+
+@router.get('/chats', response_model=InboxPageSchema, status_code=200)
+async def get_inbox(user: UserDependency,
+                    service: ChatServiceDependency,
+                    cursor: Optional[str] = None,
+                    limit: int = Query(default=50, ge=1, le=200)) -> InboxPageSchema:
+    try:
+        return ModelResponse(await service.get_inbox(user.id, limit, cursor))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
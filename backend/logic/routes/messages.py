@@ -1,5 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
-from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Response, Query
+from typing import Annotated, Optional
 
 from sqlalchemy.orm import Session
 
@@ -9,15 +9,17 @@ from ..users import UserSchema
 from ..messages import (
     MessageRepository, MessageService,
     MessageUpdateSchema, MessageCreateSchema, 
-    MessageSchema,
+    MessageSchema, MessageSearchPageSchema,
+    MessageBatchResultSchema,
 )
 
-from ...database import get_db
+from ...database import get_session, AsyncRepository
+from ...utils.responses import ModelResponse
 
 router = APIRouter(tags=["Message"], prefix="/messages")
 
-def get_message_repository(db: Session = Depends(get_db)) -> MessageRepository:
-    return MessageRepository(db)
+def get_message_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, MessageRepository)
 
 def get_message_service(repository: MessageRepository = Depends(get_message_repository)) -> MessageService:
     return MessageService(repository)
@@ -27,50 +29,53 @@ UserDependency = Annotated[UserSchema, Depends(get_current_user)]
 UpdateDependency = Annotated[MessageUpdateSchema, Depends()]
 
 @router.post('/', response_model=MessageSchema, status_code=201)
-def send_message(message_data: MessageCreateSchema,
-                 service: ServiceDependency):
+async def send_message(message_data: MessageCreateSchema,
+                       service: ServiceDependency):
     try:
-        return service.add_message(message_data)
+        return ModelResponse(await service.add_message(message_data), status_code=201)
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
-@router.get('/{id}', response_model=MessageSchema, status_code=200)
-def get_message(id: int,
-                service: ServiceDependency):
+@router.post('/batch', response_model=MessageBatchResultSchema, status_code=201)
+async def send_messages(messages_data: list[MessageCreateSchema],
+                        service: ServiceDependency):
     try:
-        return service.get_message(id)
+        return ModelResponse(await service.add_messages(messages_data), status_code=201)
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
-@router.get('/', response_model=MessageSchema, status_code=200)
-def get_message_by_text(text: str,
-                        service: ServiceDependency):
+@router.get('/search', response_model=MessageSearchPageSchema, status_code=200)
+async def search_messages(q: str,
+                          user: UserDependency,
+                          service: ServiceDependency,
+                          cursor: Optional[str] = None,
+                          limit: int = Query(default=20, ge=1, le=100)) -> MessageSearchPageSchema:
     try:
-        return service.get_message_by_text(text)
+        return ModelResponse(await service.search_messages(user.id, q, limit, cursor))
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
-
-@router.get('/', response_model=list[MessageSchema], status_code=200)
-def get_messages_by_text(text: str,
-                        service: ServiceDependency):
+    
+@router.get('/{id}', response_model=MessageSchema, status_code=200)
+async def get_message(id: int,
+                      service: ServiceDependency):
     try:
-        return service.get_messages_by_text(text)
+        return ModelResponse(await service.get_message(id))
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
 @router.put('/', response_model=MessageSchema, status_code=200)
-def edit_message(id: int,
-                 message_data: MessageUpdateSchema,
-                 service: ServiceDependency):
+async def edit_message(id: int,
+                       message_data: MessageUpdateSchema,
+                       service: ServiceDependency):
     try:
-        return service.edit_message(id, message_data)
+        return ModelResponse(await service.edit_message(id, message_data))
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
 @router.delete('/', status_code=204)
-def remove_message(id: int,
-                   service: ServiceDependency):
+async def remove_message(id: int,
+                         service: ServiceDependency):
     try:
-        service.remove_message(id)
+        await service.remove_message(id)
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
\ No newline at end of file
@@ -0,0 +1,72 @@
+from fastapi import APIRouter, WebSocket, Request, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Annotated, Optional
+
+from ..tokens import decode_access_token, get_current_user_unpooled
+from ..exceptions import AppError
+from ..realtime import hub
+from ..events import EventService, EventPageSchema
+from ..users import UserRepository, UserService
+from ..particpants import ParticipantRepository, ParticipantService
+
+from ...database import session_scope, AsyncRepository
+from ...schemas.user import UserSchema
+from ...utils.responses import ModelResponse
+from ...utils.config import EVENTS_POLL_TIMEOUT
+
+router = APIRouter(tags=["Realtime"])
+
+UnpooledUserDependency = Annotated[UserSchema, Depends(get_current_user_unpooled)]
+
+@router.websocket('/ws')
+async def chat_events(websocket: WebSocket):
+    cookie_token: str = websocket.cookies.get("token")
+
+    try:
+        if cookie_token is None:
+            raise AppError("You need to authorize to perform this action.", 401)
+
+        # The socket may stay open for hours; the session is released as soon as the lookups are done.
+        async with session_scope() as db:
+            service = UserService(AsyncRepository(db, UserRepository))
+            user = await service.get_user(decode_access_token(cookie_token)['user_id'], cached=False)
+
+            try:
+                participations = await ParticipantService(AsyncRepository(db, ParticipantRepository)).get_user_participations(user.id)
+            except AppError:
+                participations = []
+
+    except AppError as e:
+        await websocket.close(code=1008, reason=e.message)
+        return
+
+    await websocket.accept()
+    connection = hub.connect(websocket, user.id, [participation.chat_id for participation in participations])
+
+    try:
+        await connection.run()
+    finally:
+        hub.disconnect(connection)
+
+    if connection.kicked.is_set():
+        await websocket.close(code=1013, reason="Too many undelivered events.")
+
+
+# Long poll by default; with "Accept: text/event-stream" the same feed is streamed as
+# Server-Sent Events, resuming from Last-Event-ID when the browser reconnects.
+@router.get('/events', response_model=EventPageSchema, status_code=200)
+async def get_events(request: Request,
+                     user: UnpooledUserDependency,
+                     since: Optional[str] = None,
+                     timeout: float = Query(default=EVENTS_POLL_TIMEOUT, ge=0, le=EVENTS_POLL_TIMEOUT)):
+    service = EventService()
+
+    try:
+        if "text/event-stream" in request.headers.get("accept", ""):
+            events = service.stream(user.id, since or request.headers.get("last-event-id"))
+            return StreamingResponse(events, media_type="text/event-stream",
+                                     headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        return ModelResponse(await service.poll(user.id, since, timeout))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
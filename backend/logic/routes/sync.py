@@ -0,0 +1,30 @@
+from fastapi import APIRouter, Depends, Query
+from typing import Annotated, Optional
+
+from sqlalchemy.orm import Session
+
+from ..tokens import get_current_user
+from ..users import UserSchema
+from ..sync import SyncRepository, SyncService, SyncPageSchema
+
+from ...database import get_session, AsyncRepository
+from ...utils.responses import ModelResponse
+from ...utils.config import SYNC_PAGE_SIZE
+
+router = APIRouter(tags=["Sync"])
+
+def get_sync_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, SyncRepository)
+
+def get_sync_service(repository: SyncRepository = Depends(get_sync_repository)) -> SyncService:
+    return SyncService(repository)
+
+ServiceDependency = Annotated[SyncService, Depends(get_sync_service)]
+UserDependency = Annotated[UserSchema, Depends(get_current_user)]
+
+@router.get('/sync', response_model=SyncPageSchema, status_code=200)
+async def sync_changes(user: UserDependency,
+                       service: ServiceDependency,
+                       since: Optional[int] = Query(default=None, ge=0),
+                       limit: int = Query(default=SYNC_PAGE_SIZE, ge=1, le=SYNC_PAGE_SIZE)) -> SyncPageSchema:
+    return ModelResponse(await service.sync(user.id, since, limit))
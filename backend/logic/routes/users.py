@@ -1,21 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, Response
-from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Response, Query
+from typing import Annotated, Optional
 
 from sqlalchemy.orm import Session
 
-from ...database import get_db
+from ...database import get_session, AsyncRepository
+from ...utils.responses import ModelResponse
 from ..tokens import get_current_user, generate_access_token
 from ..exceptions import AppError
 from ..users import (
     UserRepository, UserService,
-    UserCreateSchema, UserSchema, UserCredentialSchema,
-    UserChangeDataSchema,
+    UserCreateSchema, UserSchema, UserPublicSchema, UserCredentialSchema,
+    UserChangeDataSchema, UserSearchPageSchema,
 )
 
 router = APIRouter(tags=["User"], prefix="/users")
 
-def get_user_repository(db: Session = Depends(get_db)) -> UserRepository:
-    return UserRepository(db)
+def get_user_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, UserRepository)
 
 def get_user_service(repository: UserRepository = Depends(get_user_repository)) -> UserService:
     return UserService(repository)
@@ -24,12 +25,12 @@ ServiceDependency = Annotated[UserService, Depends(get_user_service)]
 UserDependency = Annotated[UserSchema, Depends(get_current_user)]
 ChangeOptions = Annotated[UserChangeDataSchema, Depends()]
 
-@router.post("/register", response_model=UserSchema, status_code=201)
+@router.post("/register", response_model=UserPublicSchema, status_code=201)
 async def register(user_data: UserCreateSchema, 
-                   service: ServiceDependency) -> UserSchema:
+                   service: ServiceDependency) -> UserPublicSchema:
     try:
-        user = service.register_user(user_data)
-        return user
+        user = await service.register_user(user_data)
+        return ModelResponse(user.public(), status_code=201)
     
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
@@ -40,7 +41,7 @@ async def authorize(credentials: UserCredentialSchema,
                     service: ServiceDependency,
                     response: Response):
     try:
-        authorized_user: UserSchema = service.verify_credentials(credentials)
+        authorized_user: UserSchema = await service.verify_credentials(credentials)
         token = generate_access_token(authorized_user.id, authorized_user.email)
         response.set_cookie("token", token)
 
@@ -50,27 +51,34 @@ async def authorize(credentials: UserCredentialSchema,
         raise HTTPException(status_code=e.error_code, detail=e.message)
         
 
-@router.get('/{id}')
+@router.get('/search', response_model=UserSearchPageSchema, status_code=200)
+async def search_users(q: str,
+                       user: UserDependency,
+                       service: ServiceDependency,
+                       cursor: Optional[str] = None,
+                       limit: int = Query(default=20, ge=1, le=100)) -> UserSearchPageSchema:
+    try:
+        return ModelResponse(await service.search_users(q, limit, cursor))
+    except AppError as e:
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+
+
+@router.get('/{id}', response_model=UserPublicSchema)
 async def get_user(id: int,
                    service: ServiceDependency):
     try:
-        return service.get_user(id)
+        return ModelResponse((await service.get_user(id)).public())
 
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
     
 
-@router.get('/all')
-async def get_all_users(service: ServiceDependency):
-    return service.get_all_users()
-
-
-@router.put('/')
+@router.put('/', response_model=UserPublicSchema)
 async def change_user_data(change_data: ChangeOptions, 
                            user: UserDependency,
                            service: ServiceDependency,):
     try:
-        return service.change_user_data(id=user.id, change_data=change_data)
+        return ModelResponse((await service.change_user_data(id=user.id, change_data=change_data)).public())
 
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
@@ -79,7 +87,7 @@ async def change_user_data(change_data: ChangeOptions,
 async def remove_user(user_id: int,
                       service: ServiceDependency):
     try:
-        service.remove_user(user_id)
+        await service.remove_user(user_id)
 
     except AppError as e:
         raise HTTPException(status_code=e.error_code, detail=e.message)
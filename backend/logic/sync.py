@@ -0,0 +1,118 @@
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import select, func, and_, or_
+from sqlalchemy.orm import Session
+
+from ..models.change import Change
+from .changes import sequence_changes
+from ..models.chat import Chat, utc_now
+from ..models.participant import Participant
+from ..models.message import Message
+from ..models.user import User
+from ..schemas.chat import ChatSchema
+from ..schemas.participant import ParticipantSchema
+from ..schemas.message import MessageSchema
+from ..schemas.user import UserPublicSchema
+from ..schemas.sync import ChangeSchema, SyncPageSchema
+from ..utils.config import SYNC_PAGE_SIZE
+
+# entity -> (model, schema, filter for rows that still exist)
+ENTITY_MODELS = {
+    "chat": (Chat, ChatSchema, Chat.deleted_at.is_(None)),
+    "participant": (Participant, ParticipantSchema, None),
+    "message": (Message, MessageSchema, None),
+    "user": (User, UserPublicSchema, User.deleted_at.is_(None)),
+}
+
+
+class SyncRepository:
+    def __init__(self, db: Session):
+        self.db = db
+
+    def sequence_changes(self) -> int:
+        return sequence_changes(self.db)
+
+    def find_change_bounds(self) -> tuple[Optional[int], Optional[int]]:
+        # Two subqueries: SQLite answers a lone min() or max() from the end of the index,
+        # but scans the table for both in one SELECT.
+        return tuple(self.db.execute(select(select(func.min(Change.seq)).scalar_subquery(),
+                                            select(func.max(Change.seq)).scalar_subquery())).one())
+
+    def find_changes(self, user_id: int, since: int, limit: int) -> list[ChangeSchema]:
+        # The caller sees changes of chats they're in, changes about themselves (their own
+        # memberships, including ended ones) and profile changes of the people they share
+        # a chat with.
+        chat_ids = (select(Participant.chat_id)
+                    .join(Chat, and_(Chat.id == Participant.chat_id, Chat.deleted_at.is_(None)))
+                    .where(Participant.user_id == user_id))
+        contact_ids = select(Participant.user_id).where(Participant.chat_id.in_(chat_ids))
+        relevant = or_(Change.chat_id.in_(chat_ids),
+                       Change.user_id == user_id,
+                       and_(Change.entity == "user", Change.user_id.in_(contact_ids)))
+
+        # Compacted: only the latest relevant change of every entity, in sequence order.
+        latest = (select(func.max(Change.seq).label("seq"))
+                  .where(Change.seq > since, relevant)
+                  .group_by(Change.entity, Change.entity_id)
+                  .subquery())
+        changes = self.db.scalars(select(Change)
+                                  .join(latest, Change.seq == latest.c.seq)
+                                  .order_by(Change.seq)
+                                  .limit(limit)).all()
+
+        return self.__with_state(changes)
+
+    def __with_state(self, changes: list[Change]) -> list[ChangeSchema]:
+        # Current rows, one query per entity type. An entity that's gone since its last
+        # change (a message taken along by its chat, say) is reported as deleted.
+        states = {}
+        for entity, (model, schema, exists) in ENTITY_MODELS.items():
+            ids = {change.entity_id for change in changes if change.entity == entity and not change.deleted}
+            if not ids:
+                continue
+
+            rows = self.db.query(model).filter(model.id.in_(ids))
+            if exists is not None:
+                rows = rows.filter(exists)
+            states.update({(entity, row.id): schema.model_validate(row) for row in rows})
+
+        return [ChangeSchema(seq=change.seq, entity=change.entity, id=change.entity_id,
+                             deleted=(change.entity, change.entity_id) not in states,
+                             data=states.get((change.entity, change.entity_id)))
+                for change in changes]
+
+    def prune_changes(self, retention: float, batch_size: int) -> int:
+        # The newest change always stays: it's what tells a stale cursor from a fresh one
+        # once everything older has been pruned.
+        newest = select(func.max(Change.seq)).scalar_subquery()
+        batch = (select(Change.id)
+                 .where(Change.created_at < utc_now() - timedelta(seconds=retention), Change.seq < newest)
+                 .limit(batch_size))
+        deleted = self.db.query(Change).filter(Change.id.in_(batch)).delete(synchronize_session=False)
+        self.db.commit()
+
+        return deleted
+
+
+class SyncService:
+    def __init__(self, repository: SyncRepository):
+        self.repository = repository
+
+    async def sync(self, user_id: int, since: Optional[int], limit: int = SYNC_PAGE_SIZE) -> SyncPageSchema:
+        await self.repository.sequence_changes()
+        oldest, newest = await self.repository.find_change_bounds()
+        newest = newest or 0
+
+        # Pruned rows leave a gap below the oldest retained change; a cursor in it, or one
+        # the log never handed out, can't be continued.
+        if since is None or since > newest or (oldest is not None and since < oldest - 1):
+            return SyncPageSchema(changes=[], cursor=newest, resync_required=True)
+
+        changes = await self.repository.find_changes(user_id, since, limit + 1)
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        # Everything up to newest has been looked at, relevant or not.
+        cursor = changes[-1].seq if has_more else max([newest, *(change.seq for change in changes)])
+        return SyncPageSchema(changes=changes, cursor=cursor, has_more=has_more)
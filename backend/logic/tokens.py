@@ -1,17 +1,18 @@
 from fastapi import Request, HTTPException, Depends
-from typing import Annotated, Any
+from typing import Annotated, Any, Optional
 
 import jwt
+import time
 import datetime
 from passlib.context import CryptContext
 from sqlalchemy.orm import Session
 
-from .exceptions import AppError
-from .users import UserRepository, UserService
+from .exceptions import AppError, InvalidTokenError
+from .users import UserRepository, UserService, authenticated_users
 
 from ..schemas.user import UserSchema, BaseModel
 from ..models.user import User
-from ..database import get_db
+from ..database import get_session, session_scope, AsyncRepository
 from ..utils.secret_data import TOKEN_ALGORITHM, SECRET_TOKEN_KEY
 # from ..models.revoked_token import RevokedToken
 
@@ -19,8 +20,8 @@ class TokenResponse(BaseModel):
     access_token: str
     token_type: str
 
-def get_user_repository(db: Session = Depends(get_db)) -> UserRepository:
-    return UserRepository(db)
+def get_user_repository(db: Session = Depends(get_session)) -> AsyncRepository:
+    return AsyncRepository(db, UserRepository)
 
 def get_user_service(repository: UserRepository = Depends(get_user_repository)) -> UserService:
     return UserService(repository)
@@ -33,21 +34,42 @@ def generate_access_token(user_id: int, email: str) -> str:
 
     return jwt.encode(payload=encode, key=SECRET_TOKEN_KEY, algorithm=TOKEN_ALGORITHM)
 
-async def get_current_user(request: Request,
-                           service: ServiceDependency) -> UserSchema:
-    cookie_token: str = request.cookies.get("token")
+def decode_access_token(token: str) -> dict[str, Any]:
+    try:
+        payload_header: dict[str, Any] = jwt.decode(jwt=token, key=SECRET_TOKEN_KEY, algorithms=[TOKEN_ALGORITHM])
+    except jwt.PyJWTError:
+        raise InvalidTokenError()
+
+    if payload_header.get('user_id') is None:
+        raise InvalidTokenError()
+    
+    return payload_header
 
+async def authenticate(cookie_token: Optional[str], service: UserService) -> UserSchema:
     if cookie_token is None:
         raise HTTPException(status_code=401, detail="You need to authorize to perform this action.")
     
-    payload_header: dict[str, Any] = jwt.decode(jwt=cookie_token, key=SECRET_TOKEN_KEY, algorithms=[TOKEN_ALGORITHM])
-    user_id: int = payload_header['user_id']
-
-    if user_id is None:
-        raise HTTPException(status_code=400, detail="Invalid/Corrupted Token.")
+    cached = authenticated_users.get(cookie_token)
+    if cached is not None:
+        claims, user = cached
+        if claims['exp'] > time.time():
+            return user
     
     try:
-        return service.get_user(user_id)
+        claims = decode_access_token(cookie_token)
+        user = await service.get_user(claims['user_id'], cached=False)
+        authenticated_users.set(cookie_token, (claims, user), tag=user.id)
+        return user
     
     except AppError as e:
-        raise HTTPException(status_code=e.error_code, detail=e.message)
\ No newline at end of file
+        raise HTTPException(status_code=e.error_code, detail=e.message)
+
+async def get_current_user(request: Request,
+                           service: ServiceDependency) -> UserSchema:
+    return await authenticate(request.cookies.get("token"), service)
+
+# For requests that park (long polls, event streams): a Depends(get_session) session would
+# stay checked out until the response ends, so the lookup gets a session of its own.
+async def get_current_user_unpooled(request: Request) -> UserSchema:
+    async with session_scope() as db:
+        return await authenticate(request.cookies.get("token"), UserService(AsyncRepository(db, UserRepository)))
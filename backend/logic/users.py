@@ -1,25 +1,55 @@
+import re
+from typing import Optional
+
+from sqlalchemy import select, func, literal, literal_column, true, table, column, and_, or_
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import NoResultFound
+from sqlalchemy.exc import NoResultFound, IntegrityError
 from email_validator import validate_email, EmailNotValidError, EmailUndeliverableError
 
-from passlib.hash import bcrypt
+from starlette.concurrency import run_in_threadpool
 
-from ..utils.utils import generate_name
-from ..models.user import User
-from ..schemas.user import UserSchema, UserCreateSchema, UserCredentialSchema, UserChangeDataSchema
+from ..utils.utils import generate_name, encode_cursor, decode_cursor
+from ..utils.cache import TTLCache, EntityCache
+from ..utils.config import (
+    AUTH_CACHE_SIZE, AUTH_CACHE_TTL, EMAIL_CHECK_DELIVERABILITY,
+    ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, PURGE_INLINE_LIMIT,
+)
+from ..models.user import User, USER_SEARCH_TEXT
+from ..models.chat import Chat, utc_now
+from ..models.participant import Participant
+from ..models.message import Message
+from ..schemas.user import (
+    UserSchema, UserPublicSchema, UserSearchPageSchema,
+    UserCreateSchema, UserCredentialSchema, UserChangeDataSchema,
+)
 from .exceptions import (
     InvalidCredentialsError, 
     InvalidEmailError,
+    InvalidCursorError,
     UserNotFoundError,
     UserAlreadyRegisteredError
 )
+from .passwords import PasswordHasher, password_hasher
+from .particpants import chat_participants_cache
+from .changes import change, record_changes, record_changes_from
+from .purge import Purger, purger as user_purger
+
+# token -> (claims, UserSchema), tagged with the user id. Filled by get_current_user, which
+# reads the user past user_cache: another worker's change only reaches this one by expiry,
+# so a deleted or changed user stays authenticated at most AUTH_CACHE_TTL seconds.
+authenticated_users = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+users_fts = table("users_fts", column("rowid"))
+
+# id -> UserSchema, read through by find_user.
+user_cache = EntityCache("user", TTLCache(maxsize=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL))
 
 class UserRepository:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, cache: EntityCache = user_cache):
         self.db = db
+        self.cache = cache
 
-    def __to_user(self, credentials: UserCreateSchema) -> User:
-        hashed_password = bcrypt.hash(credentials.password)
+    def __to_user(self, credentials: UserCreateSchema, hashed_password: str) -> User:
         return User(
             name=generate_name(),
             email=credentials.email,
@@ -29,21 +59,24 @@ class UserRepository:
         )
     
     def __to_user_schema(self, user: User) -> UserSchema:
-        return UserSchema(
-            id=user.id, name=user.name, email=user.email,
-            bio=user.bio, status=user.status, hashed_password=user.hashed_password
-        )
+        return UserSchema.model_validate(user)
 
-    def add_user(self, credentials: UserCreateSchema) -> UserSchema:
-        user = self.__to_user(credentials)
+    def add_user(self, credentials: UserCreateSchema, hashed_password: str) -> UserSchema:
+        user = self.__to_user(credentials, hashed_password)
 
         self.db.add(user)
         self.db.commit()
 
         return self.__to_user_schema(user)
     
-    def find_user(self, id: int) -> UserSchema:
-        user = self.db.query(User).filter(User.id == id).first()
+    def find_user(self, id: int, cached: bool = True) -> UserSchema:
+        if not cached:
+            return self.__load_user(id)
+
+        return self.cache.get_or_load(id, lambda: self.__load_user(id))
+
+    def __load_user(self, id: int) -> UserSchema:
+        user = self.db.query(User).filter(User.id == id, User.deleted_at.is_(None)).first()
 
         if user is None:
             raise NoResultFound()
@@ -51,19 +84,52 @@ class UserRepository:
         return self.__to_user_schema(user)
     
     def find_user_by_email(self, email: str) -> UserSchema:
-        user = self.db.query(User).filter(User.email == email).first()
+        user = self.db.query(User).filter(User.email == email, User.deleted_at.is_(None)).first()
 
         if user is None:
             raise NoResultFound()
         
         return self.__to_user_schema(user)
     
-    def get_all_users(self) -> list[UserSchema]:
-        users = self.db.query(User).all()
-        return [self.__to_user_schema(user) for user in users]
+    def __match_and_rank(self, text: str):
+        # Both branches produce a rank where lower is better, like SQLite's bm25().
+        if self.db.get_bind().dialect.name == "postgresql":
+            # Spelled like the indexed expression so the trigram index serves both conditions:
+            # a substring anywhere, or a close enough match for typos.
+            search_text = literal_column(f"({USER_SEARCH_TEXT})")
+            pattern = "%" + re.sub(r"([\\%_])", r"\\\1", text) + "%"
+            return (or_(search_text.ilike(pattern, escape="\\"), literal(text).op("<%")(search_text)),
+                    -func.word_similarity(text, search_text))
+
+        # Quote every word so user input can't use FTS5 query syntax; '*' makes it a prefix match.
+        words = re.findall(r"\w+", text)
+        query = " ".join(f'"{word}"*' for word in words)
+        return literal_column("users_fts").op("MATCH")(query), func.bm25(literal_column("users_fts"))
+
+    def search_users(self, text: str, limit: int,
+                     after: Optional[tuple[float, int]] = None) -> list[tuple[UserPublicSchema, float]]:
+        if not re.search(r"\w", text):
+            return []
+
+        match, rank = self.__match_and_rank(text)
+        rank = rank.label("rank")
+
+        users = self.db.query(User, rank).filter(match, User.deleted_at.is_(None))
+
+        if self.db.get_bind().dialect.name != "postgresql":
+            users = users.join(users_fts, users_fts.c.rowid == User.id)
+
+        if after is not None:
+            after_rank, after_id = after
+            users = users.filter(or_(rank > after_rank, and_(rank == after_rank, User.id > after_id)))
+
+        users = users.order_by(rank.asc(), User.id.asc()).limit(limit)
+
+        return [(UserPublicSchema.model_validate(user), user_rank) for user, user_rank in users]
     
-    def change_user_data(self, id: int, changed_data: UserChangeDataSchema) -> UserSchema:
-        user = self.db.query(User).filter(User.id == id).first()
+    def change_user_data(self, id: int, changed_data: UserChangeDataSchema,
+                         hashed_password: Optional[str] = None) -> UserSchema:
+        user = self.db.query(User).filter(User.id == id, User.deleted_at.is_(None)).first()
 
         if user is None:
             raise NoResultFound()
@@ -71,87 +137,159 @@ class UserRepository:
         user.name = changed_data.name if changed_data.name else user.name
         user.email = changed_data.email if changed_data.email else user.email
         user.bio = changed_data.bio if changed_data.bio else user.bio
-        user.hashed_password = bcrypt.hash(changed_data.password) if changed_data.password else user.hashed_password
+        user.hashed_password = hashed_password if hashed_password else user.hashed_password
         
         self.db.merge(user)
+        record_changes(self.db, change("user", id, user_id=id))
         self.db.commit()
+        self.cache.invalidate(id)
 
         return self.__to_user_schema(user)
 
-    def remove_user(self, id: int) -> UserSchema:
-        user = self.db.query(User).filter(User.id == id).first()
+    def remove_user(self, id: int, inline_limit: int = PURGE_INLINE_LIMIT) -> UserSchema:
+        user = self.db.query(User).filter(User.id == id, User.deleted_at.is_(None)).first()
 
         if user is None:
             raise NoResultFound()
-        
+
+        removed_user = self.__to_user_schema(user)
+        participant_ids = select(Participant.id).where(Participant.user_id == id)
+        # The user leaves every chat at once, whichever way the rows go.
+        record_changes_from(self.db, select(literal("participant"), Participant.id, Participant.chat_id,
+                                            Participant.user_id, true())
+                                     .where(Participant.user_id == id))
+        record_changes(self.db, change("user", id, user_id=id, deleted=True))
+
+        chat_ids = self.db.scalars(select(Participant.chat_id).where(Participant.user_id == id)).all()
+
+        # A user with a long history is only marked here and purged in batches by the background job.
+        messages = self.db.query(Message.id).filter(Message.sender_id.in_(participant_ids))
+        if messages.offset(inline_limit).first() is not None:
+            user.deleted_at = utc_now()
+            self.db.commit()
+            self.cache.invalidate(id)
+            for chat_id in chat_ids:
+                chat_participants_cache.invalidate(chat_id)
+            return removed_user
+
+        # Participations and their messages go through ON DELETE CASCADE; keep the member
+        # counts and last messages of the user's chats in step.
         self.db.delete(user)
+        self.db.flush()
+
+        latest_message = select(func.max(Message.id)).where(Message.chat_id == Chat.id).scalar_subquery()
+        (self.db.query(Chat)
+         .filter(Chat.id.in_(chat_ids))
+         .update({Chat.member_count: Chat.member_count - 1, Chat.last_message_id: latest_message,
+                  Chat.updated_at: Chat.updated_at}, synchronize_session=False))
         self.db.commit()
 
-        return self.__to_user_schema(user)
+        self.cache.invalidate(id)
+        for chat_id in chat_ids:
+            chat_participants_cache.invalidate(chat_id)
+
+        return removed_user
 
 
 class UserService:
-    def __init__(self, repository: UserRepository):
+    def __init__(self, repository: UserRepository, hasher: PasswordHasher = password_hasher,
+                 auth_cache: TTLCache = authenticated_users, purger: Purger = user_purger):
         self.repository = repository
+        self.hasher = hasher
+        self.auth_cache = auth_cache
+        self.purger = purger
 
-    def register_user(self, credentials: UserCreateSchema) -> UserSchema:
+    async def register_user(self, credentials: UserCreateSchema) -> UserSchema:
         try:
-            self.get_user_by_email(credentials.email)
+            await self.get_user_by_email(credentials.email)
             raise UserAlreadyRegisteredError()
 
         except UserNotFoundError:
             try:
-                validate_email(credentials.email)
+                # Deliverability check does DNS lookups; keep them off the event loop.
+                await run_in_threadpool(validate_email, credentials.email,
+                                        check_deliverability=EMAIL_CHECK_DELIVERABILITY)
             except:
                 raise InvalidEmailError()
 
             if credentials.password != credentials.repeated_password:
                 raise InvalidCredentialsError("Password doesn't match the repeated password. Try again.")
 
-            return self.repository.add_user(credentials)
+            hashed_password = await self.hasher.hash(credentials.password)
+            try:
+                return await self.repository.add_user(credentials, hashed_password)
+            # Registered concurrently, or held by a deleted user whose rows aren't purged yet.
+            except IntegrityError:
+                raise UserAlreadyRegisteredError()
     
-    def get_user(self, id: int) -> UserSchema:
+    async def get_user(self, id: int, cached: bool = True) -> UserSchema:
         try:
-            found_user: UserSchema = self.repository.find_user(id)
+            found_user: UserSchema = await self.repository.find_user(id, cached)
             return found_user
 
         except NoResultFound:
             raise UserNotFoundError()
     
-    def get_user_by_email(self, email: str) -> UserSchema:
+    async def get_user_by_email(self, email: str) -> UserSchema:
         try:
-            found_user: UserSchema = self.repository.find_user_by_email(email)
+            found_user: UserSchema = await self.repository.find_user_by_email(email)
             return found_user
         
         except NoResultFound:
             raise UserNotFoundError()
         
-    def get_all_users(self) -> list[UserSchema]:
-        return self.repository.get_all_users()
+    async def search_users(self, text: str, limit: int, cursor: Optional[str] = None) -> UserSearchPageSchema:
+        try:
+            after = tuple(decode_cursor(cursor, (int, float), int)) if cursor else None
+        except ValueError:
+            raise InvalidCursorError()
+
+        # One extra row tells whether there is another page.
+        results = await self.repository.search_users(text, limit + 1, after)
+        has_more = len(results) > limit
+        results = results[:limit]
+
+        if not has_more:
+            return UserSearchPageSchema(users=[user for user, _ in results])
+
+        last_user, last_rank = results[-1]
+        return UserSearchPageSchema(users=[user for user, _ in results],
+                                    next_cursor=encode_cursor(last_rank, last_user.id))
         
-    def change_user_data(self, id: int, change_data: UserChangeDataSchema) -> UserSchema:
+    async def change_user_data(self, id: int, change_data: UserChangeDataSchema) -> UserSchema:
         if change_data.email:
-            self.is_email_valid(change_data.email)
+            await self.is_email_valid(change_data.email)
+
+        hashed_password = await self.hasher.hash(change_data.password) if change_data.password else None
 
         try:
-            return self.repository.change_user_data(id=id, changed_data=change_data)
+            changed_user = await self.repository.change_user_data(id=id, changed_data=change_data,
+                                                                   hashed_password=hashed_password)
 
         except NoResultFound:
             raise UserNotFoundError()
+        except IntegrityError:
+            raise UserAlreadyRegisteredError()
 
-    def remove_user(self, id: int) -> UserSchema:
+        self.auth_cache.invalidate_tag(id)
+        return changed_user
+
+    async def remove_user(self, id: int) -> UserSchema:
         try:
-            deleted_user: UserSchema = self.repository.remove_user(id)
-            return deleted_user
+            deleted_user: UserSchema = await self.repository.remove_user(id)
         
         except NoResultFound:
             raise UserNotFoundError()
+
+        self.auth_cache.invalidate_tag(id)
+        self.purger.wake()
+        return deleted_user
         
     
-    def is_email_valid(self, email: str):
+    async def is_email_valid(self, email: str):
         try:
-            validate_email(email, check_deliverability=True)
-            self.get_user_by_email(email=email)
+            await run_in_threadpool(validate_email, email, check_deliverability=EMAIL_CHECK_DELIVERABILITY)
+            await self.get_user_by_email(email=email)
             raise UserAlreadyRegisteredError()
         
         except NoResultFound:
@@ -161,10 +299,10 @@ class UserService:
             raise InvalidEmailError()
         
 
-    def verify_credentials(self, credentials: UserCredentialSchema) -> UserSchema:
-        user: UserSchema = self.get_user_by_email(credentials.email)
+    async def verify_credentials(self, credentials: UserCredentialSchema) -> UserSchema:
+        user: UserSchema = await self.get_user_by_email(credentials.email)
 
-        if not bcrypt.verify(credentials.password, user.hashed_password):
+        if not await self.hasher.verify(credentials.password, user.hashed_password):
             raise InvalidCredentialsError()
         
         return user
\ No newline at end of file
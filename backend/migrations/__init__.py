@@ -0,0 +1,141 @@
+import importlib
+import logging
+import pkgutil
+import re
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, inspect, select, insert, text
+from sqlalchemy.engine import Connection, Engine
+
+from .legacy import complete_initial_schema
+
+logger = logging.getLogger("messenger.migrations")
+
+# Versioned schema changes. Every module named m<NNNN>_<name>.py in this package is one
+# migration with an upgrade(connection) function; they are applied in version order, each
+# in its own transaction together with its row in schema_migrations. Migrations are never
+# edited once merged: a change to the schema is a new module, plus the matching change to
+# the models.
+migrations_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations", migrations_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), nullable=False),
+)
+
+MODULE_NAME = re.compile(r"m(\d{4})_(\w+)")
+# Arbitrary key of the PostgreSQL advisory lock that serializes workers migrating at startup.
+ADVISORY_LOCK_KEY = 7_102_341
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+def load_migrations() -> list[Migration]:
+    migrations = []
+
+    for module_info in pkgutil.iter_modules(__path__):
+        match = MODULE_NAME.fullmatch(module_info.name)
+        if match is None:
+            continue
+
+        module = importlib.import_module(f"{__name__}.{module_info.name}")
+        migrations.append(Migration(version=int(match[1]), name=match[2], upgrade=module.upgrade))
+
+    migrations.sort(key=lambda migration: migration.version)
+    versions = [migration.version for migration in migrations]
+    if versions != list(range(1, len(migrations) + 1)):
+        raise RuntimeError(f"Migration versions must run 1..n without gaps, got {versions}.")
+
+    return migrations
+
+
+def applied_versions(connection: Connection) -> set[int]:
+    if not inspect(connection).has_table(schema_migrations.name):
+        return set()
+
+    return set(connection.scalars(select(schema_migrations.c.version)))
+
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as connection:
+        return max(applied_versions(connection), default=0)
+
+
+def record_migration(connection: Connection, migration: Migration):
+    connection.execute(insert(schema_migrations).values(version=migration.version, name=migration.name,
+                                                        applied_at=datetime.now(timezone.utc)))
+
+
+def adopt_existing_schema(connection: Connection, migrations: list[Migration]):
+    # Databases created by Base.metadata.create_all, before there were migrations, have the
+    # tables of m0001 but not necessarily all of their columns (see legacy.py): complete them
+    # and record m0001 as applied instead of creating the tables again. SQLite rebuilds
+    # tables for that, which must neither cascade nor check references halfway; its foreign
+    # keys can only be switched off outside a transaction.
+    sqlite = connection.dialect.name == "sqlite"
+    if sqlite:
+        connection.execute(text("PRAGMA foreign_keys = OFF"))
+        connection.commit()
+
+    try:
+        with connection.begin():
+            complete_initial_schema(connection)
+            record_migration(connection, migrations[0])
+    finally:
+        if sqlite:
+            connection.execute(text("PRAGMA foreign_keys = ON"))
+            connection.commit()
+
+    logger.info("existing schema adopted at version %d (%s)", migrations[0].version, migrations[0].name)
+
+
+def migrate(engine: Engine, target: Optional[int] = None) -> list[int]:
+    migrations = load_migrations()
+    target = migrations[-1].version if target is None else target
+    applied = []
+
+    with engine.connect() as connection:
+        # Several workers may start at once. On PostgreSQL they queue on an advisory lock
+        # and each one re-reads the applied versions once it holds it; SQLite deployments
+        # are expected to run a single migrating process.
+        if connection.dialect.name == "postgresql":
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            connection.commit()
+
+        try:
+            with connection.begin():
+                migrations_metadata.create_all(connection)
+                adopting = not applied_versions(connection) and inspect(connection).has_table("users")
+
+            if adopting:
+                adopt_existing_schema(connection, migrations)
+
+            done = applied_versions(connection)
+            connection.commit()
+
+            for migration in migrations:
+                if migration.version in done or migration.version > target:
+                    continue
+
+                with connection.begin():
+                    migration.upgrade(connection)
+                    record_migration(connection, migration)
+
+                logger.info("migrated to version %d (%s)", migration.version, migration.name)
+                applied.append(migration.version)
+
+        finally:
+            if connection.dialect.name == "postgresql":
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+                connection.commit()
+
+    return applied
@@ -0,0 +1,124 @@
+import logging
+
+from sqlalchemy import Table, inspect, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateTable
+
+from . import m0001_initial as initial
+
+logger = logging.getLogger("messenger.migrations")
+
+# Databases that Base.metadata.create_all built before there were migrations come from any
+# revision of the models up to m0001, the oldest with only the first columns of every table.
+# What they lack of m0001 is added here and filled from the rows they have, table by table
+# in this order, as later backfills read the columns earlier ones filled. Messages from
+# back then have no time of their own and are dated at the upgrade; nothing counts as unread.
+BACKFILLS = {
+    "messages": {
+        "chat_id": "(SELECT participants.chat_id FROM participants WHERE participants.id = messages.sender_id)",
+        "created_at": "CURRENT_TIMESTAMP",
+    },
+    "chats": {
+        "last_message_id": "(SELECT max(messages.id) FROM messages WHERE messages.chat_id = chats.id)",
+        "last_activity_at": "coalesce(chats.updated_at, chats.created_at, CURRENT_TIMESTAMP)",
+        "member_count": "(SELECT count(*) FROM participants WHERE participants.chat_id = chats.id)",
+    },
+    "participants": {
+        "last_read_message_id": "(SELECT chats.last_message_id FROM chats WHERE chats.id = participants.chat_id)",
+        "unread_count": "0",
+    },
+}
+
+
+def missing_columns(connection: Connection) -> dict[str, list[str]]:
+    inspector = inspect(connection)
+    missing = {}
+
+    for name in BACKFILLS:
+        existing = {column["name"] for column in inspector.get_columns(name)}
+        columns = [column.name for column in initial.metadata.tables[name].columns if column.name not in existing]
+        if columns:
+            missing[name] = columns
+
+    return missing
+
+
+# Runs in a transaction; on SQLite with foreign keys switched off, as tables are rebuilt.
+def complete_initial_schema(connection: Connection):
+    missing = missing_columns(connection)
+
+    for name, columns in missing.items():
+        logger.info("adding %s to the existing %s table", ", ".join(columns), name)
+        table = initial.metadata.tables[name]
+
+        if connection.dialect.name == "sqlite":
+            rebuild_table(connection, table, columns)
+        else:
+            add_columns(connection, table, columns)
+
+    for table in initial.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+    for statement in initial.SEARCH_DDL.get(connection.dialect.name, []):
+        connection.execute(text(statement))
+
+    if connection.dialect.name == "sqlite":
+        # Indexes the messages there are, which the triggers never saw. Nothing is compressed
+        # before m0006, so the text is all there is to index.
+        connection.execute(text("INSERT INTO messages_fts(rowid, text) SELECT id, text FROM messages"))
+
+        if connection.execute(text("PRAGMA foreign_key_check")).first() is not None:
+            raise RuntimeError("The existing schema has rows that break its foreign keys; fix them and retry.")
+
+
+# Rows a required column can't be filled for are left out, and counted in the log: messages
+# whose sender is gone belong to no chat, and no request could reach them.
+#
+# SQLite's ALTER TABLE can add neither NOT NULL columns without a constant default nor
+# defaults like CURRENT_TIMESTAMP, so the table is created anew as m0001 has it, filled
+# from the old one, and takes its name. Foreign keys elsewhere refer to the table by
+# name and so refer to the new one.
+def rebuild_table(connection: Connection, table: Table, columns: list[str]):
+    created = str(CreateTable(table).compile(dialect=connection.dialect))
+    connection.execute(text(created.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {table.name}_adopted ", 1)))
+
+    names = [column.name for column in table.columns]
+    values = [BACKFILLS[table.name][name] if name in columns else f"{table.name}.{name}" for name in names]
+    required = [name for name in columns if not table.c[name].nullable]
+    conditions = [f"{BACKFILLS[table.name][name]} IS NOT NULL" for name in required]
+    copied = connection.execute(text(f"INSERT INTO {table.name}_adopted ({', '.join(names)}) "
+                                     f"SELECT {', '.join(values)} FROM {table.name}"
+                                     + (f" WHERE {' AND '.join(conditions)}" if conditions else ""))).rowcount
+    total = connection.execute(text(f"SELECT count(*) FROM {table.name}")).scalar()
+    log_left_out(table, required, total - copied)
+    connection.execute(text(f"DROP TABLE {table.name}"))
+    connection.execute(text(f"ALTER TABLE {table.name}_adopted RENAME TO {table.name}"))
+
+
+def log_left_out(table: Table, columns: list[str], count: int):
+    if count:
+        logger.warning("left out %d rows of %s with no value for %s", count, table.name, ", ".join(columns))
+
+
+def add_columns(connection: Connection, table: Table, columns: list[str]):
+    compiler = connection.dialect.ddl_compiler(connection.dialect, None)
+
+    for name in columns:
+        column = table.c[name]
+        definition = f"{name} {column.type.compile(dialect=connection.dialect)}"
+        for foreign_key in column.foreign_keys:
+            definition += f" REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})"
+            if foreign_key.ondelete:
+                definition += f" ON DELETE {foreign_key.ondelete}"
+
+        connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {definition}"))
+        connection.execute(text(f"UPDATE {table.name} SET {name} = {BACKFILLS[table.name][name]}"))
+
+        default = compiler.get_column_default_string(column)
+        if default is not None:
+            connection.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {name} SET DEFAULT {default}"))
+        if not column.nullable:
+            deleted = connection.execute(text(f"DELETE FROM {table.name} WHERE {name} IS NULL")).rowcount
+            log_left_out(table, [name], deleted)
+            connection.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {name} SET NOT NULL"))
@@ -0,0 +1,87 @@
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, String, DateTime, ForeignKey,
+    Index, UniqueConstraint, func, text,
+)
+from sqlalchemy.engine import Connection
+
+from ..utils.config import SEARCH_LANGUAGE
+
+# The schema as Base.metadata.create_all built it before migrations existed. The tables
+# are spelled out rather than taken from the models so that this migration keeps creating
+# the same schema whatever the models turn into later.
+metadata = MetaData()
+
+Table(
+    "users", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String),
+    Column("email", String, unique=True),
+    Column("bio", String),
+    Column("status", String),
+    Column("hashed_password", String),
+)
+
+Table(
+    "chats", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String),
+    Column("type", String),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+    Column("last_message_id", Integer, nullable=True),
+    Column("last_activity_at", DateTime(timezone=True), nullable=False),
+    Column("member_count", Integer, nullable=False, server_default="0"),
+    Index("ix_chats_last_activity_at_id", "last_activity_at", "id"),
+)
+
+Table(
+    "participants", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE")),
+    Column("chat_id", Integer, ForeignKey("chats.id", ondelete="CASCADE")),
+    Column("last_read_message_id", Integer, nullable=True),
+    Column("unread_count", Integer, nullable=False, server_default="0"),
+    UniqueConstraint("user_id", "chat_id", name="_user_participation_uc"),
+)
+
+Table(
+    "messages", metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("sender_id", Integer, ForeignKey("participants.id", ondelete="CASCADE")),
+    Column("chat_id", Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False),
+    Column("text", String),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Index("ix_messages_chat_id_id", "chat_id", "id"),
+)
+
+# The full-text index over messages.text: an external-content FTS5 table kept by triggers
+# on SQLite, a generated tsvector column with a GIN index on PostgreSQL.
+SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END",
+
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+        "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END",
+    ],
+    "postgresql": [
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_LANGUAGE}', coalesce(text, ''))) STORED",
+
+        "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING GIN (search_vector)",
+    ],
+}
+
+
+def upgrade(connection: Connection):
+    metadata.create_all(connection)
+
+    for statement in SEARCH_DDL.get(connection.dialect.name, []):
+        connection.execute(text(statement))
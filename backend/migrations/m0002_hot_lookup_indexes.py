@@ -0,0 +1,21 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# Lookups that filtered on a column no index started with:
+#   participants (chat_id, user_id)  members of a chat: find_chat_participants, the unread
+#                                    counter UPDATEs, invites, member recounts. The unique
+#                                    (user_id, chat_id) constraint only serves the user side.
+#   messages (sender_id)             a participant's messages, deleted along with them.
+#   chats (name)                     find_chats_by_name.
+# On a busy PostgreSQL database create these by hand with CREATE INDEX CONCURRENTLY
+# before deploying; IF NOT EXISTS then makes this migration a no-op.
+INDEXES = {
+    "ix_participants_chat_id_user_id": ("participants", ("chat_id", "user_id")),
+    "ix_messages_sender_id": ("messages", ("sender_id",)),
+    "ix_chats_name": ("chats", ("name",)),
+}
+
+
+def upgrade(connection: Connection):
+    for name, (table, columns) in INDEXES.items():
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
@@ -0,0 +1,15 @@
+from sqlalchemy import DateTime, text
+from sqlalchemy.engine import Connection
+
+# Tombstones for chats and users whose rows are purged in the background. The partial
+# indexes only hold the few tombstoned rows, so the purger finds its work without a scan.
+TABLES = ("chats", "users")
+
+
+def upgrade(connection: Connection):
+    column_type = DateTime(timezone=True).compile(dialect=connection.dialect)
+
+    for table in TABLES:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN deleted_at {column_type}"))
+        connection.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_deleted_at ON {table} (deleted_at) "
+                                "WHERE deleted_at IS NOT NULL"))
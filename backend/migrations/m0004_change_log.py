@@ -0,0 +1,24 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, Boolean, DateTime, Index, func
+from sqlalchemy.engine import Connection
+
+# The change log behind GET /sync, see models/change.py.
+metadata = MetaData()
+
+Table(
+    "changes", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("entity", String, nullable=False),
+    Column("entity_id", Integer, nullable=False),
+    Column("chat_id", Integer, nullable=True),
+    Column("user_id", Integer, nullable=True),
+    Column("deleted", Boolean, nullable=False, server_default="0"),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+    Index("ix_changes_chat_id_id", "chat_id", "id"),
+    Index("ix_changes_user_id_id", "user_id", "id"),
+    Index("ix_changes_created_at", "created_at"),
+    sqlite_autoincrement=True,
+)
+
+
+def upgrade(connection: Connection):
+    metadata.create_all(connection)
@@ -0,0 +1,32 @@
+from sqlalchemy import MetaData, Table, Column, Integer, BigInteger, String, ForeignKey, DateTime, Index
+from sqlalchemy.engine import Connection
+
+# Content-addressed blobs and the attachments linking them to messages, see models/attachment.py.
+metadata = MetaData()
+
+Table("messages", metadata, Column("id", Integer, primary_key=True))
+
+Table(
+    "blobs", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("sha256", String(64), nullable=False, unique=True),
+    Column("size", BigInteger, nullable=False),
+    Column("created_at", DateTime(timezone=True), nullable=False),
+    Index("ix_blobs_created_at", "created_at"),
+)
+
+Table(
+    "attachments", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("message_id", Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False),
+    Column("blob_id", Integer, ForeignKey("blobs.id"), nullable=False),
+    Column("filename", String, nullable=False),
+    Column("content_type", String, nullable=False),
+    Index("ix_attachments_message_id", "message_id"),
+    Index("ix_attachments_blob_id", "blob_id"),
+)
+
+
+def upgrade(connection: Connection):
+    metadata.tables["blobs"].create(connection)
+    metadata.tables["attachments"].create(connection)
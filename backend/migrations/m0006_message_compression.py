@@ -0,0 +1,66 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String, LargeBinary, DateTime, func, text
+from sqlalchemy.engine import Connection
+
+from ..utils.config import SEARCH_LANGUAGE
+
+# Compressed message bodies and the shared dictionaries they're compressed with, see
+# models/message.py. Existing rows stay as they are: plain text with no encoding.
+metadata = MetaData()
+
+Table(
+    "message_dictionaries", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("encoding", String(8), nullable=False),
+    Column("sha256", String(64), nullable=False, unique=True),
+    Column("data", LargeBinary, nullable=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now(), nullable=False),
+)
+
+# What the search index holds for a row: its text, or the decompressed body. message_text()
+# is registered on every SQLite connection, see database.py.
+SEARCHED_TEXT = ("coalesce({row}.text, message_text({row}.text_encoding, {row}.compressed_text, "
+                 "(SELECT data FROM message_dictionaries WHERE id = {row}.text_dictionary_id)))")
+
+COMPRESSED_SEARCH_DDL = {
+    "sqlite": [
+        "DROP TRIGGER IF EXISTS messages_fts_insert",
+        "DROP TRIGGER IF EXISTS messages_fts_delete",
+        "DROP TRIGGER IF EXISTS messages_fts_update",
+
+        "CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN "
+        f"INSERT INTO messages_fts(rowid, text) VALUES (new.id, {SEARCHED_TEXT.format(row='new')}); END",
+
+        "CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) "
+        f"VALUES ('delete', old.id, {SEARCHED_TEXT.format(row='old')}); END",
+
+        "CREATE TRIGGER messages_fts_update AFTER UPDATE OF text, compressed_text ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) "
+        f"VALUES ('delete', old.id, {SEARCHED_TEXT.format(row='old')}); "
+        f"INSERT INTO messages_fts(rowid, text) VALUES (new.id, {SEARCHED_TEXT.format(row='new')}); END",
+    ],
+    "postgresql": [
+        "ALTER TABLE messages ALTER COLUMN search_vector DROP EXPRESSION",
+
+        "CREATE OR REPLACE FUNCTION messages_search_vector() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+        "IF NEW.compressed_text IS NULL THEN "
+        f"NEW.search_vector := to_tsvector('{SEARCH_LANGUAGE}', coalesce(NEW.text, '')); "
+        "END IF; RETURN NEW; END $$",
+
+        "CREATE TRIGGER messages_search_vector BEFORE INSERT OR UPDATE OF text, compressed_text ON messages "
+        "FOR EACH ROW EXECUTE FUNCTION messages_search_vector()",
+    ],
+}
+
+
+def upgrade(connection: Connection):
+    metadata.create_all(connection)
+
+    binary_type = LargeBinary().compile(dialect=connection.dialect)
+    connection.execute(text(f"ALTER TABLE messages ADD COLUMN compressed_text {binary_type}"))
+    connection.execute(text("ALTER TABLE messages ADD COLUMN text_encoding VARCHAR(8)"))
+    connection.execute(text("ALTER TABLE messages ADD COLUMN text_dictionary_id INTEGER "
+                            "REFERENCES message_dictionaries (id)"))
+
+    for statement in COMPRESSED_SEARCH_DDL.get(connection.dialect.name, []):
+        connection.execute(text(statement))
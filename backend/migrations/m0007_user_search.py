@@ -0,0 +1,36 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+
+# Indexed directory search over users' names and e-mails, see models/user.py.
+USER_SEARCH_TEXT = "coalesce(name, '') || ' ' || coalesce(email, '')"
+
+USER_SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "name, email, content='users', content_rowid='id', tokenize='unicode61 remove_diacritics 2', "
+        "prefix='1 2 3')",
+
+        "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_fts(rowid, name, email) VALUES (new.id, new.name, new.email); END",
+
+        "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email); END",
+
+        "CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name, email ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email); "
+        "INSERT INTO users_fts(rowid, name, email) VALUES (new.id, new.name, new.email); END",
+
+        # Indexes the users that exist already.
+        "INSERT INTO users_fts(users_fts) VALUES ('rebuild')",
+    ],
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+
+        f"CREATE INDEX IF NOT EXISTS ix_users_search_trgm ON users USING GIN (({USER_SEARCH_TEXT}) gin_trgm_ops)",
+    ],
+}
+
+
+def upgrade(connection: Connection):
+    for statement in USER_SEARCH_DDL.get(connection.dialect.name, []):
+        connection.execute(text(statement))
@@ -0,0 +1,19 @@
+from sqlalchemy import BigInteger, text
+from sqlalchemy.engine import Connection
+
+# Sync sequence numbers given once the writing transaction is over instead of at insert, see
+# logic/changes.py. Every row there is so far is committed and keeps its id as its seq.
+
+
+def upgrade(connection: Connection):
+    bigint_type = BigInteger().compile(dialect=connection.dialect)
+
+    connection.execute(text("ALTER TABLE changes ADD COLUMN seq INTEGER"))
+    connection.execute(text(f"ALTER TABLE changes ADD COLUMN txid {bigint_type} NOT NULL DEFAULT 0"))
+    connection.execute(text("UPDATE changes SET seq = id"))
+
+    connection.execute(text("DROP INDEX ix_changes_chat_id_id"))
+    connection.execute(text("DROP INDEX ix_changes_user_id_id"))
+    connection.execute(text("CREATE UNIQUE INDEX ix_changes_seq ON changes (seq)"))
+    connection.execute(text("CREATE INDEX ix_changes_chat_id_seq ON changes (chat_id, seq)"))
+    connection.execute(text("CREATE INDEX ix_changes_user_id_seq ON changes (user_id, seq)"))
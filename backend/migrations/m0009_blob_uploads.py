@@ -0,0 +1,27 @@
+from sqlalchemy import MetaData, Table, Column, Integer, ForeignKey, Index, text
+from sqlalchemy.engine import Connection
+
+# Who uploaded each blob, see models/attachment.py. The senders of the messages a blob is
+# attached to count as its uploaders; blobs attached nowhere have to be uploaded again.
+metadata = MetaData()
+
+Table("blobs", metadata, Column("id", Integer, primary_key=True))
+Table("users", metadata, Column("id", Integer, primary_key=True))
+
+Table(
+    "uploads", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("blob_id", Integer, ForeignKey("blobs.id", ondelete="CASCADE"), nullable=False),
+    Column("user_id", Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Index("ix_uploads_blob_id_user_id", "blob_id", "user_id", unique=True),
+    Index("ix_uploads_user_id", "user_id"),
+)
+
+
+def upgrade(connection: Connection):
+    metadata.tables["uploads"].create(connection)
+
+    connection.execute(text("INSERT INTO uploads (blob_id, user_id) "
+                            "SELECT DISTINCT attachments.blob_id, participants.user_id FROM attachments "
+                            "JOIN messages ON messages.id = attachments.message_id "
+                            "JOIN participants ON participants.id = messages.sender_id"))
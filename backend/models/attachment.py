@@ -0,0 +1,55 @@
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, DateTime, Index
+from sqlalchemy.orm import relationship
+from ..database import Base
+from .chat import utc_now
+
+# A stored file, named on disk by the SHA-256 of its content (see logic/attachments.py), so
+# the same bytes are kept once however many messages carry them. created_at is moved
+# forward on every upload of the same content; the purge job only removes blobs nothing
+# refers to that haven't been uploaded for a while.
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(String(64), nullable=False, unique=True)
+    size = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
+
+    __table_args__ = (
+        Index("ix_blobs_created_at", "created_at"),
+    )
+
+
+# Who uploaded a blob. Only they may attach it: knowing a file's hash gives no access to it.
+class Upload(Base):
+    __tablename__ = "uploads"
+
+    id = Column(Integer, primary_key=True)
+    blob_id = Column(Integer, ForeignKey("blobs.id", ondelete="CASCADE"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+
+    # (blob_id, user_id) is looked up on attaching; user_id serves the cascade from users.
+    __table_args__ = (
+        Index("ix_uploads_blob_id_user_id", "blob_id", "user_id", unique=True),
+        Index("ix_uploads_user_id", "user_id"),
+    )
+
+
+# A file of a message: the blob plus what the sender called it.
+class Attachment(Base):
+    __tablename__ = "attachments"
+
+    id = Column(Integer, primary_key=True)
+    message_id = Column(Integer, ForeignKey("messages.id", ondelete="CASCADE"), nullable=False)
+    blob_id = Column(Integer, ForeignKey("blobs.id"), nullable=False)
+    filename = Column(String, nullable=False)
+    content_type = Column(String, nullable=False)
+
+    message = relationship("Message", foreign_keys=[message_id], back_populates="attachments")
+    blob = relationship("Blob", foreign_keys=[blob_id])
+
+    # message_id lists a message's files, blob_id tells whether a blob is still used.
+    __table_args__ = (
+        Index("ix_attachments_message_id", "message_id"),
+        Index("ix_attachments_blob_id", "blob_id"),
+    )
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Index
+from sqlalchemy.sql import func
+from ..database import Base
+
+# One row per mutation, written in the mutation's own transaction (see logic/changes.py).
+# seq is the sync sequence number. It's NULL until the transaction that wrote the row, and
+# every one that could still write a row before it, is over; txid, the writing transaction
+# (0 on SQLite), tells when that is. AUTOINCREMENT keeps SQLite from ever handing out an id
+# again once the oldest rows are pruned. chat_id and user_id say who may see the change:
+# members of the chat, the user it's about, and for "user" rows, the user's contacts.
+# Nothing references the entities, which may be long gone when a client syncs.
+class Change(Base):
+    __tablename__ = "changes"
+
+    id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=True)
+    txid = Column(BigInteger, nullable=False, default=0, server_default="0")
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    chat_id = Column(Integer, nullable=True)
+    user_id = Column(Integer, nullable=True)
+    deleted = Column(Boolean, nullable=False, default=False, server_default="0")
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index("ix_changes_seq", "seq", unique=True),
+        Index("ix_changes_chat_id_seq", "chat_id", "seq"),
+        Index("ix_changes_user_id_seq", "user_id", "seq"),
+        Index("ix_changes_created_at", "created_at"),
+        {"sqlite_autoincrement": True},
+    )
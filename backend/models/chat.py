@@ -1,8 +1,13 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from ..database import Base
 
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
 class Chat(Base):
     __tablename__ = "chats"
 
@@ -12,4 +17,22 @@ class Chat(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now()) 
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now()) 
 
-    participants = relationship("Participant", back_populates="chat", cascade="all, delete")
\ No newline at end of file
+    # Inbox summary, maintained by the message and participant repositories on write.
+    # last_activity_at is set from Python so keyset cursors compare against the exact
+    # stored value (SQLite keeps datetimes as text).
+    last_message_id = Column(Integer, nullable=True)
+    last_activity_at = Column(DateTime(timezone=True), default=utc_now, nullable=False)
+    member_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Set when a large chat is deleted; the rows go in batches in the background (see purge.py).
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
+
+    # Children are deleted by the database's ON DELETE CASCADE, never loaded for it.
+    participants = relationship("Participant", back_populates="chat", cascade="all, delete", passive_deletes=True)
+
+    # Indexes are created by the migrations in backend/migrations; keep both in step.
+    __table_args__ = (
+        Index("ix_chats_last_activity_at_id", "last_activity_at", "id"),
+        Index("ix_chats_name", "name"),
+        Index("ix_chats_deleted_at", "deleted_at",
+              sqlite_where=deleted_at.isnot(None), postgresql_where=deleted_at.isnot(None)),
+    )
@@ -1,14 +1,165 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
-from sqlalchemy.orm import relationship
+from typing import Any, Optional
+
+from sqlalchemy import Column, Integer, String, LargeBinary, ForeignKey, DateTime, Index, DDL, event
+from sqlalchemy.orm import relationship, object_session
+from sqlalchemy.sql import func
 from ..database import Base
+from ..utils.config import SEARCH_LANGUAGE
+from ..utils.compression import TextCodec, message_codec, decompress
+from .attachment import Attachment
+
+# Shared compression dictionaries (see utils/compression.py). Rows are never changed or
+# deleted: a message compressed with one needs it for as long as the message exists.
+class MessageDictionary(Base):
+    __tablename__ = "message_dictionaries"
+
+    id = Column(Integer, primary_key=True)
+    encoding = Column(String(8), nullable=False)
+    sha256 = Column(String(64), nullable=False, unique=True)
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
 
 class Message(Base):
     __tablename__ = "messages"
 
     id = Column(Integer, primary_key=True, index=True)
     sender_id = Column(Integer, ForeignKey("participants.id", ondelete="CASCADE"))
-    text = Column(String)
+    chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"), nullable=False)
+    # The body is read and written through `text`. Bodies the codec compresses are stored in
+    # compressed_text, flagged by text_encoding (NULL: plain_text holds the body as it is).
+    plain_text = Column("text", String)
+    compressed_text = Column(LargeBinary, nullable=True)
+    text_encoding = Column(String(8), nullable=True)
+    text_dictionary_id = Column(Integer, ForeignKey("message_dictionaries.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    sender = relationship("Participant", foreign_keys=[sender_id], back_populates="messages")
+    attachments = relationship(Attachment, back_populates="message", cascade="all, delete", passive_deletes=True)
+
+    # History pages are read with "WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+    # so (chat_id, id) lets every page be a single index range seek.
+    # sender_id finds a participant's messages when the participant goes.
+    __table_args__ = (
+        Index("ix_messages_chat_id_id", "chat_id", "id"),
+        Index("ix_messages_sender_id", "sender_id"),
+    )
+
+    # Column values storing `text`, for inserts that don't go through Message objects.
+    @staticmethod
+    def encode_text(text: Optional[str], codec: TextCodec = message_codec) -> dict[str, Any]:
+        compressed = codec.compress(text) if text is not None else None
+        if compressed is None:
+            return {"plain_text": text, "compressed_text": None, "text_encoding": None, "text_dictionary_id": None}
+
+        encoding, data, dictionary_id = compressed
+        return {"plain_text": None, "compressed_text": data, "text_encoding": encoding,
+                "text_dictionary_id": dictionary_id}
+
+    @property
+    def text(self) -> Optional[str]:
+        if self.text_encoding is None:
+            return self.plain_text
+
+        return decompress(self.text_encoding, self.compressed_text, self.__dictionary())
+
+    @text.setter
+    def text(self, text: Optional[str]):
+        for key, value in self.encode_text(text).items():
+            setattr(self, key, value)
+
+    def __dictionary(self) -> Optional[bytes]:
+        if self.text_dictionary_id is None:
+            return None
+
+        data = message_codec.dictionaries.get(self.text_dictionary_id)
+        if data is None:
+            # Registered by another worker since this one loaded its dictionaries.
+            data = object_session(self).get(MessageDictionary, self.text_dictionary_id).data
+            message_codec.add_dictionary(self.text_dictionary_id, data)
+        return data
+
+
+# Full-text index over Message.text, kept in sync by the database itself so every
+# write path (ORM, bulk Core inserts, raw SQL) is covered.
+# SQLite: an external-content FTS5 table maintained by triggers.
+# PostgreSQL: a generated tsvector column with a GIN index.
+SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+        "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END",
+
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+
+        "CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+        "INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text); END",
+    ],
+    "postgresql": [
+        "ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        f"GENERATED ALWAYS AS (to_tsvector('{SEARCH_LANGUAGE}', coalesce(text, ''))) STORED",
+
+        "CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING GIN (search_vector)",
+    ],
+}
+
+# Compressed bodies have no text to index. SQLite's triggers index what message_text()
+# (registered on every connection, see database.py) decompresses instead; the function
+# has to be known to any connection that writes messages. On PostgreSQL the search vector
+# becomes a plain column kept by a trigger for plain bodies and written by
+# MessageRepository for compressed ones.
+SEARCHED_TEXT = ("coalesce({row}.text, message_text({row}.text_encoding, {row}.compressed_text, "
+                 "(SELECT data FROM message_dictionaries WHERE id = {row}.text_dictionary_id)))")
+
+COMPRESSED_SEARCH_DDL = {
+    "sqlite": [
+        "DROP TRIGGER IF EXISTS messages_fts_insert",
+        "DROP TRIGGER IF EXISTS messages_fts_delete",
+        "DROP TRIGGER IF EXISTS messages_fts_update",
+
+        "CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN "
+        f"INSERT INTO messages_fts(rowid, text) VALUES (new.id, {SEARCHED_TEXT.format(row='new')}); END",
+
+        "CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) "
+        f"VALUES ('delete', old.id, {SEARCHED_TEXT.format(row='old')}); END",
+
+        "CREATE TRIGGER messages_fts_update AFTER UPDATE OF text, compressed_text ON messages BEGIN "
+        "INSERT INTO messages_fts(messages_fts, rowid, text) "
+        f"VALUES ('delete', old.id, {SEARCHED_TEXT.format(row='old')}); "
+        f"INSERT INTO messages_fts(rowid, text) VALUES (new.id, {SEARCHED_TEXT.format(row='new')}); END",
+    ],
+    "postgresql": [
+        "ALTER TABLE messages ALTER COLUMN search_vector DROP EXPRESSION",
+
+        "CREATE OR REPLACE FUNCTION messages_search_vector() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+        "IF NEW.compressed_text IS NULL THEN "
+        f"NEW.search_vector := to_tsvector('{SEARCH_LANGUAGE}', coalesce(NEW.text, '')); "
+        "END IF; RETURN NEW; END $$",
+
+        "CREATE TRIGGER messages_search_vector BEFORE INSERT OR UPDATE OF text, compressed_text ON messages "
+        "FOR EACH ROW EXECUTE FUNCTION messages_search_vector()",
+    ],
+}
+
+# Fills the index anew, for a database whose index is missing rows. FTS5's own 'rebuild'
+# reads messages.text, which is NULL for compressed bodies. PostgreSQL keeps the search
+# vector in the row itself, so there is nothing to rebuild.
+SEARCH_REBUILD = {
+    "sqlite": [
+        "INSERT INTO messages_fts(messages_fts) VALUES ('delete-all')",
+
+        f"INSERT INTO messages_fts(rowid, text) SELECT id, {SEARCHED_TEXT.format(row='messages')} FROM messages",
+    ],
+}
 
-    sender = relationship("Participant", foreign_keys=[sender_id], cascade="all, delete", back_populates="messages")
-    # attachments
+for ddl in (SEARCH_DDL, COMPRESSED_SEARCH_DDL):
+    for dialect, statements in ddl.items():
+        for statement in statements:
+            event.listen(Message.__table__, "after_create", DDL(statement).execute_if(dialect=dialect))
 
+event.listen(Message.__table__, "before_drop", DDL("DROP TABLE IF EXISTS messages_fts").execute_if(dialect="sqlite"))
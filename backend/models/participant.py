@@ -1,6 +1,6 @@
 from sqlalchemy import ( 
     Column, Integer, String, ForeignKey, 
-    UniqueConstraint,
+    UniqueConstraint, Index,
 )
 from sqlalchemy.orm import relationship
 from ..database import Base
@@ -11,9 +11,17 @@ class Participant(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     chat_id = Column(Integer, ForeignKey("chats.id", ondelete="CASCADE"))
+    # Read state. unread_count is kept up to date by every write to messages, so the
+    # chat list never has to count messages.
+    last_read_message_id = Column(Integer, nullable=True)
+    unread_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     user = relationship("User", foreign_keys=[user_id], back_populates="participations")
     chat = relationship("Chat", foreign_keys=[chat_id], back_populates="participants")
-    messages = relationship("Message", cascade="all, delete", back_populates="sender")
+    messages = relationship("Message", cascade="all, delete", back_populates="sender", passive_deletes=True)
 
-    __table_args__ = (UniqueConstraint('user_id', 'chat_id', name='_user_participation_uc'),)
\ No newline at end of file
+    # The unique constraint serves lookups by user; members of a chat need chat_id first.
+    __table_args__ = (
+        UniqueConstraint('user_id', 'chat_id', name='_user_participation_uc'),
+        Index("ix_participants_chat_id_user_id", "chat_id", "user_id"),
+    )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, String, DateTime, Index, DDL, event
 from sqlalchemy.orm import relationship
 from ..database import Base
 
@@ -11,5 +11,52 @@ class User(Base):
     bio = Column(String)
     status = Column(String)
     hashed_password = Column(String)
+    # Set when a user with a long history is deleted; see purge.py.
+    deleted_at = Column(DateTime(timezone=True), nullable=True)
 
-    participations = relationship("Participant", back_populates="user", cascade="all, delete")
\ No newline at end of file
+    participations = relationship("Participant", back_populates="user", cascade="all, delete", passive_deletes=True)
+
+    __table_args__ = (
+        Index("ix_users_deleted_at", "deleted_at",
+              sqlite_where=deleted_at.isnot(None), postgresql_where=deleted_at.isnot(None)),
+    )
+
+
+# Directory search over name and email (GET /users/search), kept in sync by the database.
+# SQLite: an external-content FTS5 table maintained by triggers, with prefix indexes so short
+# prefixes stay cheap. PostgreSQL: a trigram GIN index over both columns, serving substring
+# and similarity matches. USER_SEARCH_TEXT is the indexed expression; queries must spell it
+# the same way for the index to be used.
+USER_SEARCH_TEXT = "coalesce(name, '') || ' ' || coalesce(email, '')"
+
+USER_SEARCH_DDL = {
+    "sqlite": [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5("
+        "name, email, content='users', content_rowid='id', tokenize='unicode61 remove_diacritics 2', "
+        "prefix='1 2 3')",
+
+        "CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN "
+        "INSERT INTO users_fts(rowid, name, email) VALUES (new.id, new.name, new.email); END",
+
+        "CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email); END",
+
+        "CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name, email ON users BEGIN "
+        "INSERT INTO users_fts(users_fts, rowid, name, email) VALUES ('delete', old.id, old.name, old.email); "
+        "INSERT INTO users_fts(rowid, name, email) VALUES (new.id, new.name, new.email); END",
+
+        # Indexes the users that exist already.
+        "INSERT INTO users_fts(users_fts) VALUES ('rebuild')",
+    ],
+    "postgresql": [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+
+        f"CREATE INDEX IF NOT EXISTS ix_users_search_trgm ON users USING GIN (({USER_SEARCH_TEXT}) gin_trgm_ops)",
+    ],
+}
+
+for dialect, statements in USER_SEARCH_DDL.items():
+    for statement in statements:
+        event.listen(User.__table__, "after_create", DDL(statement).execute_if(dialect=dialect))
+
+event.listen(User.__table__, "before_drop", DDL("DROP TABLE IF EXISTS users_fts").execute_if(dialect="sqlite"))
@@ -0,0 +1,22 @@
+from pydantic import BaseModel, ConfigDict, Field
+
+class BlobSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    sha256: str = Field()
+    size: int = Field()
+
+class AttachmentCreateSchema(BaseModel):
+    sha256: str = Field(pattern=r"^[0-9a-f]{64}$")
+    filename: str = Field(min_length=1, max_length=255)
+    content_type: str = Field(default="application/octet-stream", max_length=255)
+
+class AttachmentSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int = Field()
+    message_id: int = Field()
+    sha256: str = Field()
+    size: int = Field()
+    filename: str = Field()
+    content_type: str = Field()
@@ -1,9 +1,16 @@
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 
+from .message import MessageSchema
+
+# Chat.type of chats that members may invite others to.
+PUBLIC_CHAT = "Public"
+
 class ChatSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int = Field()
     name: str = Field()
     type: str = Field()
@@ -19,9 +26,23 @@ class CreatePrivateChatSchema(ChatCreateSchema):
     type: str = "Private"
 
 class CreatePublicChatSchema(ChatCreateSchema):
-    type: str = "Public"
+    type: str = PUBLIC_CHAT
 
 class ChatUpdateSchema(BaseModel):
     name: Optional[str] = None
     type: Optional[str] = None
 
+class LastMessageSchema(MessageSchema):
+    sender_user_id: Optional[int] = None
+    sender_name: Optional[str] = None
+
+class ChatSummarySchema(ChatSchema):
+    last_activity_at: datetime = Field()
+    member_count: int = Field()
+    unread_count: int = Field()
+    last_read_message_id: Optional[int] = None
+    last_message: Optional[LastMessageSchema] = None
+
+class InboxPageSchema(BaseModel):
+    chats: list[ChatSummarySchema] = Field()
+    next_cursor: Optional[str] = None
@@ -0,0 +1,13 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field
+
+from .message import MessageSchema
+
+class EventSchema(BaseModel):
+    type: Literal["message"] = "message"
+    message: MessageSchema = Field()
+
+class EventPageSchema(BaseModel):
+    events: list[EventSchema] = Field()
+    cursor: str = Field()
@@ -1,16 +1,32 @@
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 
 class MessageSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int = Field()
     sender_id: int = Field()
+    chat_id: int = Field()
     text: str = Field()
+    created_at: datetime = Field()
 
 class MessageCreateSchema(BaseModel):
     sender_id: int = Field()
     text: str = Field()
 
+class MessageBatchResultSchema(BaseModel):
+    ids: list[int] = Field()
+
 class MessageUpdateSchema(BaseModel):
-    text: Optional[str] = None
\ No newline at end of file
+    text: Optional[str] = None
+
+class MessagePageSchema(BaseModel):
+    messages: list[MessageSchema] = Field()
+    prev_cursor: Optional[str] = None
+    next_cursor: Optional[str] = None
+
+class MessageSearchPageSchema(BaseModel):
+    messages: list[MessageSchema] = Field()
+    next_cursor: Optional[str] = None
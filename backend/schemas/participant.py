@@ -1,10 +1,14 @@
 from typing import Optional
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 
 class ParticipantSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int = Field()
     user_id: int = Field()
     chat_id: int = Field()
+    last_read_message_id: Optional[int] = None
+    unread_count: int = 0
 
 class ParticipantCreateSchema(BaseModel):
     user_id: int = Field()
@@ -12,3 +16,14 @@ class ParticipantCreateSchema(BaseModel):
 
 class ParticipationSchema(ParticipantCreateSchema):
     pass
+
+class ParticipantsInviteSchema(BaseModel):
+    user_ids: list[int] = Field()
+
+class ParticipantsInviteResultSchema(BaseModel):
+    added: list[int] = Field()
+    already_participating: list[int] = Field()
+    missing_users: list[int] = Field()
+
+class ReadCursorSchema(BaseModel):
+    message_id: Optional[int] = None
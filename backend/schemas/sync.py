@@ -0,0 +1,25 @@
+from typing import Literal, Optional, Union
+
+from pydantic import BaseModel, Field
+
+from .chat import ChatSchema
+from .participant import ParticipantSchema
+from .message import MessageSchema
+from .user import UserPublicSchema
+
+# The latest state of one entity that changed after the cursor, or deleted=True. Deleting
+# a chat or a participant also deletes the messages in it / sent by them.
+class ChangeSchema(BaseModel):
+    seq: int = Field()
+    entity: Literal["chat", "participant", "message", "user"] = Field()
+    id: int = Field()
+    deleted: bool = False
+    data: Optional[Union[ChatSchema, ParticipantSchema, MessageSchema, UserPublicSchema]] = None
+
+class SyncPageSchema(BaseModel):
+    changes: list[ChangeSchema] = Field()
+    cursor: int = Field()
+    has_more: bool = False
+    # The cursor is missing or older than the retained log: reload everything, then
+    # sync from the returned cursor.
+    resync_required: bool = False
@@ -1,14 +1,27 @@
 from typing import Optional
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
+
+# What other users may see of a user.
+class UserPublicSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
 
-class UserSchema(BaseModel):
     id: int = Field()
     name: str = Field(pattern="[А-Яа-яA-Za-z0-9]+", min_length=2, max_length=50)
     email: EmailStr = Field()
     bio: str = Field(max_length=250)
     status: str = Field()
+
+class UserSchema(UserPublicSchema):
     hashed_password: str = Field()
 
+    # The same user as responses show it, without validating the fields again.
+    def public(self) -> UserPublicSchema:
+        return UserPublicSchema.model_construct(**self.model_dump(include=set(UserPublicSchema.model_fields)))
+
+class UserSearchPageSchema(BaseModel):
+    users: list[UserPublicSchema] = Field()
+    next_cursor: Optional[str] = None
+
 class UserCredentialSchema(BaseModel):
     email: EmailStr = Field()
     password: str = Field(pattern="^[a-zA-Z0-9!#$%&*+.<=>?@^_]+$", min_length=8, max_length=16)
@@ -0,0 +1,168 @@
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+# What EntityCache needs from a cache. TTLCache is the in-process implementation; an
+# out-of-process one (e.g. Redis, with pickled values) lets all workers share entries.
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: Hashable, default: Any = None) -> Any: ...
+
+    @abstractmethod
+    def set(self, key: Hashable, value: Any, tag: Optional[Hashable] = None, ttl: Optional[float] = None): ...
+
+    @abstractmethod
+    def delete(self, key: Hashable): ...
+
+    @abstractmethod
+    def clear(self): ...
+
+    @abstractmethod
+    def stats(self) -> dict[str, Any]: ...
+
+
+# LRU cache with a per-entry time to live. Entries can carry a tag (e.g. a user id)
+# so that everything derived from one row can be dropped in one call when it changes.
+class TTLCache(CacheBackend):
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.counters = Counter(hits=0, misses=0, evictions=0, invalidations=0)
+        self.__entries: OrderedDict[Hashable, tuple[float, Any, Optional[Hashable]]] = OrderedDict()
+        self.__tags: dict[Hashable, set[Hashable]] = {}
+        self.__lock = threading.Lock()
+
+    def __remove(self, key: Hashable):
+        _, _, tag = self.__entries.pop(key)
+
+        if tag is not None:
+            keys = self.__tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self.__tags[tag]
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.__lock:
+            entry = self.__entries.get(key)
+
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self.__remove(key)
+                self.counters["misses"] += 1
+                return default
+
+            self.__entries.move_to_end(key)
+            self.counters["hits"] += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, tag: Optional[Hashable] = None, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+
+            self.__entries[key] = (expires_at, value, tag)
+            if tag is not None:
+                self.__tags.setdefault(tag, set()).add(key)
+
+            while len(self.__entries) > self.maxsize:
+                self.__remove(next(iter(self.__entries)))
+                self.counters["evictions"] += 1
+
+    def delete(self, key: Hashable):
+        with self.__lock:
+            if key in self.__entries:
+                self.__remove(key)
+                self.counters["invalidations"] += 1
+
+    def invalidate_tag(self, tag: Hashable):
+        with self.__lock:
+            for key in list(self.__tags.get(tag, ())):
+                self.__remove(key)
+                self.counters["invalidations"] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__tags.clear()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+
+        return {
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            "size": len(self.__entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
+
+
+MISSING = object()
+
+
+# Read-through cache of one kind of entity, keyed by id. Every id has a version stored in
+# the backend and values are stored under "<namespace>:<id>:<version>". Writers bump the
+# version after they commit, so a value that was loaded before the write but stored after
+# it sits under the old version and is never read. A version that was evicted restarts
+# from the clock rather than from zero, so old keys can't come back either.
+# Cached values are shared between callers and must be treated as read-only.
+class EntityCache:
+    def __init__(self, namespace: str, backend: CacheBackend):
+        self.namespace = namespace
+        self.backend = backend
+        self.counters = Counter(hits=0, misses=0, invalidations=0)
+        self.__lock = threading.Lock()
+
+    def __count(self, name: str):
+        with self.__lock:
+            self.counters[name] += 1
+
+    def __version_key(self, id: Hashable) -> str:
+        return f"{self.namespace}:{id}:version"
+
+    def __version(self, id: Hashable) -> int:
+        version = self.backend.get(self.__version_key(id))
+
+        if version is None:
+            version = time.time_ns()
+            self.backend.set(self.__version_key(id), version)
+
+        return version
+
+    def get_or_load(self, id: Hashable, load: Callable[[], Any]) -> Any:
+        key = f"{self.namespace}:{id}:{self.__version(id)}"
+        value = self.backend.get(key, MISSING)
+
+        if value is not MISSING:
+            self.__count("hits")
+            return value
+
+        self.__count("misses")
+        value = load()
+        self.backend.set(key, value)
+        return value
+
+    def invalidate(self, id: Hashable):
+        old_version = self.backend.get(self.__version_key(id))
+        self.backend.set(self.__version_key(id), time.time_ns())
+
+        if old_version is not None:
+            self.backend.delete(f"{self.namespace}:{id}:{old_version}")
+        self.__count("invalidations")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+
+        return {
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else None,
+            "backend": self.backend.stats(),
+        }
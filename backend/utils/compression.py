@@ -0,0 +1,104 @@
+import re
+import zlib
+from collections import Counter
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .config import MESSAGE_COMPRESSION, MESSAGE_COMPRESSION_THRESHOLD, MESSAGE_COMPRESSION_LEVEL
+
+ENCODINGS = ("zlib", "zstd")
+# zlib only looks 32 KiB back, so a longer dictionary is never used.
+ZLIB_DICTIONARY_SIZE = 32 * 1024
+# Runs of the same kind of characters: words, numbers, punctuation with its spacing.
+SEGMENT = re.compile(r"\w+|[^\w\s]+\s*|\s+")
+
+
+# Compression of message bodies (see models/message.py). Bodies of `threshold` bytes or more
+# are compressed with `encoding`, and with the active shared dictionary when there is one:
+# a dictionary trained from our own traffic lets even a few-kilobyte log line or JSON blob
+# refer back to the keys and boilerplate every such message repeats. Dictionaries are
+# registered by id and never change, so every row can be read with the one it was written with.
+class TextCodec:
+    def __init__(self, encoding: str = MESSAGE_COMPRESSION, threshold: int = MESSAGE_COMPRESSION_THRESHOLD,
+                 level: int = MESSAGE_COMPRESSION_LEVEL):
+        if encoding not in ("none", *ENCODINGS):
+            raise ValueError(f"Unknown message compression '{encoding}', expected 'none' or one of {ENCODINGS}.")
+        if encoding == "zstd" and zstandard is None:
+            raise ValueError("MESSAGE_COMPRESSION=zstd needs the zstandard package.")
+
+        self.encoding = encoding
+        self.threshold = threshold
+        self.level = level
+        self.dictionaries: dict[int, bytes] = {}
+        self.dictionary_id: Optional[int] = None
+
+    def add_dictionary(self, id: int, data: bytes, active: bool = False):
+        self.dictionaries[id] = data
+        if active:
+            self.dictionary_id = id
+
+    def compress(self, text: str) -> Optional[tuple[str, bytes, Optional[int]]]:
+        # (encoding, data, dictionary id), or None when the text is better stored as it is.
+        raw = text.encode()
+        if self.encoding == "none" or len(raw) < self.threshold:
+            return None
+
+        dictionary = self.dictionaries.get(self.dictionary_id) if self.dictionary_id is not None else None
+        data = compress(self.encoding, raw, dictionary, self.level)
+        if len(data) >= len(raw):
+            return None
+
+        return self.encoding, data, self.dictionary_id if dictionary is not None else None
+
+
+def compress(encoding: str, raw: bytes, dictionary: Optional[bytes], level: int) -> bytes:
+    if encoding == "zstd":
+        dictionary = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=level, dict_data=dictionary).compress(raw)
+
+    compressor = zlib.compressobj(level, zdict=dictionary) if dictionary else zlib.compressobj(level)
+    return compressor.compress(raw) + compressor.flush()
+
+
+def decompress(encoding: str, data: bytes, dictionary: Optional[bytes]) -> str:
+    if encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Reading zstd compressed messages needs the zstandard package.")
+        dictionary = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(data).decode()
+
+    decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+    return (decompressor.decompress(data) + decompressor.flush()).decode()
+
+
+# message_text(encoding, data, dictionary) in SQL, for SQLite's full-text triggers.
+def message_text(encoding: Optional[str], data: Optional[bytes], dictionary: Optional[bytes]) -> Optional[str]:
+    if encoding is None or data is None:
+        return None
+
+    return decompress(encoding, data, dictionary)
+
+
+def train_dictionary(encoding: str, samples: list[str], size: int = 64 * 1024) -> bytes:
+    if encoding == "zstd":
+        return zstandard.train_dictionary(size, [sample.encode() for sample in samples]).as_bytes()
+
+    # zlib takes any bytes as a dictionary: the segments that add up to the most repeated
+    # bytes across the samples, the most valuable last, where matches are cheapest.
+    counts = Counter(segment for sample in samples for segment in SEGMENT.findall(sample))
+    dictionary, used = [], 0
+    for segment, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        encoded = segment.encode()
+        if count < 2 or used + len(encoded) > min(size, ZLIB_DICTIONARY_SIZE):
+            continue
+        dictionary.append(encoded)
+        used += len(encoded)
+
+    return b"".join(reversed(dictionary))
+
+
+message_codec = TextCodec()
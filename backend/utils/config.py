@@ -0,0 +1,114 @@
+import os
+
+# Tunables that are safe to commit. Credentials and database URLs live in secret_data.
+
+# Real-time delivery: events buffered per WebSocket before the overflow policy kicks in.
+# "drop_oldest" discards the oldest queued event, "disconnect" closes the lagging socket.
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "256"))
+REALTIME_OVERFLOW_POLICY = os.getenv("REALTIME_OVERFLOW_POLICY", "drop_oldest")
+
+# How events reach WebSockets held by other worker processes. "memory": they don't (one
+# worker). "unix": workers of one host exchange datagrams through sockets in the directory
+# REALTIME_BROKER_URL. "postgres": LISTEN/NOTIFY on REALTIME_BROKER_CHANNEL reaches workers
+# on every host; REALTIME_BROKER_URL defaults to the application database.
+REALTIME_BROKER = os.getenv("REALTIME_BROKER", "memory")
+REALTIME_BROKER_URL = os.getenv("REALTIME_BROKER_URL", "")
+REALTIME_BROKER_CHANNEL = os.getenv("REALTIME_BROKER_CHANNEL", "chat_events")
+
+# GET /events for clients without WebSockets: a long poll parks for at most EVENTS_POLL_TIMEOUT
+# seconds, an event stream sends a keep-alive comment after EVENTS_KEEPALIVE idle seconds.
+# Either returns at most EVENTS_BATCH_LIMIT messages at a time.
+EVENTS_POLL_TIMEOUT = float(os.getenv("EVENTS_POLL_TIMEOUT", "25"))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+EVENTS_BATCH_LIMIT = int(os.getenv("EVENTS_BATCH_LIMIT", "100"))
+
+# Database. DATABASE_URL in the environment wins over secret_data (handy for benchmarks).
+# ASYNC_DATABASE switches request handling to AsyncEngine/AsyncSession (aiosqlite/asyncpg);
+# otherwise the synchronous engine is used from the threadpool.
+DATABASE_URL_OVERRIDE = os.getenv("DATABASE_URL")
+ASYNC_DATABASE = os.getenv("ASYNC_DATABASE", "false").lower() in ("1", "true", "yes")
+
+# Debug mode adds X-DB-Queries / X-DB-Time-ms / X-DB-Max-Repeats headers to every
+# response. Statements repeated QUERY_REPEAT_THRESHOLD times in one request are logged
+# as likely N+1 lookups either way.
+DEBUG = os.getenv("DEBUG", "false").lower() in ("1", "true", "yes")
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+# Connection pool, per engine and per worker process: size workers so that
+# workers * (POOL_SIZE + MAX_OVERFLOW) stays below the server's max_connections.
+# Checkouts wait up to POOL_TIMEOUT seconds before failing; connections older than
+# POOL_RECYCLE seconds are replaced (-1 never); PRE_PING tests each one on checkout.
+# Live numbers are served at /internal/database/pool.
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "5"))
+DATABASE_MAX_OVERFLOW = int(os.getenv("DATABASE_MAX_OVERFLOW", "10"))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", "30"))
+DATABASE_POOL_RECYCLE = int(os.getenv("DATABASE_POOL_RECYCLE", "1800"))
+DATABASE_POOL_PRE_PING = os.getenv("DATABASE_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+
+# Registration checks that the e-mail domain accepts mail (DNS lookups). Turn off for
+# offline runs such as benchmarks.
+EMAIL_CHECK_DELIVERABILITY = os.getenv("EMAIL_CHECK_DELIVERABILITY", "true").lower() in ("1", "true", "yes")
+
+# Password hashing runs in a dedicated process pool. Requests beyond MAX_PENDING
+# (running + queued) are turned away with 503 instead of piling up behind bcrypt.
+PASSWORD_HASHER_WORKERS = int(os.getenv("PASSWORD_HASHER_WORKERS", "2"))
+PASSWORD_HASHER_MAX_PENDING = int(os.getenv("PASSWORD_HASHER_MAX_PENDING", "32"))
+
+# Authenticated-user cache used by get_current_user, keyed by token. Entries are dropped
+# when the user changes or is removed in this process; TTL bounds staleness elsewhere.
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+
+# Read-through caches in front of find_user, find_chat and find_chat_participants,
+# invalidated by the repositories' own writes. Size is per cache.
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "50000"))
+ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "300"))
+
+# Full-text search. On PostgreSQL this is the text search configuration of the
+# tsvector column; "simple" doesn't stem, which keeps mixed-language chats searchable.
+SEARCH_LANGUAGE = os.getenv("SEARCH_LANGUAGE", "simple")
+
+# Upper bound for POST /messages/batch; bigger batches are rejected with 413.
+MESSAGE_BATCH_MAX_SIZE = int(os.getenv("MESSAGE_BATCH_MAX_SIZE", "1000"))
+
+# Message bodies of MESSAGE_COMPRESSION_THRESHOLD bytes or more are stored compressed with
+# MESSAGE_COMPRESSION ("zlib", "zstd" with the zstandard package, or "none") at
+# MESSAGE_COMPRESSION_LEVEL. MESSAGE_COMPRESSION_DICTIONARY is the path of a shared
+# dictionary trained from our own messages (see benchmarks/compression.py); it's registered
+# in the database at startup and used for new rows from then on.
+MESSAGE_COMPRESSION = os.getenv("MESSAGE_COMPRESSION", "zlib")
+MESSAGE_COMPRESSION_THRESHOLD = int(os.getenv("MESSAGE_COMPRESSION_THRESHOLD", "1024"))
+MESSAGE_COMPRESSION_LEVEL = int(os.getenv("MESSAGE_COMPRESSION_LEVEL", "6"))
+MESSAGE_COMPRESSION_DICTIONARY = os.getenv("MESSAGE_COMPRESSION_DICTIONARY", "")
+
+# Group commit for POST /messages/. When on, sends arriving within MESSAGE_GROUP_COMMIT_DELAY_MS
+# of each other (at most MESSAGE_GROUP_COMMIT_SIZE of them) share one transaction and commit.
+# A longer delay means bigger groups and fewer commits for up to that much added latency.
+MESSAGE_GROUP_COMMIT = os.getenv("MESSAGE_GROUP_COMMIT", "false").lower() in ("1", "true", "yes")
+MESSAGE_GROUP_COMMIT_DELAY_MS = float(os.getenv("MESSAGE_GROUP_COMMIT_DELAY_MS", "2"))
+MESSAGE_GROUP_COMMIT_SIZE = int(os.getenv("MESSAGE_GROUP_COMMIT_SIZE", "200"))
+
+# Upper bound for one bulk invitation (POST /chats/{id}/participants).
+PARTICIPANT_BATCH_MAX_SIZE = int(os.getenv("PARTICIPANT_BATCH_MAX_SIZE", "10000"))
+
+# Deleting a chat or user with more than PURGE_INLINE_LIMIT messages only marks it deleted;
+# a background job then removes its rows PURGE_BATCH_SIZE at a time, one transaction per
+# batch, checking for work every PURGE_INTERVAL seconds. Progress is at /internal/purge.
+PURGE_INLINE_LIMIT = int(os.getenv("PURGE_INLINE_LIMIT", "1000"))
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "1000"))
+PURGE_INTERVAL = float(os.getenv("PURGE_INTERVAL", "5"))
+
+# Change log behind GET /sync. Changes older than CHANGE_LOG_RETENTION seconds are pruned by
+# the purge job; a client whose cursor predates them is told to resync in full. A page
+# holds at most SYNC_PAGE_SIZE changes.
+CHANGE_LOG_RETENTION = float(os.getenv("CHANGE_LOG_RETENTION", str(30 * 24 * 3600)))
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "500"))
+
+# Attachments. Blobs are stored once per distinct content under ATTACHMENTS_DIR, named by
+# their SHA-256. Uploads are streamed to disk ATTACHMENT_CHUNK_SIZE bytes at a time and
+# rejected with 413 past ATTACHMENT_MAX_SIZE. Blobs no message refers to are removed by the
+# purge job once they are ATTACHMENT_ORPHAN_TTL seconds old.
+ATTACHMENTS_DIR = os.getenv("ATTACHMENTS_DIR", "attachments")
+ATTACHMENT_MAX_SIZE = int(os.getenv("ATTACHMENT_MAX_SIZE", str(2 * 1024 ** 3)))
+ATTACHMENT_CHUNK_SIZE = int(os.getenv("ATTACHMENT_CHUNK_SIZE", str(1024 ** 2)))
+ATTACHMENT_ORPHAN_TTL = float(os.getenv("ATTACHMENT_ORPHAN_TTL", str(24 * 3600)))
@@ -0,0 +1,99 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds (ms) of the checkout wait histogram; the last bucket catches the rest.
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+# Connection pool statistics for one engine. Checkout waits are timed by the pool
+# class from instrumented_pool_class, connection churn comes from pool events.
+class PoolMonitor:
+    def __init__(self):
+        self.counters = Counter(checkouts=0, timeouts=0, connects=0, closes=0, invalidations=0)
+        self.wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.engine = None
+        self.__lock = threading.Lock()
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        milliseconds = seconds * 1000
+
+        with self.__lock:
+            self.counters["timeouts" if timed_out else "checkouts"] += 1
+            self.wait_histogram[bisect_left(WAIT_BUCKETS_MS, milliseconds)] += 1
+            self.wait_total += milliseconds
+            self.wait_max = max(self.wait_max, milliseconds)
+
+    def count(self, name: str):
+        with self.__lock:
+            self.counters[name] += 1
+
+    def attach(self, engine):
+        self.engine = engine
+
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            self.count("connects")
+
+        @event.listens_for(engine, "close")
+        def on_close(dbapi_connection, connection_record):
+            self.count("closes")
+
+        @event.listens_for(engine, "close_detached")
+        def on_close_detached(dbapi_connection):
+            self.count("closes")
+
+        @event.listens_for(engine, "invalidate")
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            self.count("invalidations")
+
+    def stats(self) -> dict:
+        with self.__lock:
+            waits = sum(self.wait_histogram)
+            stats = {
+                **self.counters,
+                "wait_ms": {
+                    "mean": round(self.wait_total / waits, 3) if waits else 0.0,
+                    "max": round(self.wait_max, 3),
+                    "histogram": {
+                        **{f"le_{bound}": count for bound, count in zip(WAIT_BUCKETS_MS, self.wait_histogram)},
+                        "inf": self.wait_histogram[-1],
+                    },
+                },
+            }
+
+        # engine.dispose() swaps the pool object; engine.pool always has the live one.
+        pool = self.engine.pool if self.engine is not None else None
+
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(),
+                         checked_in=pool.checkedin(), overflow=pool.overflow())
+
+        return stats
+
+
+class InstrumentedPool:
+    monitor: PoolMonitor
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.monitor.record_wait(time.perf_counter() - started, timed_out=True)
+            raise
+
+        self.monitor.record_wait(time.perf_counter() - started)
+        return connection
+
+
+# A subclass of `pool_class` reporting to `monitor`. Being a class (not a wrapper around
+# one pool instance) it survives engine.dispose(), which recreates the pool.
+def instrumented_pool_class(pool_class: type, monitor: PoolMonitor) -> type:
+    return type(f"Instrumented{pool_class.__name__}", (InstrumentedPool, pool_class), {"monitor": monitor})
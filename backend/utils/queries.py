@@ -0,0 +1,93 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from sqlalchemy import event
+
+logger = logging.getLogger("messenger.queries")
+
+
+# Statements executed while handling one request. Identical SQL text is one "shape":
+# parameters are bound separately, so a shape seen many times in one request is
+# usually a lookup per item (N+1).
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes: Counter[str] = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[" ".join(statement.split())] += 1
+
+    def repeated(self, threshold: int = 2) -> dict[str, int]:
+        return {shape: count for shape, count in self.shapes.most_common() if count >= threshold}
+
+    def summary(self) -> dict:
+        return {"queries": self.count, "db_ms": round(self.seconds * 1000, 3),
+                "max_repeats": max(self.shapes.values(), default=0)}
+
+
+# Set per request by QueryStatsMiddleware. The object is shared, not copied, so statements
+# run from the threadpool or through AsyncSession.run_sync are counted too.
+current_queries: ContextVar[Optional[QueryStats]] = ContextVar("current_queries", default=None)
+
+# Called with (scope, stats) after every request; used by tests to enforce query budgets.
+query_listeners: list[Callable[[dict, QueryStats], None]] = []
+
+
+def track_queries(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        stats = current_queries.get()
+
+        if stats is not None:
+            stats.record(statement, time.perf_counter() - started)
+
+
+class QueryStatsMiddleware:
+    def __init__(self, app, headers: bool = False, repeat_threshold: int = 5):
+        self.app = app
+        self.headers = headers
+        self.repeat_threshold = repeat_threshold
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = QueryStats()
+        token = current_queries.set(stats)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and self.headers:
+                summary = stats.summary()
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"],
+                                      (b"x-db-queries", str(summary["queries"]).encode()),
+                                      (b"x-db-time-ms", str(summary["db_ms"]).encode()),
+                                      (b"x-db-max-repeats", str(summary["max_repeats"]).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current_queries.reset(token)
+            self.report(scope, stats)
+
+    def report(self, scope: dict, stats: QueryStats):
+        route = f"{scope['method']} {scope['path']}"
+        logger.debug("%s", route, extra=stats.summary())
+
+        for shape, count in stats.repeated(self.repeat_threshold).items():
+            logger.warning("%s ran the same statement %d times: %s", route, count, shape)
+
+        for listener in query_listeners:
+            listener(scope, stats)
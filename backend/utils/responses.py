@@ -0,0 +1,69 @@
+import json
+import os
+from functools import lru_cache
+from typing import Any
+
+from pydantic import BaseModel, TypeAdapter
+from starlette.datastructures import Headers
+from starlette.responses import Response, FileResponse
+from starlette.types import Scope, Receive, Send
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@lru_cache(maxsize=None)
+def adapter(schema: Any) -> TypeAdapter:
+    return TypeAdapter(schema)
+
+
+# JSON response for values that are already validated schemas. Returning a Response makes
+# FastAPI skip its response_model pass (dump to dict, validate again, serialize, json.dumps),
+# so a schema built once in the repository is serialized once, by pydantic-core.
+# response_model stays on the route for the OpenAPI docs.
+class ModelResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return adapter(type(content)).dump_json(content)
+
+        if isinstance(content, list) and content and isinstance(content[0], BaseModel):
+            return adapter(list[type(content[0])]).dump_json(content)
+
+        if orjson is not None:
+            return orjson.dumps(content)
+
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+# Download of a content-addressed file (see logic/attachments.py). The content behind a hash
+# never changes, so the hash is a strong ETag and clients may cache it for good. FileResponse
+# answers Range and If-Range requests (206, multipart ranges, 416) and streams the file in
+# chunks. When the server offers the ASGI "http.response.pathsend" extension, a whole-file
+# response is handed to it as a path instead and the server sends it with sendfile(),
+# without the bytes passing through Python.
+class BlobResponse(FileResponse):
+    def __init__(self, path: str, sha256: str, stat_result: os.stat_result, media_type: str,
+                 filename: str, chunk_size: int = 1024 ** 2):
+        super().__init__(path, media_type=media_type, filename=filename, stat_result=stat_result,
+                         headers={"etag": f'"{sha256}"',
+                                  "cache-control": "private, max-age=31536000, immutable",
+                                  "x-content-type-options": "nosniff"})
+        self.chunk_size = chunk_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        headers = Headers(scope=scope)
+
+        if headers.get("if-none-match") == self.headers["etag"]:
+            headers = {key: self.headers[key] for key in ("etag", "cache-control")}
+            return await Response(status_code=304, headers=headers)(scope, receive, send)
+
+        if ("http.response.pathsend" not in scope.get("extensions", {})
+                or scope["method"].upper() == "HEAD" or "range" in headers):
+            return await super().__call__(scope, receive, send)
+
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
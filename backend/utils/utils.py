@@ -1,3 +1,6 @@
+import json
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+
 
 def generate_name() -> str:
     from random import randint
@@ -7,5 +10,29 @@ def generate_name() -> str:
     jobs = ["Плотник", "Дизайнер", "Программист", "Архитектор", "Учитель",
         "Шахтёр", "Грузчик", "Врач", "Следователь", "Полицейский",
         "Маляр", "Биолог", "Физик", "Охранник", "Директор"]
-    
-    return f"{names[randint(0, len(names)-1)]}-{jobs[randint(0, len(jobs)-1)]} {randint(0, 100)}"
\ No newline at end of file
+
+    return f"{names[randint(0, len(names)-1)]}-{jobs[randint(0, len(jobs)-1)]} {randint(0, 100)}"
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# decode_cursor(cursor, int) or decode_cursor(cursor, (int, float), int): the values of a
+# cursor made by encode_cursor, checked against the type expected at each position, as
+# clients may send anything back.
+def decode_cursor(cursor: str, *types) -> list:
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError(f"Malformed cursor: {cursor!r}")
+
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError(f"Malformed cursor: {cursor!r}")
+
+    if any(isinstance(value, bool) or not isinstance(value, kind) for value, kind in zip(values, types)):
+        raise ValueError(f"Malformed cursor: {cursor!r}")
+
+    return values
@@ -0,0 +1,231 @@
+# Storage and read latency of message bodies with and without compression.
+#
+# Run from the directory that contains the project package:
+#   python -m messenger.benchmarks.compression --messages 20000 --bot-share 0.3
+#
+# Every setting stores the same seeded traffic (short chat messages plus bot posts: JSON
+# event dumps and log excerpts of a few kilobytes) in a fresh SQLite database, in a fresh
+# interpreter because the codec is configured at import time. "+dict" settings use a shared
+# dictionary trained from a separate sample of the same kind of traffic.
+#
+# To train the dictionary for MESSAGE_COMPRESSION_DICTIONARY from real traffic instead:
+#   DATABASE_URL=... python -m messenger.benchmarks.compression --train messages.dict
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from .concurrency import percentile
+from .dataset import WORDS
+
+SERVICES = ("billing-worker", "notifier", "search-indexer", "media-transcoder", "auth-gateway")
+PATHS = ("/api/v1/orders", "/api/v1/invoices/{id}", "/internal/sync", "/api/v1/users/{id}/avatar", "/health")
+LEVELS = ("DEBUG", "INFO", "INFO", "WARNING", "ERROR")
+
+
+def bot_message(rng: random.Random) -> str:
+    service = rng.choice(SERVICES)
+
+    if rng.random() < 0.5:
+        return json.dumps({"service": service, "host": f"{service}-{rng.randint(1, 12)}", "events": [
+            {"ts": 1_700_000_000 + rng.randint(0, 10 ** 6), "request_id": f"{rng.getrandbits(64):016x}",
+             "path": rng.choice(PATHS).format(id=rng.randint(1, 10 ** 6)), "status": rng.choice((200, 200, 404, 500)),
+             "latency_ms": round(rng.expovariate(1 / 80), 1)}
+            for _ in range(rng.randint(8, 50))]}, indent=2)
+
+    return "\n".join(f"2024-05-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:"
+                     f"{rng.randint(0, 59):02d}Z {rng.choice(LEVELS)} [{service}] "
+                     f"{' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))} "
+                     f"request_id={rng.getrandbits(64):016x} elapsed={rng.randint(1, 5000)}ms"
+                     for _ in range(rng.randint(15, 80)))
+
+
+def traffic(count: int, bot_share: float, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    return [bot_message(rng) if rng.random() < bot_share
+            else " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 20)))
+            for _ in range(count)]
+
+
+def seed_sender() -> tuple[int, int]:
+    from ..backend.database import SessionLocal
+    from ..backend.logic.users import UserRepository
+    from ..backend.logic.chats import ChatRepository
+    from ..backend.logic.particpants import ParticipantRepository
+    from ..backend.schemas.user import UserCreateSchema
+    from ..backend.schemas.chat import CreatePublicChatSchema
+    from ..backend.schemas.participant import ParticipantCreateSchema
+
+    db = SessionLocal()
+    user = UserRepository(db).add_user(UserCreateSchema(email="bench@gmail.com", password="123123123",
+                                                        repeated_password="123123123"), "not a hash")
+    chat = ChatRepository(db).add_chat(CreatePublicChatSchema(name="Bots"))
+    sender = ParticipantRepository(db).add_participant(ParticipantCreateSchema(user_id=user.id, chat_id=chat.id))
+    db.close()
+
+    return chat.id, sender.id
+
+
+def run_worker(args):
+    from sqlalchemy import func, text
+
+    from ..backend.database import SessionLocal, get_engine
+    from ..backend.migrations import migrate
+    from ..backend.models.message import Message
+    from ..backend.logic.messages import MessageRepository, load_message_dictionaries
+    from ..backend.schemas.message import MessageCreateSchema
+
+    migrate(get_engine())
+    with SessionLocal() as db:
+        load_message_dictionaries(db)
+    chat_id, sender_id = seed_sender()
+    bodies = traffic(args.messages, args.bot_share, args.seed)
+
+    db = SessionLocal()
+    repository = MessageRepository(db)
+    started = time.perf_counter()
+    for start in range(0, len(bodies), 500):
+        repository.add_messages([MessageCreateSchema(sender_id=sender_id, text=body)
+                                 for body in bodies[start:start + 500]], {sender_id: chat_id})
+    write_seconds = time.perf_counter() - started
+
+    stored = db.query(func.sum(func.coalesce(func.length(Message.plain_text), 0)
+                               + func.coalesce(func.length(Message.compressed_text), 0))).scalar()
+    compressed = db.query(func.count()).filter(Message.text_encoding.isnot(None)).scalar()
+    db.close()
+
+    with get_engine().connect() as connection:
+        connection.execute(text("VACUUM"))
+        page_size = connection.execute(text("PRAGMA page_size")).scalar()
+        try:
+            table_bytes = connection.execute(text("SELECT sum(pgsize) FROM dbstat WHERE name = 'messages'")).scalar()
+        except Exception:
+            table_bytes = None
+        file_bytes = connection.execute(text("PRAGMA page_count")).scalar() * page_size
+
+    # Reads: history pages from random points, and single bot messages by id.
+    rng = random.Random(args.seed)
+    db = SessionLocal()
+    repository = MessageRepository(db)
+    page_latencies, single_latencies = [], []
+    for _ in range(args.reads):
+        before_id = rng.randint(50, len(bodies))
+        started = time.perf_counter()
+        repository.find_chat_messages(chat_id, limit=50, before_id=before_id)
+        page_latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        repository.find_message(rng.randint(1, len(bodies)))
+        single_latencies.append(time.perf_counter() - started)
+    db.close()
+
+    print(json.dumps({
+        "setting": args.setting,
+        "compressed_rows": compressed,
+        "raw_mb": round(sum(len(body.encode()) for body in bodies) / 1024 ** 2, 2),
+        "stored_mb": round(stored / 1024 ** 2, 2),
+        "table_mb": round(table_bytes / 1024 ** 2, 2) if table_bytes else None,
+        "file_mb": round(file_bytes / 1024 ** 2, 2),
+        "writes_per_s": round(len(bodies) / write_seconds, 1),
+        "page_p50_ms": round(percentile(page_latencies, 0.50) * 1000, 3),
+        "page_p99_ms": round(percentile(page_latencies, 0.99) * 1000, 3),
+        "get_p50_ms": round(percentile(single_latencies, 0.50) * 1000, 3),
+        "get_p99_ms": round(percentile(single_latencies, 0.99) * 1000, 3),
+    }))
+
+
+def run_all(args):
+    from ..backend.utils.compression import train_dictionary, zstandard
+
+    package = __spec__.name.rsplit(".", 2)[0]
+    parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    encodings = ["zlib", "zstd"] if zstandard is not None else ["zlib"]
+    settings = ["none", *(f"{encoding}{suffix}" for encoding in encodings for suffix in ("", "+dict"))]
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Trained on other messages than the ones stored, as it would be in production.
+        samples = traffic(args.messages // 4, args.bot_share, args.seed + 1)
+        samples = [sample for sample in samples if len(sample) >= args.threshold]
+        for encoding in encodings:
+            with open(f"{directory}/{encoding}.dict", "wb") as file:
+                file.write(train_dictionary(encoding, samples))
+
+        for setting in settings:
+            encoding, _, dictionary = setting.partition("+")
+            env = {
+                **os.environ,
+                "DATABASE_URL": f"sqlite:///{directory}/{setting}.db",
+                "MESSAGE_COMPRESSION": encoding,
+                "MESSAGE_COMPRESSION_THRESHOLD": str(args.threshold),
+                "MESSAGE_COMPRESSION_DICTIONARY": f"{directory}/{encoding}.dict" if dictionary else "",
+            }
+
+            output = subprocess.run(
+                [sys.executable, "-m", f"{package}.benchmarks.compression", "--worker", "--setting", setting,
+                 "--messages", str(args.messages), "--bot-share", str(args.bot_share), "--seed", str(args.seed),
+                 "--reads", str(args.reads)],
+                cwd=parent, env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'setting':<11}{'rows':>7}{'raw MB':>8}{'body MB':>9}{'table MB':>10}{'file MB':>9}{'writes/s':>10}"
+          f"{'page p50':>10}{'page p99':>10}{'get p50':>9}{'get p99':>9}")
+    for result in results:
+        print(f"{result['setting']:<11}{result['compressed_rows']:>7}{result['raw_mb']:>8}{result['stored_mb']:>9}"
+              f"{str(result['table_mb']):>10}{result['file_mb']:>9}{result['writes_per_s']:>10}"
+              f"{result['page_p50_ms']:>10}{result['page_p99_ms']:>10}{result['get_p50_ms']:>9}"
+              f"{result['get_p99_ms']:>9}")
+
+
+def train(args):
+    from sqlalchemy import func, or_
+
+    from ..backend.database import SessionLocal
+    from ..backend.models.message import Message
+    from ..backend.utils.compression import message_codec, train_dictionary
+
+    # Bodies big enough to be compressed, whether they are already or not.
+    db = SessionLocal()
+    messages = (db.query(Message)
+                .filter(or_(Message.text_encoding.isnot(None),
+                            func.length(Message.plain_text) >= message_codec.threshold))
+                .order_by(Message.id.desc())
+                .limit(args.samples))
+    samples = [message.text for message in messages]
+    db.close()
+
+    dictionary = train_dictionary(message_codec.encoding, samples)
+    with open(args.train, "wb") as file:
+        file.write(dictionary)
+    print(f"{len(dictionary)} byte {message_codec.encoding} dictionary from {len(samples)} messages in {args.train}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare message storage and reads with and without compression.")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--bot-share", type=float, default=0.3, help="Share of messages that are bot posts.")
+    parser.add_argument("--threshold", type=int, default=1024, help="MESSAGE_COMPRESSION_THRESHOLD to use.")
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--train", metavar="PATH",
+                        help="Write a dictionary trained from the configured database's compressed messages.")
+    parser.add_argument("--samples", type=int, default=5000, help="Messages to train a dictionary from.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--setting", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.train:
+        train(args)
+    elif args.worker:
+        run_worker(args)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# Concurrent-request throughput of the database layer in each execution mode.
+#
+#   inline      repositories called straight from the async handlers (the old behaviour)
+#   threadpool  sync engine, repository calls offloaded by AsyncRepository (ASYNC_DATABASE=0)
+#   async       AsyncEngine/AsyncSession, repository calls through run_sync (ASYNC_DATABASE=1)
+#
+# Run from the directory that contains the project package:
+#   python -m messenger.benchmarks.concurrency --requests 2000 --concurrency 100 --latency-ms 2
+#
+# Every mode runs in a fresh interpreter because the mode is read from the environment at
+# import time. On SQLite --latency-ms adds a sleep to every statement *in the thread that
+# executes it*, standing in for the network round trip a PostgreSQL server would add.
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ("inline", "threadpool", "async")
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def add_statement_latency(engine, latency: float):
+    from sqlalchemy import event
+
+    def delay(statement):
+        time.sleep(latency)
+
+    @event.listens_for(engine, "connect")
+    def install_trace(dbapi_connection, connection_record):
+        if hasattr(dbapi_connection, "driver_connection"):
+            # aiosqlite: the sqlite3 connection belongs to aiosqlite's worker thread.
+            driver = dbapi_connection.driver_connection
+            dbapi_connection.await_(driver._execute(driver._conn.set_trace_callback, delay))
+        else:
+            dbapi_connection.set_trace_callback(delay)
+
+
+def make_inline():
+    from ..backend.database import AsyncRepository
+
+    def __getattr__(self, name):
+        method = getattr(self.repository_class, name)
+
+        async def call(*args, **kwargs):
+            return method(self.repository_class(self.db), *args, **kwargs)
+
+        return call
+
+    AsyncRepository.__getattr__ = __getattr__
+
+
+def seed() -> tuple[int, str]:
+    from ..backend.database import SessionLocal, get_engine
+    from ..backend.migrations import migrate
+    from ..backend.logic.users import UserRepository
+    from ..backend.logic.passwords import hash_password
+    from ..backend.logic.chats import ChatRepository
+    from ..backend.logic.particpants import ParticipantRepository
+    from ..backend.logic.messages import MessageRepository
+    from ..backend.logic.tokens import generate_access_token
+    from ..backend.schemas.user import UserCreateSchema
+    from ..backend.schemas.chat import CreatePublicChatSchema
+    from ..backend.schemas.participant import ParticipantCreateSchema
+    from ..backend.schemas.message import MessageCreateSchema
+
+    migrate(get_engine())
+
+    db = SessionLocal()
+    user = UserRepository(db).add_user(UserCreateSchema(email="bench@gmail.com", password="123123123",
+                                                        repeated_password="123123123"),
+                                                        hash_password("123123123"))
+    chat = ChatRepository(db).add_chat(CreatePublicChatSchema(name="Benchmark"))
+    sender = ParticipantRepository(db).add_participant(ParticipantCreateSchema(user_id=user.id, chat_id=chat.id))
+    for i in range(200):
+        MessageRepository(db).add_message(MessageCreateSchema(sender_id=sender.id, text=f"message {i}"))
+    db.close()
+
+    return chat.id, generate_access_token(user.id, user.email)
+
+
+async def drive(app, chat_id: int, token: str, requests: int, concurrency: int) -> dict:
+    import httpx
+
+    latencies: list[float] = []
+    remaining = iter(range(requests))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 cookies={"token": token}) as client:
+        async def worker():
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get(f"/chats/{chat_id}/messages", params={"limit": 20})
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "throughput": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+    }
+
+
+def run_worker(args):
+    from ..main import app
+    from ..backend import database
+
+    chat_id, token = seed()
+    # Seeding left connections in the pool; start clean so every connection gets the latency hook.
+    database.engine.dispose()
+
+    if args.mode == "inline":
+        make_inline()
+
+    if args.latency_ms:
+        target = database.async_engine.sync_engine if database.ASYNC_DATABASE else database.engine
+        add_statement_latency(target, args.latency_ms / 1000)
+
+    result = asyncio.run(drive(app, chat_id, token, args.requests, args.concurrency))
+    print(json.dumps({"mode": args.mode, **result}))
+
+
+def run_all(args):
+    package = __spec__.name.rsplit(".", 2)[0]
+    parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = []
+
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                **os.environ,
+                "DATABASE_URL": f"sqlite:///{directory}/bench.db",
+                "ASYNC_DATABASE": "1" if mode == "async" else "0",
+            }
+            if args.database_url:
+                env["DATABASE_URL"] = args.database_url
+
+            output = subprocess.run(
+                [sys.executable, "-m", f"{package}.benchmarks.concurrency", "--worker", "--mode", mode,
+                 "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+                 "--latency-ms", str(args.latency_ms)],
+                cwd=parent, env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'mode':<12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for result in results:
+        print(f"{result['mode']:<12}{result['throughput']:>10}{result['p50_ms']:>10}{result['p95_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare concurrent throughput of the database execution modes.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--database-url", default=None,
+                        help="Benchmark against this database instead of a throwaway SQLite file.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+# Deterministic, production-shaped dataset for scale testing.
+#
+# Run from the directory that contains the project package:
+#   python -m messenger.benchmarks.dataset generate --preset small --seed 1 --snapshot small-1.db
+#   python -m messenger.benchmarks.dataset generate --preset medium --database-url postgresql://...
+#   python -m messenger.benchmarks.dataset restore small-1.db /tmp/bench.db
+#
+# Shape: most chats are 1:1 private chats, group sizes are Pareto-distributed with a few
+# huge groups on top, and messages per chat follow a long-tailed distribution. Every user
+# has the password "123123123". Rows go in with bulk Core inserts in chunks, with explicit
+# primary keys; the denormalized summaries (member counts, last message, unread counters)
+# are then derived in SQL. The same preset and seed always give the same rows.
+#
+# Snapshots are SQLite files written with the backup API; restoring one is a file copy,
+# which is much faster than generating again. On PostgreSQL use pg_dump/pg_restore instead.
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+
+from sqlalchemy import create_engine, event, insert, text
+
+PASSWORD = "123123123"
+# bcrypt of PASSWORD, fixed so that runs are reproducible (and bcrypt isn't run per user).
+PASSWORD_HASH = "$2b$12$i.C0uNmM51p1Ox7xTDkZEObsJFeE6WCIj2wiPENeSnvuw6U.szlEi"
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HISTORY = timedelta(days=365)
+CHUNK_SIZE = 10_000
+# Share of participants who are behind in a chat, and by how many of its latest messages at most.
+BEHIND_SHARE = 0.1
+MAX_UNREAD = 20
+
+WORDS = ("hello hi ok yes no thanks sure later today tomorrow meeting lunch call code review deploy "
+         "bug fix test release coffee weekend photo link price order ticket train flight hotel game "
+         "music movie book doctor school homework project design budget report invoice").split()
+
+
+@dataclass(frozen=True)
+class Preset:
+    users: int
+    private_chats: int
+    group_chats: int
+    messages: int
+
+
+PRESETS = {
+    "tiny": Preset(users=1_000, private_chats=1_500, group_chats=50, messages=20_000),
+    "small": Preset(users=10_000, private_chats=15_000, group_chats=500, messages=200_000),
+    "medium": Preset(users=100_000, private_chats=150_000, group_chats=5_000, messages=2_000_000),
+    "large": Preset(users=1_000_000, private_chats=1_500_000, group_chats=50_000, messages=20_000_000),
+}
+
+
+def chunked(rows, size: int = CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def plan_chats(preset: Preset, rng: random.Random) -> list[list[int]]:
+    # Member user ids per chat: three huge groups first, then Pareto-sized groups, then 1:1 chats.
+    members = []
+    huge = [preset.users // 2, preset.users // 5, preset.users // 10]
+
+    for number in range(preset.group_chats):
+        size = huge[number] if number < len(huge) else int(3 * rng.paretovariate(1.2))
+        members.append(rng.sample(range(1, preset.users + 1), max(3, min(size, preset.users))))
+
+    for _ in range(preset.private_chats):
+        members.append(rng.sample(range(1, preset.users + 1), 2))
+
+    return members
+
+
+def message_rows(preset: Preset, chat_members: list[list[int]], first_participant_ids: list[int],
+                 rng: random.Random):
+    cumulative_weights = list(accumulate(rng.paretovariate(1.1) for _ in chat_members))
+    total_weight = cumulative_weights[-1]
+
+    for id in range(1, preset.messages + 1):
+        chat = bisect_left(cumulative_weights, rng.random() * total_weight)
+        sender = first_participant_ids[chat] + rng.randrange(len(chat_members[chat]))
+        words = min(40, int(rng.paretovariate(1.5)))
+        yield {"id": id, "chat_id": chat + 1, "sender_id": sender,
+               "text": " ".join(rng.choice(WORDS) for _ in range(words)),
+               "created_at": START + HISTORY * (id / (preset.messages + 1))}
+
+
+# Denormalized columns, derived from the inserted rows with set-based statements.
+SUMMARY_SQL = [
+    "UPDATE chats SET last_message_id = (SELECT max(id) FROM messages WHERE messages.chat_id = chats.id)",
+    "UPDATE chats SET last_activity_at = coalesce((SELECT created_at FROM messages "
+    "WHERE messages.id = chats.last_message_id), created_at)",
+    "UPDATE participants SET last_read_message_id = (SELECT last_message_id FROM chats "
+    "WHERE chats.id = participants.chat_id)",
+]
+BEHIND_SQL = [
+    "UPDATE participants SET last_read_message_id = (SELECT id FROM messages WHERE messages.chat_id = :chat_id "
+    "ORDER BY id DESC LIMIT 1 OFFSET :behind) WHERE id = :id",
+    "UPDATE participants SET unread_count = (SELECT count(*) FROM messages "
+    "WHERE messages.chat_id = participants.chat_id AND messages.id > coalesce(participants.last_read_message_id, 0) "
+    "AND messages.sender_id != participants.id) WHERE id = :id",
+]
+
+
+def generate(engine, preset: Preset, seed: int, log=print):
+    from ..backend.database import Base
+    from ..backend.migrations import migrate, schema_migrations
+    from ..backend.models.user import User
+    from ..backend.models.chat import Chat
+    from ..backend.models.participant import Participant
+    from ..backend.models.message import Message
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    def progress(step: str):
+        log(f"{step} after {time.perf_counter() - started:.1f}s")
+
+    Base.metadata.drop_all(bind=engine)
+    schema_migrations.drop(bind=engine, checkfirst=True)
+    migrate(engine)
+
+    chat_members = plan_chats(preset, rng)
+    first_participant_ids = list(accumulate((len(members) for members in chat_members[:-1]), initial=1))
+
+    with engine.begin() as connection:
+        for rows in chunked({"id": id, "name": f"User {id}", "email": f"user{id}@example.org", "bio": "",
+                             "status": "", "hashed_password": PASSWORD_HASH}
+                            for id in range(1, preset.users + 1)):
+            connection.execute(insert(User.__table__), rows)
+        progress(f"{preset.users} users")
+
+        for rows in chunked({"id": chat + 1, "name": f"Group {chat + 1}" if len(members) > 2 else "Private",
+                             "type": "Public" if len(members) > 2 else "Private",
+                             "created_at": START, "updated_at": START, "last_activity_at": START,
+                             "member_count": len(members)}
+                            for chat, members in enumerate(chat_members)):
+            connection.execute(insert(Chat.__table__), rows)
+
+        for rows in chunked({"id": first_participant_ids[chat] + offset, "user_id": user_id, "chat_id": chat + 1}
+                            for chat, members in enumerate(chat_members)
+                            for offset, user_id in enumerate(members)):
+            connection.execute(insert(Participant.__table__), rows)
+        progress(f"{len(chat_members)} chats with {sum(map(len, chat_members))} participants")
+
+        for number, rows in enumerate(chunked(message_rows(preset, chat_members, first_participant_ids, rng))):
+            connection.execute(insert(Message.__table__), rows)
+            if number % 50 == 49:
+                progress(f"{(number + 1) * CHUNK_SIZE} messages")
+
+        for statement in SUMMARY_SQL:
+            connection.execute(text(statement))
+
+        # Everyone has read everything, except a share of participants who are a few messages behind.
+        behind = [{"id": first_participant_ids[chat] + offset, "chat_id": chat + 1,
+                   "behind": rng.randint(1, MAX_UNREAD)}
+                  for chat, members in enumerate(chat_members)
+                  for offset in range(len(members))
+                  if rng.random() < BEHIND_SHARE]
+        for rows in chunked(behind):
+            for statement in BEHIND_SQL:
+                connection.execute(text(statement), rows)
+        progress("summaries")
+
+        # Rows were inserted with explicit ids; move PostgreSQL's sequences past them.
+        if engine.dialect.name == "postgresql":
+            for table in ("users", "chats", "participants", "messages"):
+                connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                        f"coalesce((SELECT max(id) FROM {table}), 1))"))
+
+    progress("generated")
+
+
+def create_generator_engine(url: str):
+    from ..backend.database import register_functions
+
+    engine = create_engine(url)
+    register_functions(engine)
+
+    if engine.dialect.name == "sqlite":
+        # A generated database can always be generated again, so skip durability.
+        @event.listens_for(engine, "connect")
+        def fast_writes(dbapi_connection, connection_record):
+            dbapi_connection.execute("PRAGMA journal_mode = OFF")
+            dbapi_connection.execute("PRAGMA synchronous = OFF")
+
+    return engine
+
+
+def copy_sqlite(source: str, target: str):
+    source_connection, target_connection = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        source_connection.backup(target_connection)
+    finally:
+        source_connection.close()
+        target_connection.close()
+
+
+def snapshot(engine, path: str):
+    if engine.dialect.name != "sqlite":
+        raise ValueError("Snapshots are SQLite files; use pg_dump for PostgreSQL.")
+
+    copy_sqlite(engine.url.database, path)
+
+
+def restore(path: str, target: str):
+    if os.path.exists(target):
+        os.remove(target)
+
+    copy_sqlite(path, target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a production-shaped dataset.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", help="Generate a dataset into a database.")
+    generate_parser.add_argument("--preset", choices=PRESETS, default="small")
+    generate_parser.add_argument("--seed", type=int, default=1)
+    generate_parser.add_argument("--database-url", default=None,
+                                 help="Target database (its tables are dropped). Defaults to <preset>-<seed>.db.")
+    generate_parser.add_argument("--snapshot", default=None, help="Also save the result as this SQLite file.")
+
+    restore_parser = commands.add_parser("restore", help="Copy a snapshot into a SQLite database file.")
+    restore_parser.add_argument("snapshot")
+    restore_parser.add_argument("target")
+
+    args = parser.parse_args()
+
+    if args.command == "restore":
+        restore(args.snapshot, args.target)
+        return
+
+    engine = create_generator_engine(args.database_url or f"sqlite:///{args.preset}-{args.seed}.db")
+    generate(engine, PRESETS[args.preset], args.seed, log=lambda line: print(line, file=sys.stderr))
+
+    if args.snapshot:
+        engine.dispose()
+        snapshot(engine, args.snapshot)
+
+
+if __name__ == "__main__":
+    main()
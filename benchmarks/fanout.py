@@ -0,0 +1,127 @@
+# Cross-worker delivery of chat events through the unix socket broker.
+#
+# Run from the directory that contains the project package:
+#   python -m messenger.benchmarks.fanout --workers 4 --events 20000 --chats 50
+#
+# Every worker is its own interpreter, like a uvicorn worker. Each publishes --events events
+# spread over --chats chats as fast as it can, and records every event the other workers
+# publish: how long it took to arrive, whether anything was lost, and whether the events
+# of one (worker, chat) pair ever arrived out of order.
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+# Stands in for ChatHub: the broker only ever calls deliver().
+class Recorder:
+    def __init__(self, worker: int):
+        self.worker = worker
+        self.latencies: list[float] = []
+        self.last_seq: dict[tuple[int, int], int] = defaultdict(lambda: -1)
+        self.received = 0
+        self.out_of_order = 0
+
+    def deliver(self, chat_id: int, events: list[dict]):
+        now = time.time()
+        for event in events:
+            if event["worker"] == self.worker:
+                # This worker's own events, delivered locally by publish().
+                continue
+
+            key = (event["worker"], chat_id)
+            if event["seq"] <= self.last_seq[key]:
+                self.out_of_order += 1
+            self.last_seq[key] = event["seq"]
+            self.latencies.append(now - event["sent"])
+            self.received += 1
+
+
+def run_worker(args):
+    from ..backend.logic.broker import UnixSocketBroker
+
+    recorder = Recorder(args.index)
+    broker = UnixSocketBroker(recorder, args.directory)
+    broker.start()
+
+    deadline = time.time() + 10
+    while len(broker.peers()) < args.workers - 1 and time.time() < deadline:
+        time.sleep(0.01)
+
+    seq = defaultdict(int)
+    started = time.perf_counter()
+    for n in range(args.events):
+        chat_id = n % args.chats
+        broker.publish(chat_id, {"type": "message", "worker": args.index, "seq": seq[chat_id],
+                                 "sent": time.time(), "text": "x" * args.size})
+        seq[chat_id] += 1
+    published = time.perf_counter() - started
+
+    expected = args.events * (args.workers - 1)
+    deadline = time.time() + args.timeout
+    while recorder.received < expected and time.time() < deadline:
+        time.sleep(0.01)
+    # Let the slower workers drain what this one sent before the socket goes away.
+    time.sleep(1)
+    broker.stop()
+
+    print(json.dumps({
+        **broker.stats(),
+        "published_per_s": round(args.events / published, 1),
+        "received": recorder.received,
+        "lost": expected - recorder.received,
+        "out_of_order": recorder.out_of_order,
+        "p50_ms": round(percentile(recorder.latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(recorder.latencies, 0.99) * 1000, 2),
+    }))
+
+
+def run_all(args):
+    package = __spec__.name.rsplit(".", 2)[0]
+    parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    with tempfile.TemporaryDirectory() as directory:
+        workers = [subprocess.Popen(
+            [sys.executable, "-m", f"{package}.benchmarks.fanout", "--worker", "--index", str(index),
+             "--directory", directory, "--workers", str(args.workers), "--events", str(args.events),
+             "--chats", str(args.chats), "--size", str(args.size), "--timeout", str(args.timeout)],
+            cwd=parent, stdout=subprocess.PIPE, text=True,
+        ) for index in range(args.workers)]
+        results = [json.loads(worker.communicate()[0].strip().splitlines()[-1]) for worker in workers]
+
+    print(f"{'worker':<8}{'pub/s':>10}{'received':>10}{'lost':>8}{'reorder':>9}{'payloads':>10}"
+          f"{'p50 ms':>9}{'p99 ms':>9}")
+    for index, result in enumerate(results):
+        print(f"{index:<8}{result['published_per_s']:>10}{result['received']:>10}{result['lost']:>8}"
+              f"{result['out_of_order']:>9}{result['payloads']:>10}{result['p50_ms']:>9}{result['p99_ms']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cross-worker event delivery through the unix broker.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--events", type=int, default=20000, help="Events published by every worker.")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--size", type=int, default=100, help="Bytes of text in every event.")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--index", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--directory", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Throughput and latency of POST /messages/ with and without group commit.
+#
+# Run from the directory that contains the project package:
+#   python -m messenger.benchmarks.group_commit --requests 3000 --concurrency 100 --delays 0 1 2 5
+#
+# Delay 0 is the plain one-commit-per-message path; every other value turns group commit on
+# with that MESSAGE_GROUP_COMMIT_DELAY_MS. Each setting runs in a fresh interpreter because
+# the config is read at import time. On SQLite --commit-latency-ms adds a sleep to every
+# COMMIT, standing in for the fsync a durable PostgreSQL commit waits for.
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from .concurrency import percentile
+
+
+def add_commit_latency(engine, latency: float):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "commit")
+    def delay(connection):
+        time.sleep(latency)
+
+
+def seed(chats: int) -> list[int]:
+    from ..backend.database import SessionLocal, get_engine
+    from ..backend.migrations import migrate
+    from ..backend.logic.users import UserRepository
+    from ..backend.logic.passwords import hash_password
+    from ..backend.logic.chats import ChatRepository
+    from ..backend.logic.particpants import ParticipantRepository
+    from ..backend.schemas.user import UserCreateSchema
+    from ..backend.schemas.chat import CreatePublicChatSchema
+    from ..backend.schemas.participant import ParticipantCreateSchema
+
+    migrate(get_engine())
+
+    db = SessionLocal()
+    user = UserRepository(db).add_user(UserCreateSchema(email="bench@gmail.com", password="123123123",
+                                                        repeated_password="123123123"),
+                                                        hash_password("123123123"))
+    senders = [ParticipantRepository(db).add_participant(
+                   ParticipantCreateSchema(user_id=user.id,
+                                           chat_id=ChatRepository(db).add_chat(CreatePublicChatSchema(name=f"Bench {i}")).id)).id
+               for i in range(chats)]
+    db.close()
+
+    return senders
+
+
+async def drive(app, senders: list[int], requests: int, concurrency: int) -> dict:
+    import httpx
+
+    latencies: list[float] = []
+    remaining = iter(range(requests))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def worker():
+            for n in remaining:
+                started = time.perf_counter()
+                response = await client.post("/messages/", json={"sender_id": senders[n % len(senders)],
+                                                                 "text": f"message {n}"})
+                latencies.append(time.perf_counter() - started)
+                response.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "throughput": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def run_worker(args):
+    from ..main import app
+    from ..backend import database
+    from ..backend.logic.messages import message_committer
+
+    senders = seed(args.chats)
+
+    if args.commit_latency_ms:
+        target = database.async_engine.sync_engine if database.ASYNC_DATABASE else database.engine
+        add_commit_latency(target, args.commit_latency_ms / 1000)
+
+    result = asyncio.run(drive(app, senders, args.requests, args.concurrency))
+    average_group = message_committer.stats()["average_group"] if message_committer is not None else 1
+    print(json.dumps({"delay_ms": args.delay, "average_group": average_group, **result}))
+
+
+def run_all(args):
+    package = __spec__.name.rsplit(".", 2)[0]
+    parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    results = []
+
+    for delay in args.delays:
+        with tempfile.TemporaryDirectory() as directory:
+            env = {
+                **os.environ,
+                "DATABASE_URL": args.database_url or f"sqlite:///{directory}/bench.db",
+                "MESSAGE_GROUP_COMMIT": "1" if delay else "0",
+                "MESSAGE_GROUP_COMMIT_DELAY_MS": str(delay),
+                "MESSAGE_GROUP_COMMIT_SIZE": str(args.max_group),
+            }
+
+            output = subprocess.run(
+                [sys.executable, "-m", f"{package}.benchmarks.group_commit", "--worker", "--delay", str(delay),
+                 "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+                 "--chats", str(args.chats), "--commit-latency-ms", str(args.commit_latency_ms)],
+                cwd=parent, env=env, check=True, capture_output=True, text=True,
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'delay ms':<10}{'group':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for result in results:
+        print(f"{result['delay_ms'] or 'off':<10}{result['average_group']:>8}{result['throughput']:>10}"
+              f"{result['p50_ms']:>10}{result['p99_ms']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare message send throughput with and without group commit.")
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--delays", type=float, nargs="+", default=[0, 1, 2, 5],
+                        help="MESSAGE_GROUP_COMMIT_DELAY_MS values to try; 0 disables group commit.")
+    parser.add_argument("--max-group", type=int, default=200)
+    parser.add_argument("--commit-latency-ms", type=float, default=2.0)
+    parser.add_argument("--database-url", default=None,
+                        help="Benchmark against this database instead of a throwaway SQLite file.")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--delay", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
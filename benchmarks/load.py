@@ -0,0 +1,297 @@
+# Load test of the real app, in process over the ASGI transport, with per-endpoint
+# throughput and p50/p95/p99 latency.
+#
+# Run from the directory that contains the project package:
+#   python -m messenger.benchmarks.load run --users 20 --iterations 50 --output results.json
+#   python -m messenger.benchmarks.load run --baseline results.json    # flags regressions
+#   python -m messenger.benchmarks.load compare old.json new.json
+#
+# Every virtual user registers, authorizes and creates a chat; then all of them join the
+# previous user's chat and runs a weighted mix of sends, history reads, inbox reads, read
+# receipts and searches. Without --database-url a throwaway SQLite file is used, empty or
+# restored from a --dataset snapshot.
+# compare (and run --baseline) exits with status 1 when an endpoint regressed.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from .concurrency import percentile
+from .dataset import restore
+
+MIX = {
+    "send": 40,
+    "history": 30,
+    "inbox": 15,
+    "read": 10,
+    "search": 5,
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+
+    async def call(self, client, endpoint: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[endpoint].append(time.perf_counter() - started)
+
+        if response.is_error:
+            self.errors[endpoint] += 1
+            return None
+
+        return response.json() if response.content else None
+
+    def report(self, elapsed: float) -> dict:
+        def summarize(samples: list[float], errors: int) -> dict:
+            return {
+                "requests": len(samples),
+                "errors": errors,
+                "throughput": round(len(samples) / elapsed, 1),
+                "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+                "p50_ms": round(percentile(samples, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+            }
+
+        every_sample = [sample for samples in self.latencies.values() for sample in samples]
+        return {
+            "seconds": round(elapsed, 3),
+            "total": summarize(every_sample, sum(self.errors.values())),
+            "endpoints": {endpoint: summarize(samples, self.errors[endpoint])
+                          for endpoint, samples in sorted(self.latencies.items())},
+        }
+
+
+async def set_up_user(client, recorder: Recorder, number: int, run_id: str) -> tuple:
+    credentials = {"email": f"load{number}.{run_id}@gmail.com", "password": "123123123"}
+
+    user = await recorder.call(client, "POST /users/register", "POST", "/users/register",
+                               json={**credentials, "repeated_password": "123123123"})
+    await recorder.call(client, "POST /users/authorize", "POST", "/users/authorize", json=credentials)
+    chat = await recorder.call(client, "POST /chats/public", "POST", "/chats/public", json={"name": f"Load {number}"})
+
+    return user, chat
+
+
+async def use_chats(client, recorder: Recorder, user: dict, other_chat: dict,
+                    iterations: int, rng: random.Random):
+    await recorder.call(client, "POST /chats/public/add", "POST", "/chats/public/add",
+                        json={"user_id": user["id"], "chat_id": other_chat["id"]})
+
+    participations = await recorder.call(client, "GET /chats/participations", "GET", "/chats/participations",
+                                         params={"user_id": user["id"]}) or []
+    senders = [(participation["id"], participation["chat_id"]) for participation in participations]
+    if not senders:
+        return
+
+    actions, weights = zip(*MIX.items())
+    for iteration in range(iterations):
+        action = rng.choices(actions, weights)[0]
+        sender_id, chat_id = rng.choice(senders)
+
+        if action == "send":
+            await recorder.call(client, "POST /messages/", "POST", "/messages/",
+                                json={"sender_id": sender_id, "text": f"hello number {iteration} from {user['id']}"})
+        elif action == "history":
+            await recorder.call(client, "GET /chats/{id}/messages", "GET", f"/chats/{chat_id}/messages",
+                                params={"limit": 50})
+        elif action == "inbox":
+            await recorder.call(client, "GET /me/chats", "GET", "/me/chats")
+        elif action == "read":
+            await recorder.call(client, "POST /chats/{id}/read", "POST", f"/chats/{chat_id}/read")
+        else:
+            await recorder.call(client, "GET /messages/search", "GET", "/messages/search",
+                                params={"q": f"number {rng.randrange(iterations)}"})
+
+
+async def drive(app, users: int, iterations: int, seed: int) -> dict:
+    import httpx
+
+    recorder = Recorder()
+    run_id = f"{int(time.time())}{seed}"
+    transport = httpx.ASGITransport(app=app)
+    clients = [httpx.AsyncClient(transport=transport, base_url="http://load") for _ in range(users)]
+
+    started = time.perf_counter()
+    try:
+        accounts = await asyncio.gather(*(set_up_user(client, recorder, number, run_id)
+                                          for number, client in enumerate(clients)))
+        # Everyone also joins the previous user's chat, so each chat has two writers.
+        await asyncio.gather(*(use_chats(client, recorder, user, accounts[number - 1][1], iterations,
+                                         random.Random(seed * 1_000_003 + number))
+                               for number, (client, (user, chat)) in enumerate(zip(clients, accounts))
+                               if user is not None and accounts[number - 1][1] is not None))
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+    return recorder.report(time.perf_counter() - started)
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_worker(args):
+    from ..main import app
+    from ..backend.database import get_engine
+    from ..backend.migrations import migrate
+    from ..backend.logic.passwords import password_hasher
+
+    migrate(get_engine())
+    try:
+        report = asyncio.run(drive(app, args.users, args.iterations, args.seed))
+    finally:
+        password_hasher.shutdown()
+
+    print(json.dumps({"database": get_engine().dialect.name, **report}))
+
+
+# The app reads its settings from the environment at import time, so the load runs in a
+# fresh interpreter configured for it.
+def run(args) -> dict:
+    package = __spec__.name.rsplit(".", 2)[0]
+    parent = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.dataset:
+            restore(args.dataset, f"{directory}/load.db")
+
+        env = {
+            "EMAIL_CHECK_DELIVERABILITY": "0",
+            "PASSWORD_HASHER_MAX_PENDING": str(max(32, args.users * 2)),
+            **os.environ,
+            "DATABASE_URL": args.database_url or f"sqlite:///{directory}/load.db",
+        }
+        output = subprocess.run(
+            [sys.executable, "-m", f"{package}.benchmarks.load", "worker",
+             "--users", str(args.users), "--iterations", str(args.iterations), "--seed", str(args.seed)],
+            cwd=parent, env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+
+    return {
+        "meta": {
+            "commit": current_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "database": report.pop("database"),
+            "async_database": env.get("ASYNC_DATABASE", "0"),
+            "users": args.users,
+            "iterations": args.iterations,
+            "seed": args.seed,
+            "dataset": os.path.basename(args.dataset) if args.dataset else None,
+        },
+        **report,
+    }
+
+
+def print_report(result: dict):
+    print(f"{'endpoint':<28}{'req':>7}{'err':>6}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint, stats in [*result["endpoints"].items(), ("total", result["total"])]:
+        print(f"{endpoint:<28}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+
+
+# An endpoint regressed when its p95 grew, or its error rate rose, by more than the threshold.
+def compare(baseline: dict, result: dict, threshold: float) -> list[str]:
+    regressions = []
+
+    for endpoint, new in [*result["endpoints"].items(), ("total", result["total"])]:
+        old = baseline["endpoints"].get(endpoint) if endpoint != "total" else baseline["total"]
+        if old is None:
+            continue
+
+        if new["p95_ms"] > old["p95_ms"] * (1 + threshold):
+            regressions.append(f"{endpoint}: p95 {old['p95_ms']} ms -> {new['p95_ms']} ms")
+
+        old_errors = old["errors"] / old["requests"] if old["requests"] else 0
+        new_errors = new["errors"] / new["requests"] if new["requests"] else 0
+        if new_errors > old_errors + threshold / 10:
+            regressions.append(f"{endpoint}: error rate {old_errors:.1%} -> {new_errors:.1%}")
+
+    return regressions
+
+
+def report_regressions(baseline: dict, result: dict, threshold: float) -> int:
+    regressions = compare(baseline, result, threshold)
+    print(f"\nagainst {baseline['meta']['commit']} ({baseline['meta']['timestamp']}), threshold {threshold:.0%}:")
+    for regression in regressions:
+        print(f"  REGRESSION {regression}")
+    if not regressions:
+        print("  no regressions")
+
+    return 1 if regressions else 0
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the API and report latency per endpoint.")
+    commands = parser.add_subparsers(dest="command")
+
+    run_parser = commands.add_parser("run", help="Run the load test.")
+    run_parser.add_argument("--users", type=int, default=20)
+    run_parser.add_argument("--iterations", type=int, default=50, help="Requests per user after setup.")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--database-url", default=None,
+                            help="Run against this database (e.g. a local PostgreSQL) instead of a throwaway SQLite file.")
+    run_parser.add_argument("--dataset", default=None,
+                            help="Start from this snapshot (see benchmarks.dataset) instead of an empty database.")
+    run_parser.add_argument("--output", default=None, help="Write the results as JSON to this file.")
+    run_parser.add_argument("--baseline", default=None, help="Results file to compare against.")
+    run_parser.add_argument("--threshold", type=float, default=0.2)
+
+    worker_parser = commands.add_parser("worker")
+    worker_parser.add_argument("--users", type=int)
+    worker_parser.add_argument("--iterations", type=int)
+    worker_parser.add_argument("--seed", type=int)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("result")
+    compare_parser.add_argument("--threshold", type=float, default=0.2)
+
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        return run_worker(args)
+
+    if args.command == "compare":
+        result = load(args.result)
+        print_report(result)
+        sys.exit(report_regressions(load(args.baseline), result, args.threshold))
+
+    if args.command is None:
+        args = run_parser.parse_args([])
+
+    result = run(args)
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
+
+    if args.baseline:
+        sys.exit(report_regressions(load(args.baseline), result, args.threshold))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Per-item cost of turning ORM rows into a JSON response body, for each schema.
+#
+#   before  schema built field by field, then FastAPI's response_model pass: model_dump,
+#           validate the dict again, serialize in JSON mode, json.dumps
+#   after   model_validate straight from the row (from_attributes), then ModelResponse,
+#           which serializes once with pydantic-core (orjson for plain values)
+#
+# Run from the directory that contains the project package:
+#   python -m messenger.benchmarks.serialization --items 1000 --repeat 20
+import argparse
+import json
+import time
+from datetime import datetime, timezone
+
+from pydantic import TypeAdapter
+
+
+def rows(count: int) -> dict:
+    from ..backend.models.user import User
+    from ..backend.models.chat import Chat
+    from ..backend.models.participant import Participant
+    from ..backend.models.message import Message
+
+    now = datetime.now(timezone.utc)
+    return {
+        "UserSchema": [User(id=i, name=f"User{i}", email=f"user{i}@gmail.com", bio="bio", status="online",
+                            hashed_password="$2b$12$" + "x" * 53) for i in range(count)],
+        "ChatSchema": [Chat(id=i, name=f"Chat {i}", type="Public", created_at=now, updated_at=now)
+                       for i in range(count)],
+        "ParticipantSchema": [Participant(id=i, user_id=i, chat_id=1, last_read_message_id=i, unread_count=3)
+                              for i in range(count)],
+        "MessageSchema": [Message(id=i, sender_id=i, chat_id=1, text="hello there " * 5, created_at=now)
+                          for i in range(count)],
+    }
+
+
+def before(schema, items: list) -> bytes:
+    # Repositories spelled out every field; FastAPI then re-validated and re-encoded the result.
+    validated = [schema(**{name: getattr(item, name) for name in schema.model_fields}) for item in items]
+    adapter = TypeAdapter(list[schema])
+    revalidated = adapter.validate_python([item.model_dump() for item in validated])
+    return json.dumps(adapter.dump_python(revalidated, mode="json")).encode()
+
+
+def after(schema, items: list) -> bytes:
+    from ..backend.utils.responses import ModelResponse
+
+    return ModelResponse([schema.model_validate(item) for item in items]).body
+
+
+def measure(function, schema, items: list, repeat: int) -> float:
+    function(schema, items)
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(schema, items)
+        best = min(best, time.perf_counter() - started)
+
+    return best / len(items) * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-item serialization cost of each response schema.")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    from ..backend.schemas import user, chat, participant, message
+
+    modules = (user, chat, participant, message)
+    print(f"{'schema':<20}{'before us':>12}{'after us':>12}{'speedup':>10}")
+    for name, items in rows(args.items).items():
+        schema = next(getattr(module, name) for module in modules if hasattr(module, name))
+        old, new = measure(before, schema, items, args.repeat), measure(after, schema, items, args.repeat)
+        print(f"{name:<20}{old:>12.2f}{new:>12.2f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,17 @@
 from fastapi import FastAPI
 
-from .backend.database import get_engine, Base
+from .backend.database import get_engine, SessionLocal
+from .backend.migrations import migrate
+from .backend.logic.passwords import password_hasher
+from .backend.logic.purge import purger
+from .backend.logic.broker import broker
+from .backend.logic.messages import load_message_dictionaries
+from .backend.utils.queries import QueryStatsMiddleware
+from .backend.utils.config import DEBUG, QUERY_REPEAT_THRESHOLD
 from .backend.logic.routes import (
     chats, users, messages,
+    realtime, internal, me,
+    sync, attachments,
 )
 from .tests import app
 
@@ -12,11 +21,26 @@ app = FastAPI(
 )
 
 @app.on_event("startup")
-def startup():
-    print("start test")
-    print(Base.metadata.tables)
-    Base.metadata.create_all(bind=get_engine())
+async def startup():
+    migrate(get_engine())
+    with SessionLocal() as db:
+        load_message_dictionaries(db)
+    purger.start()
+    broker.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    broker.stop()
+    await purger.stop()
+    password_hasher.shutdown()
+
+app.add_middleware(QueryStatsMiddleware, headers=DEBUG, repeat_threshold=QUERY_REPEAT_THRESHOLD)
 
 app.include_router(users.router)
 app.include_router(chats.router)
-app.include_router(messages.router)
\ No newline at end of file
+app.include_router(messages.router)
+app.include_router(me.router)
+app.include_router(realtime.router)
+app.include_router(sync.router)
+app.include_router(attachments.router)
+app.include_router(internal.router)
\ No newline at end of file
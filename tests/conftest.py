@@ -1,8 +1,100 @@
-from ..backend.database import get_engine, Base
+import pytest
+from contextlib import contextmanager
+
+from ..backend.database import SessionLocal, get_engine, Base
+from ..backend.migrations import migrate, schema_migrations
+from ..backend.utils.queries import query_listeners
+from ..backend.logic.users import UserRepository, authenticated_users, user_cache
+from ..backend.logic.chats import chat_cache
+from ..backend.logic.particpants import ParticipantRepository, chat_participants_cache
+from ..backend.logic.chats import ChatRepository
+from ..backend.logic.messages import MessageRepository
+from ..backend.logic.passwords import hash_password
+from ..backend.logic.tokens import generate_access_token
+from ..backend.schemas.user import UserCreateSchema, UserSchema
+from ..backend.schemas.chat import CreatePublicChatSchema, ChatSchema
+from ..backend.schemas.participant import ParticipantCreateSchema, ParticipantSchema
+from ..backend.schemas.message import MessageCreateSchema
 
 def flush_database():
     Base.metadata.drop_all(bind=get_engine())
-    Base.metadata.create_all(bind=get_engine())
+    schema_migrations.drop(bind=get_engine(), checkfirst=True)
+    migrate(get_engine())
+    # Ids start over in the new tables, so nothing cached about the old rows may survive.
+    for cache in (authenticated_users, user_cache, chat_cache, chat_participants_cache):
+        cache.clear()
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fresh_database():
+    flush_database()
+
+
+# with query_budget(3) as requests: ... fails the test if any request made inside the
+# block ran more than 3 statements, listing the statements that were repeated.
+@pytest.fixture
+def query_budget():
+    @contextmanager
+    def budget(max_queries: int):
+        requests = []
+        listener = lambda scope, stats: requests.append((f"{scope['method']} {scope['path']}", stats))
+        query_listeners.append(listener)
+        try:
+            yield requests
+        finally:
+            query_listeners.remove(listener)
+
+        for route, stats in requests:
+            assert stats.count <= max_queries, (
+                f"{route} ran {stats.count} queries, the budget is {max_queries}. Repeated: {stats.repeated()}")
+
+    return budget
+
+
+# Rows for tests to work on, written through the repositories:
+#   owner, guest = make.users("chat.owner", "chat.guest")    # chat.owner@gmail.com, ...
+#   chat, (sender, _) = make.chat("Chat", owner, guest)      # a public chat they are both in
+#   ids = make.messages(sender, "hello", "bye")
+# Users get a password hash only when they are given a password, as hashing is slow.
+class Factory:
+    def users(self, *names: str, password: str = None) -> list[UserSchema]:
+        hashed_password = hash_password(password) if password else "not a hash"
+        db = SessionLocal()
+        users = [UserRepository(db).add_user(UserCreateSchema(email=f"{name}@gmail.com", password="123123123",
+                                                              repeated_password="123123123"), hashed_password)
+                 for name in names]
+        db.close()
+
+        return users
+
+    def user(self, name: str, password: str = None) -> UserSchema:
+        return self.users(name, password=password)[0]
+
+    def chat(self, name: str, *members: UserSchema) -> tuple[ChatSchema, list[ParticipantSchema]]:
+        db = SessionLocal()
+        chat = ChatRepository(db).add_chat(CreatePublicChatSchema(name=name))
+        participants = [ParticipantRepository(db).add_participant(ParticipantCreateSchema(user_id=member.id,
+                                                                                          chat_id=chat.id))
+                        for member in members]
+        db.close()
+
+        return chat, participants
+
+    def messages(self, sender: ParticipantSchema, *texts: str) -> list[int]:
+        db = SessionLocal()
+        ids = [MessageRepository(db).add_message(MessageCreateSchema(sender_id=sender.id, text=text)).id
+               for text in texts]
+        db.close()
+
+        return ids
+
+    def token(self, user: UserSchema) -> str:
+        return generate_access_token(user.id, user.email)
+
+
+@pytest.fixture(scope="session")
+def make() -> Factory:
+    return Factory()
 
 
 funcs_of_interest = ["test_register", "test_register2"]
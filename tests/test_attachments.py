@@ -0,0 +1,142 @@
+import asyncio
+import hashlib
+import os
+import pytest
+
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..backend.logic.attachments import BlobStore, blob_store
+from ..backend.logic.exceptions import AttachmentTooLargeError
+from ..backend.logic.purge import Purger
+
+client = TestClient(app)
+
+VIDEO = bytes(range(256)) * 1024
+
+
+@pytest.fixture(scope="module")
+def chats(make, tmp_path_factory):
+    sender, stranger = make.users("files.sender", "files.stranger")
+    messages = []
+    for number in range(3):
+        _, (participant,) = make.chat(f"Files {number}", sender)
+        messages += make.messages(participant, "look")
+
+    root, blob_store.root = blob_store.root, str(tmp_path_factory.mktemp("blobs"))
+    client.cookies.set("token", make.token(sender))
+    yield messages, make.token(stranger)
+    client.cookies.clear()
+    blob_store.root = root
+
+
+def stored_files() -> list[str]:
+    return [name for _, _, names in os.walk(blob_store.root) for name in names]
+
+
+def test_forwarded_file_is_stored_once(chats):
+    messages, _ = chats
+
+    # Act
+    uploads = [client.post('/attachments/', content=VIDEO) for _ in messages]
+    attached = [client.post(f'/messages/{message_id}/attachments',
+                            json={"sha256": upload.json()['sha256'], "filename": "clip.mp4",
+                                  "content_type": "video/mp4"})
+                for message_id, upload in zip(messages, uploads)]
+
+    # Assert
+    assert [upload.status_code for upload in uploads] == [201] * len(messages)
+    assert {upload.json()['sha256'] for upload in uploads} == {hashlib.sha256(VIDEO).hexdigest()}
+    assert [attachment.status_code for attachment in attached] == [201] * len(messages)
+    assert stored_files() == [hashlib.sha256(VIDEO).hexdigest()]
+    assert [a['id'] for a in client.get(f'/messages/{messages[1]}/attachments').json()] == [attached[1].json()['id']]
+
+
+def test_download_supports_ranges_and_revalidation(chats):
+    messages, _ = chats
+    sha256 = client.post('/attachments/', content=VIDEO).json()['sha256']
+    attachment = client.post(f'/messages/{messages[0]}/attachments',
+                             json={"sha256": sha256, "filename": "clip.mp4", "content_type": "video/mp4"}).json()
+
+    # Act
+    full = client.get(f"/attachments/{attachment['id']}")
+    part = client.get(f"/attachments/{attachment['id']}", headers={"Range": "bytes=1000-1999"})
+    beyond = client.get(f"/attachments/{attachment['id']}", headers={"Range": f"bytes={len(VIDEO)}-"})
+    cached = client.get(f"/attachments/{attachment['id']}", headers={"If-None-Match": full.headers['etag']})
+
+    # Assert
+    assert full.status_code == 200 and full.content == VIDEO
+    assert full.headers['content-type'] == "video/mp4" and full.headers['etag'] == f'"{sha256}"'
+    assert part.status_code == 206 and part.content == VIDEO[1000:2000]
+    assert part.headers['content-range'] == f"bytes 1000-1999/{len(VIDEO)}"
+    assert beyond.status_code == 416
+    assert cached.status_code == 304
+
+
+def test_only_members_download_and_only_the_sender_attaches(chats):
+    messages, stranger_token = chats
+    sha256 = client.post('/attachments/', content=b"private").json()['sha256']
+    attachment = client.post(f'/messages/{messages[2]}/attachments',
+                             json={"sha256": sha256, "filename": "notes.txt"}).json()
+    token = client.cookies.get("token")
+
+    # Act
+    client.cookies.set("token", stranger_token)
+    download = client.get(f"/attachments/{attachment['id']}")
+    listed = client.get(f'/messages/{messages[2]}/attachments')
+    attach = client.post(f'/messages/{messages[2]}/attachments', json={"sha256": sha256, "filename": "x"})
+    client.cookies.set("token", token)
+    unknown = client.post(f'/messages/{messages[2]}/attachments', json={"sha256": "0" * 64, "filename": "x"})
+
+    # Assert
+    assert download.status_code == 404
+    assert listed.json() == []
+    assert attach.status_code == 403
+    assert unknown.status_code == 404
+
+
+def test_only_the_uploader_attaches_a_blob(chats, make):
+    thief = make.user("files.thief")
+    _, (participant,) = make.chat("Files of a thief", thief)
+    message_id, = make.messages(participant, "mine now")
+    sha256 = client.post('/attachments/', content=b"sender's notes").json()['sha256']
+    token = client.cookies.get("token")
+
+    # Act
+    client.cookies.set("token", make.token(thief))
+    known = client.post(f'/messages/{message_id}/attachments', json={"sha256": sha256, "filename": "x"})
+    unknown = client.post(f'/messages/{message_id}/attachments', json={"sha256": "0" * 64, "filename": "x"})
+    client.post('/attachments/', content=b"sender's notes")
+    uploaded = client.post(f'/messages/{message_id}/attachments', json={"sha256": sha256, "filename": "x"})
+    client.cookies.set("token", token)
+
+    # Assert: someone else's upload looks the same as no upload at all.
+    assert known.status_code == unknown.status_code == 404
+    assert known.json() == unknown.json()
+    assert uploaded.status_code == 201
+
+
+def test_upload_over_the_limit_leaves_nothing_behind(tmp_path):
+    store = BlobStore(str(tmp_path), chunk_size=4)
+
+    async def chunks():
+        for _ in range(10):
+            yield b"12345"
+
+    # Act / Assert
+    with pytest.raises(AttachmentTooLargeError):
+        asyncio.run(store.receive(chunks(), max_size=20))
+    assert os.listdir(tmp_path / "tmp") == []
+
+
+def test_unreferenced_blobs_are_collected(chats):
+    sha256 = client.post('/attachments/', content=b"never sent").json()['sha256']
+    kept = hashlib.sha256(VIDEO).hexdigest()
+    client.post('/attachments/', content=VIDEO)
+
+    # Act
+    asyncio.run(Purger(orphan_ttl=-60).remove_orphan_blobs())
+
+    # Assert
+    assert sha256 not in stored_files()
+    assert kept in stored_files()
@@ -0,0 +1,172 @@
+import time
+import pytest
+
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..backend.utils.cache import TTLCache, EntityCache
+from ..backend.database import SessionLocal
+from ..backend.logic.users import UserRepository, authenticated_users, user_cache
+from ..backend.logic.particpants import chat_participants_cache
+from ..backend.schemas.user import UserChangeDataSchema
+
+client = TestClient(app)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_ttl_cache_expires_entries():
+    cache = TTLCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+
+
+def test_ttl_cache_invalidates_by_tag():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("token-1", 1, tag=7)
+    cache.set("token-2", 2, tag=7)
+    cache.set("token-3", 3, tag=8)
+
+    cache.invalidate_tag(7)
+
+    assert cache.get("token-1") is None and cache.get("token-2") is None
+    assert cache.get("token-3") == 3
+
+
+def test_entity_cache_reads_through_until_invalidated():
+    cache = EntityCache("thing", TTLCache(maxsize=10, ttl=60))
+    loads = []
+
+    first = cache.get_or_load(1, lambda: loads.append(1) or "v1")
+    second = cache.get_or_load(1, lambda: loads.append(1) or "unused")
+    cache.invalidate(1)
+    third = cache.get_or_load(1, lambda: loads.append(1) or "v2")
+
+    assert (first, second, third) == ("v1", "v1", "v2")
+    assert len(loads) == 2
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+
+def test_entity_cache_drops_value_loaded_before_invalidation():
+    cache = EntityCache("thing", TTLCache(maxsize=10, ttl=60))
+
+    # A reader loads the old row, a writer commits and invalidates, then the reader stores.
+    def stale_load():
+        cache.invalidate(1)
+        return "stale"
+
+    cache.get_or_load(1, stale_load)
+
+    assert cache.get_or_load(1, lambda: "fresh") == "fresh"
+
+
+@pytest.fixture
+def authorized_user(make):
+    user = make.user("cached")
+
+    client.cookies.set("token", make.token(user))
+    yield user
+    client.cookies.clear()
+
+    db = SessionLocal()
+    UserRepository(db).remove_user(user.id)
+    db.close()
+
+
+def test_current_user_is_cached_until_user_changes(authorized_user):
+    authenticated_users.clear()
+    before = dict(authenticated_users.counters)
+
+    # Act
+    client.post('/chats/public', json={"name": "First"})
+    client.post('/chats/public', json={"name": "Second"})
+    client.put('/users/', params={"bio": "changed"})
+    response = client.post('/chats/public', json={"name": "Third"})
+
+    # Assert
+    assert response.status_code == 201
+    assert authenticated_users.counters['hits'] - before['hits'] == 2
+    assert authenticated_users.counters['misses'] - before['misses'] == 2
+
+
+def test_authentication_reads_past_the_entity_cache(authorized_user):
+    from sqlalchemy import update
+    from ..backend.models.user import User
+    from ..backend.models.chat import utc_now
+
+    db = SessionLocal()
+    UserRepository(db).find_user(authorized_user.id)
+    # Another worker deletes the user: this worker's caches hear nothing of it.
+    db.execute(update(User).where(User.id == authorized_user.id).values(deleted_at=utc_now()))
+    db.commit()
+    db.close()
+    authenticated_users.clear()
+
+    # Act
+    response = client.post('/chats/public', json={"name": "Gone"})
+
+    # Assert
+    assert response.status_code == 404
+    assert user_cache.get_or_load(authorized_user.id, lambda: None) is not None
+    db = SessionLocal()
+    db.execute(update(User).where(User.id == authorized_user.id).values(deleted_at=None))
+    db.commit()
+    db.close()
+
+
+def test_user_repository_invalidates_on_change(authorized_user):
+    db = SessionLocal()
+    repository = UserRepository(db)
+
+    repository.find_user(authorized_user.id)
+    repository.change_user_data(authorized_user.id, UserChangeDataSchema(bio="new bio"))
+    found = repository.find_user(authorized_user.id)
+    db.close()
+
+    assert found.bio == "new bio"
+
+
+def test_chat_participants_see_new_unread_counts(authorized_user, make):
+    other = make.user("cached.other")
+    chat = client.post('/chats/public', json={"name": "Cached"}).json()
+    client.post('/chats/public/add', json={"user_id": other.id, "chat_id": chat["id"]})
+    participants = client.get(f'/chats/{chat["id"]}/participants', params={"chat_id": chat["id"]}).json()
+    sender = next(participant for participant in participants if participant["user_id"] == authorized_user.id)
+    before = dict(chat_participants_cache.counters)
+
+    # Act
+    client.get(f'/chats/{chat["id"]}/participants', params={"chat_id": chat["id"]})
+    client.post('/messages/', json={"sender_id": sender["id"], "text": "hello"})
+    response = client.get(f'/chats/{chat["id"]}/participants', params={"chat_id": chat["id"]})
+
+    db = SessionLocal()
+    UserRepository(db).remove_user(other.id)
+    db.close()
+
+    # Assert
+    unread = {participant["user_id"]: participant["unread_count"] for participant in response.json()}
+    assert unread == {authorized_user.id: 0, other.id: 1}
+    assert chat_participants_cache.counters['hits'] - before['hits'] == 1
+    assert chat_participants_cache.counters['misses'] - before['misses'] == 1
+
+
+def test_cache_stats_report_hit_rates():
+    response = client.get('/internal/caches')
+
+    assert response.status_code == 200
+    assert {"users", "chats", "chat_participants"} <= response.json().keys()
+    assert "hit_rate" in response.json()["users"]
@@ -0,0 +1,223 @@
+import pytest
+
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..backend.database import SessionLocal
+from ..backend.logic.messages import MessageRepository
+from ..backend.schemas.message import MessageCreateSchema
+
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def chat_with_history(make):
+    # Arrange
+    user, stranger = make.users("history", "history.stranger")
+    chat, (sender,) = make.chat("History", user)
+    ids = make.messages(sender, *(f"message {i}" for i in range(7)))
+
+    client.cookies.set("token", make.token(user))
+    yield chat.id, ids, make.token(stranger)
+    client.cookies.clear()
+
+
+def test_history_pages_backwards(chat_with_history):
+    chat_id, ids, _ = chat_with_history
+
+    # Act
+    first = client.get(f'/chats/{chat_id}/messages', params={"limit": 3}).json()
+    second = client.get(f'/chats/{chat_id}/messages', params={"limit": 3, "before": first['prev_cursor']}).json()
+    third = client.get(f'/chats/{chat_id}/messages', params={"limit": 3, "before": second['prev_cursor']}).json()
+
+    # Assert
+    assert [m['id'] for m in first['messages']] == ids[4:]
+    assert [m['id'] for m in second['messages']] == ids[1:4]
+    assert [m['id'] for m in third['messages']] == ids[:1]
+    assert third['prev_cursor'] is None
+
+
+def test_history_pages_forwards(chat_with_history):
+    chat_id, ids, _ = chat_with_history
+    oldest = client.get(f'/chats/{chat_id}/messages', params={"limit": 3}).json()
+    while oldest['prev_cursor']:
+        oldest = client.get(f'/chats/{chat_id}/messages',
+                            params={"limit": 3, "before": oldest['prev_cursor']}).json()
+
+    # Act
+    newer = client.get(f'/chats/{chat_id}/messages', params={"limit": 4, "after": oldest['next_cursor']}).json()
+
+    # Assert
+    assert [m['id'] for m in newer['messages']] == ids[1:5]
+    assert newer['prev_cursor'] is not None
+
+
+@pytest.mark.parametrize("params", [
+    {"before": "not-a-cursor"},
+    {"before": "WzFd", "after": "WzFd"},
+    {"before": "WyJ4Il0"},
+    {"after": "WzEuNV0"},
+])
+def test_history_rejects_bad_cursors(chat_with_history, params):
+    chat_id, _, _ = chat_with_history
+
+    # Act
+    response = client.get(f'/chats/{chat_id}/messages', params=params)
+
+    # Assert
+    assert response.status_code == 400
+
+
+def test_history_is_only_for_participants(chat_with_history):
+    chat_id, _, stranger_token = chat_with_history
+    token = client.cookies.get("token")
+
+    # Act
+    client.cookies.set("token", stranger_token)
+    stranger = client.get(f'/chats/{chat_id}/messages')
+    client.cookies.clear()
+    anonymous = client.get(f'/chats/{chat_id}/messages')
+    client.cookies.set("token", token)
+
+    # Assert
+    assert stranger.status_code == 403
+    assert anonymous.status_code == 401
+
+
+@pytest.fixture(scope="module")
+def inviter(make):
+    owner, *invitees = make.users("owner", *(f"invitee{i}" for i in range(3)))
+
+    client.cookies.set("token", make.token(owner))
+    chat = client.post('/chats/public', json={"name": "Group"}).json()
+    yield owner, chat, [invitee.id for invitee in invitees]
+    client.cookies.clear()
+
+
+def test_invite_participants_in_bulk(inviter):
+    owner, chat, invitees = inviter
+
+    # Act
+    response = client.post(f'/chats/{chat["id"]}/participants', json={"user_ids": [owner.id, *invitees, 999999]})
+
+    # Assert
+    assert response.status_code == 200
+    assert response.json() == {"added": invitees, "already_participating": [owner.id], "missing_users": [999999]}
+    assert {p['user_id'] for p in client.get(f'/chats/{chat["id"]}/participants',
+                                              params={"chat_id": chat["id"]}).json()} == {owner.id, *invitees}
+
+
+def test_invite_to_missing_chat(inviter):
+    response = client.post('/chats/999999/participants', json={"user_ids": [1]})
+
+    assert response.status_code == 404
+
+
+def test_invites_need_a_public_chat_and_a_participant(inviter, make):
+    owner, chat, invitees = inviter
+    outsider = make.user("outsider")
+    private = client.post('/chats/private', params={"invited_user_id": invitees[0]}, json={"name": "Pair"}).json()
+
+    # Act
+    to_private = client.post(f'/chats/{private["id"]}/participants', json={"user_ids": [invitees[1]]})
+    client.cookies.set("token", make.token(outsider))
+    by_outsider = client.post(f'/chats/{chat["id"]}/participants', json={"user_ids": [outsider.id]})
+    client.cookies.set("token", make.token(owner))
+
+    # Assert
+    assert to_private.status_code == 403
+    assert by_outsider.status_code == 403
+    assert outsider.id not in {p['user_id'] for p in client.get(f'/chats/{chat["id"]}/participants',
+                                                                 params={"chat_id": chat["id"]}).json()}
+
+
+@pytest.mark.parametrize("user_index, expected_status_code", [
+    (None, 400),  # owner is already a participant
+    (0, 400),     # invited in the previous test
+])
+def test_add_single_participant_reports_duplicates(inviter, user_index, expected_status_code):
+    owner, chat, invitees = inviter
+    user_id = owner.id if user_index is None else invitees[user_index]
+
+    response = client.post('/chats/public/add', json={"user_id": user_id, "chat_id": chat["id"]})
+
+    assert response.status_code == expected_status_code
+
+
+def test_add_single_participant_needs_a_participant(inviter, make):
+    owner, chat, invitees = inviter
+    outsider = make.user("single.outsider")
+
+    # Act
+    client.cookies.set("token", make.token(outsider))
+    response = client.post('/chats/public/add', json={"user_id": outsider.id, "chat_id": chat["id"]})
+    client.cookies.set("token", make.token(owner))
+
+    # Assert
+    assert response.status_code == 403
+
+
+def test_chat_with_a_missing_user_isnt_created(inviter):
+    owner, chat, invitees = inviter
+
+    # Act
+    response = client.post('/chats/private', params={"invited_user_id": 999999}, json={"name": "Nobody"})
+
+    # Assert
+    assert response.status_code == 404
+    assert "Nobody" not in {chat['name'] for chat in client.get('/me/chats', params={"limit": 200}).json()['chats']}
+
+
+@pytest.fixture(scope="module")
+def conversation(make):
+    reader, writer = make.users("unread.reader", "unread.writer")
+    chat, senders = make.chat("Unread", reader, writer)
+
+    client.cookies.set("token", make.token(reader))
+    yield reader, writer, chat, senders
+    client.cookies.clear()
+
+
+def unread_counts(*users):
+    return [client.get('/chats/participations', params={"user_id": user.id}).json()[0]['unread_count']
+            for user in users]
+
+
+def test_unread_counts_follow_sends_and_reads(conversation, make):
+    reader, writer, chat, (reader_sender, writer_sender) = conversation
+    reader_id, writer_id = reader_sender.id, writer_sender.id
+    ids = make.messages(writer_sender, *(f"unread {i}" for i in range(3)))
+    db = SessionLocal()
+    MessageRepository(db).add_messages([MessageCreateSchema(sender_id=writer_id, text="batched"),
+                                        MessageCreateSchema(sender_id=reader_id, text="reply")],
+                                       {writer_id: chat.id, reader_id: chat.id})
+    db.close()
+
+    # Assert
+    assert unread_counts(reader, writer) == [4, 1]
+
+    # Act
+    partial = client.post(f'/chats/{chat.id}/read', json={"message_id": ids[1]}).json()
+    backwards = client.post(f'/chats/{chat.id}/read', json={"message_id": ids[0]}).json()
+
+    # Assert
+    assert (partial['last_read_message_id'], partial['unread_count']) == (ids[1], 2)
+    assert backwards == partial
+
+    # Act
+    client.delete('/messages/', params={"id": ids[2]})
+
+    # Assert
+    assert unread_counts(reader) == [1]
+
+    # Act
+    everything = client.post(f'/chats/{chat.id}/read').json()
+
+    # Assert
+    assert everything['unread_count'] == 0
+
+
+def test_mark_read_outside_chat(conversation):
+    response = client.post('/chats/999999/read')
+
+    assert response.status_code == 404
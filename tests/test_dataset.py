@@ -0,0 +1,50 @@
+from sqlalchemy import text
+
+from ..benchmarks.dataset import Preset, generate, create_generator_engine, snapshot, restore
+
+PRESET = Preset(users=60, private_chats=40, group_chats=6, messages=800)
+
+
+def dump(engine) -> list:
+    with engine.connect() as connection:
+        return [connection.execute(text(f"SELECT * FROM {table} ORDER BY id")).all()
+                for table in ("users", "chats", "participants", "messages")]
+
+
+def test_dataset_is_deterministic_and_survives_snapshots(tmp_path):
+    first = create_generator_engine(f"sqlite:///{tmp_path}/first.db")
+    second = create_generator_engine(f"sqlite:///{tmp_path}/second.db")
+
+    # Act
+    generate(first, PRESET, seed=7, log=lambda line: None)
+    generate(second, PRESET, seed=7, log=lambda line: None)
+    snapshot(first, f"{tmp_path}/snapshot.db")
+    restore(f"{tmp_path}/snapshot.db", f"{tmp_path}/restored.db")
+
+    # Assert
+    assert dump(first) == dump(second)
+    assert dump(first) == dump(create_generator_engine(f"sqlite:///{tmp_path}/restored.db"))
+
+
+def test_dataset_summaries_match_the_rows(tmp_path):
+    engine = create_generator_engine(f"sqlite:///{tmp_path}/data.db")
+
+    # Act
+    generate(engine, PRESET, seed=3, log=lambda line: None)
+
+    # Assert
+    with engine.connect() as connection:
+        stale_chats = connection.execute(text(
+            "SELECT count(*) FROM chats WHERE member_count != "
+            "(SELECT count(*) FROM participants WHERE chat_id = chats.id) "
+            "OR coalesce(last_message_id, 0) != coalesce((SELECT max(id) FROM messages WHERE chat_id = chats.id), 0)"
+        )).scalar()
+        stale_participants = connection.execute(text(
+            "SELECT count(*) FROM participants WHERE unread_count != "
+            "(SELECT count(*) FROM messages WHERE messages.chat_id = participants.chat_id "
+            "AND messages.id > coalesce(last_read_message_id, 0) AND messages.sender_id != participants.id)"
+        )).scalar()
+        behind = connection.execute(text("SELECT count(*) FROM participants WHERE unread_count > 0")).scalar()
+
+    assert (stale_chats, stale_participants) == (0, 0)
+    assert behind > 0
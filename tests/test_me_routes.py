@@ -0,0 +1,63 @@
+import pytest
+
+from fastapi.testclient import TestClient
+
+from ..main import app
+
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def inbox(make):
+    # Arrange
+    owner, friend = make.users("inbox.owner", "inbox.friend")
+    chats, senders = [], {}
+    for i in range(3):
+        chat, (_, sender) = make.chat(f"Inbox {i}", owner, friend)
+        chats.append(chat)
+        senders[chat.id] = sender
+
+    for chat in (chats[1], chats[0], chats[2], chats[0]):
+        last, = make.messages(senders[chat.id], f"in {chat.name}")
+
+    client.cookies.set("token", make.token(owner))
+    yield friend, chats, last
+    client.cookies.clear()
+
+
+def test_inbox_orders_chats_by_activity(inbox):
+    friend, chats, last = inbox
+
+    # Act
+    first = client.get('/me/chats', params={"limit": 2}).json()
+    second = client.get('/me/chats', params={"limit": 2, "cursor": first['next_cursor']}).json()
+
+    # Assert
+    assert [chat['id'] for chat in first['chats'] + second['chats']] == [chats[0].id, chats[2].id, chats[1].id]
+    assert second['next_cursor'] is None
+
+    newest = first['chats'][0]
+    assert newest['member_count'] == 2
+    assert newest['unread_count'] == 2
+    assert newest['last_message']['id'] == last
+    assert newest['last_message']['sender_user_id'] == friend.id
+    assert newest['last_message']['sender_name'] == friend.name
+
+
+def test_inbox_follows_deleted_last_message(inbox):
+    _, chats, last = inbox
+
+    # Act
+    client.delete('/messages/', params={"id": last})
+    newest = client.get('/me/chats', params={"limit": 1}).json()['chats'][0]
+
+    # Assert
+    assert newest['id'] == chats[0].id
+    assert newest['last_message']['text'] == f"in {chats[0].name}"
+    assert newest['last_message']['id'] < last
+
+
+def test_inbox_requires_login():
+    response = TestClient(app).get('/me/chats')
+
+    assert response.status_code == 401
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import pytest
+
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import NoResultFound
+
+from ..main import app
+from ..backend.database import SessionLocal
+from ..backend.logic.messages import MessageRepository, MessageCommitter
+from ..backend.schemas.message import MessageCreateSchema
+from ..backend.models.message import Message
+from ..backend.utils.compression import TextCodec, train_dictionary, decompress
+
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def search_data(make):
+    reader, stranger = make.users("reader", "stranger")
+    _, (reader_sender,) = make.chat("Own", reader)
+    _, (stranger_sender,) = make.chat("Other", stranger)
+
+    visible = make.messages(reader_sender, "deploy went fine", "deployment failed again", "lunch?", "deploying the fix")
+    make.messages(stranger_sender, "secret deploy plans")
+
+    client.cookies.set("token", make.token(reader))
+    yield visible
+    client.cookies.clear()
+
+
+def test_search_only_sees_callers_chats(search_data):
+    # Act
+    response = client.get('/messages/search', params={"q": "deploy"})
+
+    # Assert
+    assert response.status_code == 200
+    assert {m['id'] for m in response.json()['messages']} == {search_data[0], search_data[1], search_data[3]}
+
+
+def test_search_paginates_without_repeats(search_data):
+    # Act
+    first = client.get('/messages/search', params={"q": "deploy", "limit": 2}).json()
+    second = client.get('/messages/search', params={"q": "deploy", "limit": 2, "cursor": first['next_cursor']}).json()
+
+    # Assert
+    ids = [m['id'] for m in first['messages'] + second['messages']]
+    assert len(ids) == len(set(ids)) == 3
+    assert second['next_cursor'] is None
+
+
+@pytest.mark.parametrize("cursor", ["WyJ4IiwxXQ", "WzEsIjIiXQ", "WzFd"])
+def test_search_rejects_malformed_cursor(search_data, cursor: str):
+    # Act
+    response = client.get('/messages/search', params={"q": "deploy", "cursor": cursor})
+
+    # Assert
+    assert response.status_code == 400
+
+
+def test_search_index_follows_edits(search_data):
+    # Act
+    client.put('/messages/', params={"id": search_data[2]}, json={"text": "deploy after lunch"})
+    response = client.get('/messages/search', params={"q": "lunch"})
+
+    # Assert
+    assert [m['id'] for m in response.json()['messages']] == [search_data[2]]
+
+
+def bot_log(number: int) -> str:
+    return json.dumps([{"level": "error", "service": "billing-worker", "request_id": f"req-{number}-{line}",
+                        "message": f"upstream timeout after {line * 100} ms, retrying"} for line in range(40)])
+
+
+def test_large_bodies_are_stored_compressed(search_data):
+    sender_id = client.get(f'/messages/{search_data[0]}').json()['sender_id']
+    body = bot_log(1) + " quarterlyfigures"
+
+    # Act
+    sent = client.post('/messages/', json={"sender_id": sender_id, "text": body}).json()
+    batch = client.post('/messages/batch', json=[{"sender_id": sender_id, "text": bot_log(2)}]).json()['ids']
+    db = SessionLocal()
+    stored = {message.id: message for message in db.query(Message).filter(Message.id.in_([sent['id'], *batch]))}
+    stored_sizes = [len(message.compressed_text or b"") for message in stored.values()]
+    encodings = [message.text_encoding for message in stored.values()]
+    db.close()
+    found = client.get('/messages/search', params={"q": "quarterlyfigures"}).json()['messages']
+
+    # Assert
+    assert encodings == ["zlib", "zlib"]
+    assert all(0 < size < len(body) // 4 for size in stored_sizes)
+    assert sent['text'] == client.get(f"/messages/{sent['id']}").json()['text'] == body
+    assert client.get(f'/messages/{batch[0]}').json()['text'] == bot_log(2)
+    assert [message['id'] for message in found] == [sent['id']]
+
+
+def test_editing_a_compressed_body_reindexes_it(search_data):
+    sender_id = client.get(f'/messages/{search_data[0]}').json()['sender_id']
+    sent = client.post('/messages/', json={"sender_id": sender_id, "text": bot_log(3) + " oldmarker"}).json()
+
+    # Act
+    client.put('/messages/', params={"id": sent['id']}, json={"text": "short newmarker"})
+
+    # Assert
+    assert client.get('/messages/search', params={"q": "oldmarker"}).json()['messages'] == []
+    assert [m['id'] for m in client.get('/messages/search', params={"q": "newmarker"}).json()['messages']] == [
+        sent['id']]
+
+
+def test_rebuilt_search_index_keeps_compressed_bodies(search_data):
+    sender_id = client.get(f'/messages/{search_data[0]}').json()['sender_id']
+    sent = client.post('/messages/', json={"sender_id": sender_id, "text": bot_log(4) + " rebuiltmarker"}).json()
+
+    # Act
+    db = SessionLocal()
+    MessageRepository(db).rebuild_search_index()
+    db.close()
+
+    # Assert
+    assert [m['id'] for m in client.get('/messages/search', params={"q": "rebuiltmarker"}).json()['messages']] == [
+        sent['id']]
+    assert [m['id'] for m in client.get('/messages/search', params={"q": "lunch"}).json()['messages']] == [
+        search_data[2]]
+
+
+def test_shared_dictionary_shrinks_small_bodies():
+    codec = TextCodec("zlib", threshold=64)
+    body = json.dumps(json.loads(bot_log(99))[:3])
+    without = codec.compress(body)
+    codec.add_dictionary(7, train_dictionary("zlib", [bot_log(number) for number in range(20)]), active=True)
+
+    # Act
+    encoding, data, dictionary_id = codec.compress(body)
+
+    # Assert
+    assert dictionary_id == 7
+    assert len(data) < len(without[1]) * 0.75
+    assert decompress(encoding, data, codec.dictionaries[7]) == body
+
+
+@pytest.mark.parametrize("query", ['"', "AND OR NOT", "*"])
+def test_search_tolerates_query_syntax(search_data, query):
+    response = client.get('/messages/search', params={"q": query})
+
+    assert response.status_code == 200
+
+
+@pytest.fixture(scope="module")
+def batch_senders(make):
+    user = make.user("bridge")
+
+    return [make.chat(f"Bridge {i}", user)[1][0] for i in range(2)]
+
+
+def test_send_batch_returns_ids_in_order(batch_senders):
+    batch = [{"sender_id": batch_senders[i % 2].id, "text": f"bridged {i}"} for i in range(10)]
+
+    # Act
+    response = client.post('/messages/batch', json=batch)
+
+    # Assert
+    assert response.status_code == 201
+    ids = response.json()['ids']
+    assert len(ids) == 10 and ids == sorted(ids)
+    stored = [client.get(f'/messages/{id}').json() for id in ids]
+    assert [message['text'] for message in stored] == [message['text'] for message in batch]
+    assert [message['chat_id'] for message in stored] == [batch_senders[i % 2].chat_id for i in range(10)]
+
+
+@pytest.mark.parametrize("batch, expected_status_code", [
+    ([{"sender_id": 0, "text": "unknown sender"}], 404),
+    ([{"sender_id": 1, "text": "x"}] * 1001, 413),
+])
+def test_send_batch_rejects_whole_batch(batch_senders, batch, expected_status_code):
+    # Act
+    response = client.post('/messages/batch', json=batch)
+
+    # Assert
+    assert response.status_code == expected_status_code
+
+
+@pytest.mark.asyncio
+async def test_group_commit_answers_every_sender(batch_senders):
+    committer = MessageCommitter(delay=0.05, max_size=100)
+    sends = [MessageCreateSchema(sender_id=batch_senders[i % 2].id, text=f"grouped {i}") for i in range(6)]
+
+    # Act
+    results = await asyncio.gather(*(committer.add_message(send) for send in sends),
+                                   committer.add_message(MessageCreateSchema(sender_id=0, text="nobody")),
+                                   return_exceptions=True)
+
+    # Assert
+    *messages, unknown = results
+    assert [message.text for message in messages] == [send.text for send in sends]
+    assert [message.chat_id for message in messages] == [batch_senders[i % 2].chat_id for i in range(6)]
+    assert isinstance(unknown, NoResultFound)
+    assert committer.stats()["groups"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_group_is_retried_message_by_message(batch_senders, monkeypatch):
+    committer = MessageCommitter(delay=0.05, max_size=3)
+
+    def fail(self, create_schemas, sender_chats):
+        raise RuntimeError("group transaction failed")
+
+    monkeypatch.setattr(MessageRepository, "add_messages", fail)
+
+    # Act
+    messages = await asyncio.gather(*(committer.add_message(MessageCreateSchema(sender_id=batch_senders[0].id,
+                                                                                text=f"retried {i}"))
+                                      for i in range(3)))
+
+    # Assert
+    assert [message.text for message in messages] == ["retried 0", "retried 1", "retried 2"]
+    assert {key: committer.stats()[key] for key in ("groups", "retried")} == {"groups": 1, "retried": 3}
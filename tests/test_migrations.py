@@ -0,0 +1,86 @@
+import logging
+
+from sqlalchemy import create_engine, inspect, text
+
+from ..backend.database import Base
+from ..backend.migrations import migrate, current_version, load_migrations, m0001_initial as initial
+
+
+def schema(engine) -> dict:
+    inspector = inspect(engine)
+    return {table: ({column["name"] for column in inspector.get_columns(table)},
+                    {index["name"] for index in inspector.get_indexes(table)})
+            for table in Base.metadata.tables}
+
+
+def model_schema() -> dict:
+    return {name: ({column.name for column in table.columns}, {index.name for index in table.indexes})
+            for name, table in Base.metadata.tables.items()}
+
+
+def test_migrations_build_the_model_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/fresh.db")
+
+    # Act
+    applied = migrate(engine)
+
+    # Assert
+    assert applied == [migration.version for migration in load_migrations()]
+    assert schema(engine) == model_schema()
+    assert migrate(engine) == []
+
+
+def test_schema_from_create_all_is_adopted_and_upgraded(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/legacy.db")
+    # What create_all made before there were migrations.
+    initial.metadata.create_all(bind=engine)
+
+    # Act
+    applied = migrate(engine)
+
+    # Assert
+    assert applied == [migration.version for migration in load_migrations()][1:]
+    assert current_version(engine) == len(load_migrations())
+    assert schema(engine) == model_schema()
+
+
+def test_schema_from_the_first_models_is_completed_and_upgraded(tmp_path, caplog):
+    engine = create_engine(f"sqlite:///{tmp_path}/first.db")
+    # What create_all made of the very first models, with a few rows.
+    with engine.begin() as connection:
+        for statement in (
+            "CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR, email VARCHAR UNIQUE, bio VARCHAR, "
+            "status VARCHAR, hashed_password VARCHAR)",
+            "CREATE TABLE chats (id INTEGER PRIMARY KEY, name VARCHAR, type VARCHAR, "
+            "created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP)",
+            "CREATE TABLE participants (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users (id) "
+            "ON DELETE CASCADE, chat_id INTEGER REFERENCES chats (id) ON DELETE CASCADE, "
+            "CONSTRAINT _user_participation_uc UNIQUE (user_id, chat_id))",
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY, sender_id INTEGER REFERENCES participants (id) "
+            "ON DELETE CASCADE, text VARCHAR)",
+            "INSERT INTO users (id, name, email, bio, status, hashed_password) VALUES "
+            "(1, 'Ann', 'ann@gmail.com', '', '', 'x'), (2, 'Bob', 'bob@gmail.com', '', '', 'x')",
+            "INSERT INTO chats (id, name, type) VALUES (1, 'Old', 'public'), (2, 'Empty', 'public')",
+            "INSERT INTO participants (id, user_id, chat_id) VALUES (1, 1, 1), (2, 2, 1)",
+            "INSERT INTO messages (id, sender_id, text) VALUES (1, 1, 'hello there'), (2, 2, 'general kenobi'), "
+            "(3, NULL, 'lost')",
+        ):
+            connection.execute(text(statement))
+
+    # Act
+    with caplog.at_level(logging.WARNING, logger="messenger.migrations"):
+        applied = migrate(engine)
+
+    # Assert
+    assert applied == [migration.version for migration in load_migrations()][1:]
+    assert schema(engine) == model_schema()
+    assert "left out 1 rows of messages with no value for chat_id" in caplog.messages
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT id, chat_id FROM messages ORDER BY id")).all() == [(1, 1), (2, 1)]
+        assert connection.execute(text("SELECT id, last_message_id, member_count FROM chats ORDER BY id")).all() == [
+            (1, 2, 2), (2, None, 0)]
+        assert connection.execute(text("SELECT last_read_message_id, unread_count FROM participants")).all() == [
+            (2, 0), (2, 0)]
+        assert connection.execute(text("SELECT rowid FROM messages_fts WHERE messages_fts MATCH 'kenobi'")).all() == [
+            (2,)]
+        assert connection.execute(text("PRAGMA foreign_key_check")).all() == []
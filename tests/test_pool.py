@@ -0,0 +1,60 @@
+import pytest
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import QueuePool
+
+from ..main import app
+from ..backend.utils.pool import PoolMonitor, instrumented_pool_class
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def tiny_engine(tmp_path):
+    monitor = PoolMonitor()
+    engine = create_engine(f"sqlite:///{tmp_path}/pool.db", poolclass=instrumented_pool_class(QueuePool, monitor),
+                           pool_size=1, max_overflow=0, pool_timeout=0.05)
+    monitor.attach(engine)
+    yield engine, monitor
+    engine.dispose()
+
+
+def test_pool_monitor_counts_checkouts_and_timeouts(tiny_engine):
+    engine, monitor = tiny_engine
+
+    # Act
+    with engine.connect():
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+        busy = monitor.stats()
+
+    # Assert
+    assert busy['checkouts'] == 1
+    assert busy['timeouts'] == 1
+    assert busy['connects'] == 1
+    assert busy['checked_out'] == 1
+    assert busy['wait_ms']['max'] >= 50
+    assert monitor.stats()['checked_out'] == 0
+
+
+def test_pool_monitor_survives_dispose(tiny_engine):
+    engine, monitor = tiny_engine
+    with engine.connect():
+        pass
+
+    # Act
+    engine.dispose()
+    with engine.connect():
+        pass
+
+    # Assert
+    stats = monitor.stats()
+    assert (stats['checkouts'], stats['connects'], stats['closes']) == (2, 2, 1)
+
+
+def test_pool_stats_endpoint():
+    response = client.get('/internal/database/pool')
+
+    assert response.status_code == 200
+    assert {'checkouts', 'timeouts', 'wait_ms'} <= response.json()['sync'].keys()
@@ -0,0 +1,125 @@
+import asyncio
+import pytest
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select, func
+from sqlalchemy.exc import NoResultFound
+
+from ..main import app
+from ..backend.database import SessionLocal
+from ..backend.models.chat import Chat
+from ..backend.models.user import User
+from ..backend.models.participant import Participant
+from ..backend.models.message import Message
+from ..backend.logic.users import UserRepository
+from ..backend.logic.chats import ChatRepository
+from ..backend.logic.particpants import ParticipantRepository
+from ..backend.logic.messages import MessageRepository
+from ..backend.logic.purge import Purger
+from ..backend.schemas.message import MessageCreateSchema
+
+client = TestClient(app)
+
+
+def create_chat(make, name: str, messages: int) -> tuple[int, list[int]]:
+    users = make.users(*(f"purge.{name}.{number}" for number in range(2)))
+    chat, senders = make.chat(name, *users)
+    for number in range(messages):
+        make.messages(senders[number % 2], f"m{number}")
+
+    return chat.id, [user.id for user in users]
+
+
+def count(model, condition) -> int:
+    db = SessionLocal()
+    try:
+        return db.scalar(select(func.count()).select_from(model).where(condition))
+    finally:
+        db.close()
+
+
+def test_small_chat_is_deleted_by_database_cascade(make):
+    chat_id, _ = create_chat(make, "small", messages=3)
+
+    # Act
+    response = client.delete('/chats/', params={"id": chat_id})
+
+    # Assert
+    assert response.status_code == 204
+    assert count(Chat, Chat.id == chat_id) == 0
+    assert count(Participant, Participant.chat_id == chat_id) == 0
+    assert count(Message, Message.chat_id == chat_id) == 0
+
+
+def test_large_chat_is_hidden_at_once_and_purged_in_batches(make):
+    chat_id, _ = create_chat(make, "large", messages=5)
+    purger = Purger(batch_size=2)
+
+    # Act
+    db = SessionLocal()
+    ChatRepository(db).delete_chat(chat_id, inline_limit=2)
+    db.close()
+    hidden = client.get(f'/chats/{chat_id}').status_code
+    pending = count(Message, Message.chat_id == chat_id)
+    asyncio.run(purger.run_once())
+
+    # Assert
+    assert hidden == 404 and pending == 5
+    assert count(Chat, Chat.id == chat_id) == 0
+    assert count(Participant, Participant.chat_id == chat_id) == 0
+    assert count(Message, Message.chat_id == chat_id) == 0
+    assert purger.stats()['deleted'] == {"messages": 5, "participants": 2, "chats": 1}
+    assert purger.stats()['finished'][0]['batches'] == 3 + 1 + 1
+
+
+def test_large_user_is_purged_and_their_chats_updated(make):
+    chat_id, (leaving_id, staying_id) = create_chat(make, "user", messages=4)
+    purger = Purger(batch_size=1)
+
+    # Act
+    db = SessionLocal()
+    UserRepository(db).remove_user(leaving_id, inline_limit=1)
+    db.close()
+    asyncio.run(purger.run_once())
+
+    # Assert
+    db = SessionLocal()
+    chat = db.get(Chat, chat_id)
+    remaining = db.scalars(select(Message.id).where(Message.chat_id == chat_id)).all()
+    db.close()
+    assert count(User, User.id == leaving_id) == 0
+    assert count(Participant, Participant.user_id == leaving_id) == 0
+    assert len(remaining) == 2
+    assert chat.member_count == 1 and chat.last_message_id == max(remaining)
+
+
+def test_tombstones_are_invisible_before_the_purge(make):
+    chat_id, (member_id, _) = create_chat(make, "hidden", messages=2)
+    other_chat_id, (leaving_id, staying_id) = create_chat(make, "left", messages=2)
+    db = SessionLocal()
+    participants, messages = ParticipantRepository(db), MessageRepository(db)
+    leaving_sender = participants.find_participation(leaving_id, other_chat_id).id
+    participants.find_chat_participants(other_chat_id)
+
+    # Act
+    ChatRepository(db).delete_chat(chat_id, inline_limit=0)
+    UserRepository(db).remove_user(leaving_id, inline_limit=0)
+
+    # Assert
+    assert [p.user_id for p in participants.find_chat_participants(other_chat_id)] == [staying_id]
+    for lookup in (lambda: participants.find_participation(member_id, chat_id),
+                   lambda: participants.find_user_participations(member_id),
+                   lambda: participants.find_chat_participants(chat_id),
+                   lambda: participants.mark_read(member_id, chat_id),
+                   lambda: messages.add_message(MessageCreateSchema(sender_id=leaving_sender, text="still here?"))):
+        with pytest.raises(NoResultFound):
+            lookup()
+    assert messages.find_sender_chats({leaving_sender}) == {}
+    db.close()
+
+
+def test_purge_progress_is_reported():
+    response = client.get('/internal/purge')
+
+    assert response.status_code == 200
+    assert {"running", "finished", "pending", "deleted", "completed"} <= response.json().keys()
@@ -0,0 +1,62 @@
+import pytest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from ..main import app
+from ..backend.database import get_engine
+from ..backend.utils.queries import QueryStatsMiddleware
+
+client = TestClient(app)
+
+
+def test_debug_headers_count_statements():
+    debug_app = FastAPI()
+
+    @debug_app.get('/')
+    def run_queries():
+        with get_engine().connect() as connection:
+            for _ in range(3):
+                connection.execute(text("SELECT 1"))
+
+    # Act
+    response = TestClient(QueryStatsMiddleware(debug_app, headers=True)).get('/')
+
+    # Assert
+    assert response.headers['x-db-queries'] == "3"
+    assert response.headers['x-db-max-repeats'] == "3"
+    assert float(response.headers['x-db-time-ms']) >= 0
+
+
+@pytest.fixture(scope="module")
+def busy_chat(make):
+    user = make.user("budget")
+    chats = []
+    for i in range(5):
+        chat, (sender,) = make.chat(f"Budget {i}", user)
+        make.messages(sender, *(f"budget {i}" for i in range(3)))
+        chats.append(chat)
+
+    client.cookies.set("token", make.token(user))
+    yield user, chats
+    client.cookies.clear()
+
+
+# The first authenticated request also looks the user up; budgets include that.
+@pytest.mark.parametrize("method, path, budget", [
+    ("get", "/me/chats", 2),
+    ("get", "/chats/{chat_id}/messages", 2),
+    ("get", "/chats/{chat_id}/participants?chat_id={chat_id}", 2),
+    ("get", "/chats/participations?user_id={user_id}", 2),
+    ("get", "/messages/search?q=budget", 2),
+    ("post", "/chats/{chat_id}/read", 6),
+])
+def test_route_query_budgets(busy_chat, query_budget, method, path, budget):
+    user, chats = busy_chat
+
+    with query_budget(budget) as requests:
+        response = client.request(method, path.format(chat_id=chats[0].id, user_id=user.id))
+
+    assert response.status_code == 200
+    assert len(requests) == 1
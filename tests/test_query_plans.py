@@ -0,0 +1,129 @@
+import re
+import pytest
+
+from sqlalchemy import event
+
+from ..backend.database import SessionLocal, get_engine
+from ..backend.logic.users import UserRepository, user_cache
+from ..backend.logic.chats import ChatRepository, chat_cache
+from ..backend.logic.particpants import ParticipantRepository, chat_participants_cache
+from ..backend.logic.messages import MessageRepository
+from ..backend.logic.purge import PurgeRepository
+from ..backend.logic.sync import SyncRepository
+from ..backend.logic.attachments import AttachmentRepository
+from ..backend.schemas.user import UserChangeDataSchema
+from ..backend.schemas.chat import ChatUpdateSchema
+from ..backend.schemas.participant import ParticipantCreateSchema, ParticipationSchema
+from ..backend.schemas.message import MessageCreateSchema, MessageUpdateSchema
+from ..backend.schemas.attachment import AttachmentCreateSchema
+
+# Tables that grow without bound; reading one of them in full is never acceptable.
+LARGE_TABLES = {"users", "chats", "participants", "messages", "changes", "blobs", "uploads", "attachments"}
+# "SCAN <table>" is a full scan (with or without an index); SEARCH is an index lookup.
+FULL_SCAN = re.compile(r"^SCAN (\w+?)(?:_\d+)?\b")
+
+
+@pytest.fixture
+def statements():
+    if get_engine().dialect.name != "sqlite":
+        pytest.skip("plans are checked with SQLite's EXPLAIN QUERY PLAN")
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            captured.append((statement, parameters))
+
+    for cache in (user_cache, chat_cache, chat_participants_cache):
+        cache.clear()
+
+    event.listen(get_engine(), "before_cursor_execute", capture)
+    yield captured
+    event.remove(get_engine(), "before_cursor_execute", capture)
+
+
+def full_scans(statement: str, parameters) -> list[str]:
+    with get_engine().connect() as connection:
+        plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).all()
+
+    return [detail for *_, detail in plan
+            if (match := FULL_SCAN.match(detail)) and match[1] in LARGE_TABLES]
+
+
+# Rows made by the factory are written through the same repositories, so their statements are checked too.
+def exercise_repositories(make):
+    owner, guest = make.users("plans.owner", "plans.guest")
+    chat, (sender,) = make.chat("Plans", owner)
+
+    db = SessionLocal()
+    users, chats = UserRepository(db), ChatRepository(db)
+    participants, messages = ParticipantRepository(db), MessageRepository(db)
+    participants.add_participants(chat.id, [guest.id])
+
+    first = messages.add_message(MessageCreateSchema(sender_id=sender.id, text="query plans"))
+    messages.add_messages([MessageCreateSchema(sender_id=sender.id, text=f"batch {number}") for number in range(3)],
+                          messages.find_sender_chats({sender.id}))
+
+    users.find_user(owner.id)
+    users.find_user_by_email(owner.email)
+    users.change_user_data(owner.id, UserChangeDataSchema(bio="explained"))
+    users.search_users("plans.o", limit=10)
+    users.search_users("plans", limit=10, after=(0.0, owner.id))
+    chats.find_chat(chat.id)
+    chats.find_chats_by_name("Plans")
+    chats.find_user_chats(owner.id, limit=20)
+    chats.update_chat(chat.id, ChatUpdateSchema(name="Plans"))
+    participants.find_participant(sender.id)
+    participants.find_participation(owner.id, chat.id)
+    participants.find_chat_access(chat.id, owner.id)
+    participants.find_chat_participants(chat.id)
+    participants.find_user_participations(owner.id)
+    participants.mark_read(guest.id, chat.id)
+    messages.find_message(first.id)
+    messages.find_chat_messages(chat.id, limit=2)
+    messages.find_chat_messages(chat.id, limit=2, before_id=first.id + 2)
+    messages.find_chat_messages(chat.id, limit=2, after_id=first.id)
+    messages.find_chat_messages(chat.id, limit=2, before_id=first.id + 2, user_id=owner.id)
+    messages.is_chat_member(owner.id, chat.id)
+    messages.search_messages(owner.id, "plans", limit=10)
+    messages.find_user_messages(owner.id, 0, limit=10)
+    attachments = AttachmentRepository(db)
+    attachments.add_blob("a" * 64, 10, owner.id, lambda: None)
+    attachment = attachments.add_attachment(first.id, owner.id,
+                                            AttachmentCreateSchema(sha256="a" * 64, filename="plan.txt"))
+    attachments.find_message_sender(first.id)
+    attachments.find_message_attachments(first.id, owner.id)
+    attachments.find_attachment(attachment.id, owner.id)
+    sync = SyncRepository(db)
+    sync.sequence_changes()
+    sync.find_change_bounds()
+    sync.find_changes(owner.id, since=0, limit=10)
+    sync.find_changes(guest.id, since=first.id, limit=10)
+    messages.update_message(first.id, MessageUpdateSchema(text="query plans, edited"))
+    messages.delete_message(first.id)
+    participants.delete_participation(ParticipationSchema(user_id=guest.id, chat_id=chat.id))
+
+    # Deletions with any history at all go through the background purge.
+    guest_sender = participants.add_participant(ParticipantCreateSchema(user_id=guest.id, chat_id=chat.id))
+    messages.add_message(MessageCreateSchema(sender_id=guest_sender.id, text="leaving"))
+    users.remove_user(guest.id, inline_limit=0)
+    chats.delete_chat(chat.id, inline_limit=0)
+    purge = PurgeRepository(db)
+    for kind, id in purge.find_pending():
+        while not getattr(purge, f"purge_{kind}")(id, batch_size=2)[1]:
+            pass
+
+    users.remove_user(owner.id)
+    sync.prune_changes(retention=0, batch_size=2)
+    attachments.delete_orphan_blobs(older_than=-60, batch_size=2, remove_file=lambda sha256: None)
+    db.close()
+
+
+def test_repository_queries_use_indexes(statements, make):
+    exercise_repositories(make)
+
+    scans = {statement: scans for statement, parameters in statements
+             if (scans := full_scans(statement, parameters))}
+
+    assert statements
+    assert scans == {}
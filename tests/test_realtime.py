@@ -0,0 +1,364 @@
+import asyncio
+import pytest
+
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..backend.database import SessionLocal, session_scope, AsyncRepository, get_engine
+from ..backend.logic.realtime import ChatHub
+from ..backend.logic.broker import UnixSocketBroker, create_broker
+from ..backend.logic.events import EventService
+from ..backend.logic.messages import MessageRepository, MessageService
+from ..backend.logic.tokens import generate_access_token
+from ..backend.schemas.message import MessageCreateSchema
+
+client = TestClient(app)
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_json(self, data):
+        self.sent.append(data)
+
+
+@pytest.fixture(scope="module")
+def participant(make):
+    user = make.user("realtime")
+    _, (participant,) = make.chat("Realtime", user)
+
+    return user, participant
+
+
+def test_ws_receives_sent_message(participant):
+    # Arrange
+    user, sender = participant
+    client.cookies.set("token", generate_access_token(user.id, user.email))
+
+    with client.websocket_connect('/ws') as websocket:
+        # Act
+        response = client.post('/messages/', json={"sender_id": sender.id, "text": "hello"})
+        event = websocket.receive_json()
+
+    # Assert
+    assert response.status_code == 201
+    assert event['type'] == "message"
+    assert event['message']['id'] == response.json()['id']
+    assert event['message']['chat_id'] == sender.chat_id
+    client.cookies.clear()
+
+
+def test_ws_rejects_anonymous():
+    from starlette.websockets import WebSocketDisconnect
+
+    with pytest.raises(WebSocketDisconnect):
+        with client.websocket_connect('/ws') as websocket:
+            websocket.receive_json()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("policy, expected_queue, expected_counters", [
+    ("drop_oldest", [2, 3], {"dropped": 2, "disconnected": 0}),
+    ("disconnect", [0, 1], {"dropped": 0, "disconnected": 1}),
+])
+async def test_hub_overflow_policy(policy, expected_queue, expected_counters):
+    # Arrange
+    hub = ChatHub(max_queue=2, overflow_policy=policy)
+    connection = hub.connect(FakeWebSocket(), user_id=1, chat_ids=[10])
+
+    # Act
+    for i in range(4):
+        hub.publish(10, {"n": i})
+    await asyncio.sleep(0)
+
+    # Assert
+    queued = [connection.queue.get_nowait()["n"] for _ in range(connection.queue.qsize())]
+    assert queued == expected_queue
+    assert {key: hub.counters[key] for key in expected_counters} == expected_counters
+    assert connection.kicked.is_set() == (policy == "disconnect")
+
+
+async def drain(connection, count: int, timeout: float = 5) -> list:
+    events = []
+    while len(events) < count:
+        events.append(await asyncio.wait_for(connection.queue.get(), timeout))
+    return events
+
+
+@pytest.mark.asyncio
+async def test_connection_leaves_no_task_running():
+    from fastapi import WebSocketDisconnect
+
+    class ClosingWebSocket(FakeWebSocket):
+        async def receive_text(self):
+            raise WebSocketDisconnect()
+
+    hub = ChatHub()
+    connection = hub.connect(ClosingWebSocket(), user_id=1, chat_ids=[10])
+    before = asyncio.all_tasks()
+
+    # Act
+    await connection.run()
+
+    # Assert
+    assert asyncio.all_tasks() - before == set()
+
+
+@pytest.mark.asyncio
+async def test_unix_brokers_relay_events_between_workers(tmp_path):
+    # Arrange: two workers, each with its own hub and a socket subscribed to chat 10.
+    hubs = [ChatHub(), ChatHub()]
+    connections = [hub.connect(FakeWebSocket(), user_id=1, chat_ids=[10]) for hub in hubs]
+    brokers = [UnixSocketBroker(hub, str(tmp_path)) for hub in hubs]
+    for broker in brokers:
+        # Small payloads, so a batch is split across several datagrams.
+        broker.max_payload = 300
+        broker.start()
+
+    # Act
+    try:
+        for i in range(50):
+            brokers[0].publish(10, {"type": "message", "n": i})
+            brokers[0].publish(11, {"type": "message", "n": i})
+        received = [await drain(connection, 50) for connection in connections]
+        await asyncio.sleep(0.2)
+    finally:
+        for broker in brokers:
+            broker.stop()
+
+    # Assert: every worker got each event of its chat once, in order.
+    assert [[event["n"] for event in events] for events in received] == [list(range(50))] * 2
+    assert [connection.queue.qsize() for connection in connections] == [0, 0]
+    assert brokers[0].stats()["payloads"] > 2
+    assert brokers[1].stats()["received"] == 100
+    assert list(tmp_path.iterdir()) == []
+
+
+# Joins that were split in transit, until user_count users have joined.
+async def drain_joins(connection, user_count: int) -> list:
+    events = []
+    while user_count > 0:
+        events += await drain(connection, 1)
+        user_count -= len(events[-1]["user_ids"])
+    return events
+
+
+@pytest.mark.asyncio
+async def test_brokers_relay_events_too_big_for_a_payload(tmp_path, participant, make):
+    # Arrange
+    _, sender = participant
+    long_id, = make.messages(sender, "long " * 200)
+    db = SessionLocal()
+    long_message = MessageRepository(db).find_message(long_id).model_dump(mode="json")
+    db.close()
+    hubs = [ChatHub(), ChatHub()]
+    connection = hubs[1].connect(FakeWebSocket(), user_id=1, chat_ids=[sender.chat_id])
+    brokers = [UnixSocketBroker(hub, str(tmp_path)) for hub in hubs]
+    for broker in brokers:
+        broker.max_payload = 300
+        broker.start()
+
+    # Act
+    try:
+        brokers[0].publish(sender.chat_id, {"type": "participants_added", "chat_id": sender.chat_id,
+                                            "user_ids": list(range(1000, 1200))})
+        brokers[0].publish(sender.chat_id, {"type": "message", "message": long_message})
+        joins = await drain_joins(connection, 200)
+        received = await drain(connection, 1)
+    finally:
+        for broker in brokers:
+            broker.stop()
+
+    # Assert: the join arrives in parts, the message whole, read back by the receiver.
+    assert len(joins) > 1 and {event["type"] for event in joins} == {"participants_added"}
+    assert [user_id for event in joins for user_id in event["user_ids"]] == list(range(1000, 1200))
+    assert received == [{"type": "message", "message": long_message}]
+    assert brokers[0].stats()["dropped"] == 0
+
+
+@pytest.mark.asyncio
+async def test_postgres_brokers_relay_events_between_workers():
+    pytest.importorskip("psycopg2")
+    if get_engine().dialect.name != "postgresql":
+        pytest.skip("LISTEN/NOTIFY needs a PostgreSQL database")
+
+    # Arrange
+    hubs = [ChatHub(), ChatHub()]
+    connection = hubs[1].connect(FakeWebSocket(), user_id=1, chat_ids=[10])
+    brokers = [create_broker("postgres", "", hub) for hub in hubs]
+    for broker in brokers:
+        broker.start()
+
+    # Act
+    try:
+        for i in range(50):
+            brokers[0].publish(10, {"type": "message", "n": i})
+        brokers[0].publish(10, {"type": "participants_added", "chat_id": 10, "user_ids": list(range(2000))})
+        received = await drain(connection, 50)
+        joins = await drain_joins(connection, 2000)
+    finally:
+        for broker in brokers:
+            broker.stop()
+
+    # Assert
+    assert [event["n"] for event in received] == list(range(50))
+    assert [user_id for event in joins for user_id in event["user_ids"]] == list(range(2000))
+    assert brokers[1].stats()["errors"] == 0
+
+
+@pytest.mark.asyncio
+async def test_broker_skips_payloads_it_cannot_deliver(tmp_path):
+    import socket
+
+    hub = ChatHub()
+    connection = hub.connect(FakeWebSocket(), user_id=1, chat_ids=[10])
+    broker = UnixSocketBroker(hub, str(tmp_path))
+    broker.start()
+
+    # Act
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            for payload in (b"not json", b'{"origin":"other","chat_id":10}',
+                            b'{"origin":"other","chat_id":10,"events":[{"type":"message","n":1}]}'):
+                sender.sendto(payload, broker.path)
+        received = await drain(connection, 1)
+    finally:
+        broker.stop()
+
+    # Assert
+    assert [event["n"] for event in received] == [1]
+    assert broker.stats()["errors"] == 2
+
+
+@pytest.mark.asyncio
+async def test_membership_events_move_open_sockets():
+    # Arrange
+    hub = ChatHub()
+    connection = hub.connect(FakeWebSocket(), user_id=1, chat_ids=[])
+
+    # Act
+    hub.deliver(10, [{"type": "message", "n": 0},
+                     {"type": "participants_added", "chat_id": 10, "user_ids": [1]},
+                     {"type": "message", "n": 1},
+                     {"type": "participant_removed", "chat_id": 10, "user_id": 1},
+                     {"type": "message", "n": 2}])
+    await asyncio.sleep(0)
+
+    # Assert
+    queued = [connection.queue.get_nowait()["type"] for _ in range(connection.queue.qsize())]
+    assert queued == ["participants_added", "message", "participant_removed"]
+    assert hub.stats()["subscribed_chats"] == 0
+
+
+async def send(sender_id: int, text: str):
+    async with session_scope() as db:
+        return await MessageService(AsyncRepository(db, MessageRepository)).add_message(
+            MessageCreateSchema(sender_id=sender_id, text=text))
+
+
+@pytest.fixture
+def events_client(participant):
+    user, _ = participant
+    client.cookies.set("token", generate_access_token(user.id, user.email))
+    yield client
+    client.cookies.clear()
+
+
+def test_events_long_poll_returns_messages_after_cursor(participant, events_client):
+    _, sender = participant
+    cursor = events_client.get('/events').json()['cursor']
+    sent = events_client.post('/messages/', json={"sender_id": sender.id, "text": "polled"}).json()
+
+    # Act
+    page = events_client.get('/events', params={"since": cursor}).json()
+    empty = events_client.get('/events', params={"since": page['cursor'], "timeout": 0}).json()
+
+    # Assert
+    assert [event['message']['id'] for event in page['events']] == [sent['id']]
+    assert empty == {"events": [], "cursor": page['cursor']}
+
+
+def test_events_follow_the_order_messages_change_in(participant, events_client):
+    _, sender = participant
+    older = events_client.post('/messages/', json={"sender_id": sender.id, "text": "older"}).json()
+    events_client.post('/messages/', json={"sender_id": sender.id, "text": "newer"})
+    cursor = events_client.get('/events').json()['cursor']
+    events_client.put('/messages/', params={"id": older['id']}, json={"text": "older, edited"})
+
+    # Act
+    page = events_client.get('/events', params={"since": cursor}).json()
+
+    # Assert
+    assert [(event['message']['id'], event['message']['text']) for event in page['events']] == \
+        [(older['id'], "older, edited")]
+
+
+@pytest.mark.parametrize("params, cookie, expected_status_code", [
+    ({"since": "garbage"}, True, 400),
+    ({"timeout": 3600}, True, 422),
+    ({}, False, 401),
+])
+def test_events_rejects_bad_requests(participant, params, cookie, expected_status_code):
+    user, _ = participant
+    if cookie:
+        client.cookies.set("token", generate_access_token(user.id, user.email))
+
+    response = client.get('/events', params=params)
+    client.cookies.clear()
+
+    assert response.status_code == expected_status_code
+
+
+@pytest.mark.asyncio
+async def test_parked_poll_wakes_up_on_new_message(participant):
+    user, sender = participant
+    service = EventService()
+    cursor = (await service.poll(user.id, None, timeout=0)).cursor
+
+    # Act
+    parked = asyncio.create_task(service.poll(user.id, cursor, timeout=5))
+    await asyncio.sleep(0.1)
+    message = await send(sender.id, "wake up")
+    page = await asyncio.wait_for(parked, 2)
+
+    # Assert
+    assert [event.message.id for event in page.events] == [message.id]
+
+
+@pytest.mark.asyncio
+async def test_event_stream_sends_messages_and_keep_alives(participant):
+    user, sender = participant
+    service = EventService()
+    cursor = (await service.poll(user.id, None, timeout=0)).cursor
+    message = await send(sender.id, "streamed")
+    stream = service.stream(user.id, cursor, keepalive=0.05)
+
+    # Act
+    try:
+        frames = [await stream.__anext__(), await stream.__anext__()]
+    finally:
+        await stream.aclose()
+
+    # Assert
+    assert frames[0].startswith("id: ") and f'"id":{message.id},' in frames[0]
+    assert frames[1] == ": keep-alive\n\n"
+    assert service.hub.stats()["listeners"] == 0
+
+
+@pytest.mark.asyncio
+async def test_event_stream_ends_when_hub_drops_it(participant):
+    user, sender = participant
+    hub = ChatHub(max_queue=1, overflow_policy="disconnect")
+    service = EventService(hub=hub)
+    stream = service.stream(user.id, None, keepalive=5)
+    first_frame = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0.1)
+
+    # Act: two events before the stream gets to run overflow its queue.
+    hub.deliver(sender.chat_id, [{"type": "read"}, {"type": "read"}])
+
+    # Assert
+    with pytest.raises(StopAsyncIteration):
+        await asyncio.wait_for(first_frame, 2)
+    assert hub.stats()["listeners"] == 0 and hub.counters["disconnected"] == 1
@@ -0,0 +1,145 @@
+import pytest
+
+from fastapi.testclient import TestClient
+
+from ..main import app
+from ..backend.database import SessionLocal
+from ..backend.models.change import Change
+from ..backend.logic.users import UserRepository
+from ..backend.logic.chats import ChatRepository
+from ..backend.logic.sync import SyncRepository
+from ..backend.schemas.user import UserChangeDataSchema
+from ..backend.schemas.chat import ChatUpdateSchema
+
+client = TestClient(app)
+
+
+@pytest.fixture(scope="module")
+def members(make):
+    users = make.users("sync.reader", "sync.friend", "sync.stranger")
+    shared, senders = make.chat("Shared", *users[:2])
+    other, (stranger,) = make.chat("Other", users[2])
+
+    client.cookies.set("token", make.token(users[0]))
+    yield users, (shared, other), [*senders, stranger]
+    client.cookies.clear()
+
+
+def sync(since: int, limit: int = 500) -> dict:
+    response = client.get('/sync', params={"since": since, "limit": limit})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_sync_without_cursor_asks_for_full_resync(members):
+    # Act
+    page = client.get('/sync').json()
+
+    # Assert
+    assert page['resync_required'] is True
+    assert page['changes'] == [] and page['cursor'] > 0
+
+
+def test_sync_returns_latest_state_of_relevant_changes(members):
+    users, (shared, other), senders = members
+    cursor = client.get('/sync').json()['cursor']
+
+    edited = client.post('/messages/', json={"sender_id": senders[1].id, "text": "first draft"}).json()
+    client.put('/messages/', params={"id": edited['id']}, json={"text": "second draft"})
+    client.put('/messages/', params={"id": edited['id']}, json={"text": "final"})
+    removed = client.post('/messages/', json={"sender_id": senders[0].id, "text": "oops"}).json()
+    client.delete('/messages/', params={"id": removed['id']})
+    client.post('/messages/', json={"sender_id": senders[2].id, "text": "elsewhere"})
+    db = SessionLocal()
+    UserRepository(db).change_user_data(users[1].id, UserChangeDataSchema(bio="synced bio"))
+    UserRepository(db).change_user_data(users[2].id, UserChangeDataSchema(bio="not a contact"))
+    ChatRepository(db).update_chat(shared.id, ChatUpdateSchema(name="Renamed"))
+    db.close()
+
+    # Act
+    page = sync(cursor)
+
+    # Assert
+    changes = {(change['entity'], change['id']): change for change in page['changes']}
+    assert set(changes) == {("message", edited['id']), ("message", removed['id']),
+                            ("user", users[1].id), ("chat", shared.id)}
+    assert changes["message", edited['id']]['data']['text'] == "final"
+    assert changes["message", removed['id']]['deleted'] is True
+    assert changes["user", users[1].id]['data']['bio'] == "synced bio"
+    assert "hashed_password" not in changes["user", users[1].id]['data']
+    assert changes["chat", shared.id]['data']['name'] == "Renamed"
+    assert [change['seq'] for change in page['changes']] == sorted(change['seq'] for change in page['changes'])
+    assert sync(page['cursor'])['changes'] == []
+
+
+def test_sync_pages_without_gaps_or_repeats(members):
+    _, _, senders = members
+    cursor = client.get('/sync').json()['cursor']
+    sent = [client.post('/messages/', json={"sender_id": senders[0].id, "text": f"paged {i}"}).json()['id']
+            for i in range(5)]
+
+    # Act
+    seen, pages = [], 0
+    while True:
+        page = sync(cursor, limit=2)
+        seen += [change['id'] for change in page['changes'] if change['entity'] == "message"]
+        cursor, pages = page['cursor'], pages + 1
+        if not page['has_more']:
+            break
+
+    # Assert
+    assert seen == sent
+    assert pages == 3
+
+
+def test_changes_are_numbered_in_order_once_read(members):
+    _, _, senders = members
+    cursor = client.get('/sync').json()['cursor']
+    sent = [client.post('/messages/', json={"sender_id": senders[0].id, "text": f"numbered {i}"}).json()['id']
+            for i in range(3)]
+    db = SessionLocal()
+    pending = db.query(Change).filter(Change.seq.is_(None)).count()
+    db.close()
+
+    # Act
+    page = sync(cursor)
+
+    # Assert
+    assert pending == 3
+    assert [(change['id'], change['seq']) for change in page['changes']] == [
+        (id, cursor + number) for number, id in enumerate(sent, 1)]
+    assert page['cursor'] == cursor + 3
+
+
+def test_membership_end_and_chat_deletion_reach_the_member(members, make):
+    users, _, _ = members
+    chat, _ = make.chat("Short lived", users[0])
+    cursor = client.get('/sync').json()['cursor']
+
+    # Act
+    client.delete('/chats/', params={"id": chat.id})
+    page = sync(cursor)
+
+    # Assert
+    assert [(change['entity'], change['id'], change['deleted']) for change in page['changes']] == [
+        ("chat", chat.id, True)]
+
+
+def test_cursor_older_than_retention_requires_resync(members):
+    _, _, senders = members
+    stale = client.get('/sync').json()['cursor']
+    for i in range(3):
+        client.post('/messages/', json={"sender_id": senders[0].id, "text": f"pruned {i}"})
+
+    db = SessionLocal()
+    SyncRepository(db).sequence_changes()
+    pruned = SyncRepository(db).prune_changes(retention=-60, batch_size=1000)
+    db.close()
+
+    # Act
+    page = sync(stale)
+
+    # Assert
+    assert pruned > 0
+    assert page['resync_required'] is True
+    assert sync(page['cursor'])['resync_required'] is False
@@ -46,4 +46,129 @@ async def test_register(creation_schema: UserCreateSchema,
     # Assert
     assert response.status_code == expected_status_code
     if response.status_code >= 400:
-        assert response.json()['detail'] == expected_message
\ No newline at end of file
+        assert response.json()['detail'] == expected_message
+
+@pytest.fixture(scope="module")
+def registered_user(make):
+    return make.user("login", password='123123123')
+
+
+@pytest.mark.parametrize("password, expected_status_code", [
+    ('123123123', 200),
+    ('000000000', 400),
+])
+def test_authorize(registered_user, password: str, expected_status_code: int):
+    # Act
+    response = client.post(url='/users/authorize', json={"email": registered_user.email, "password": password})
+
+    # Assert
+    assert response.status_code == expected_status_code
+    if response.status_code == 200:
+        assert response.cookies.get("token") == response.json()['access_token']
+
+
+def test_get_users_serializes_schemas(registered_user):
+    # Act
+    one = client.get(url=f'/users/{registered_user.id}')
+
+    # Assert
+    assert one.status_code == 200
+    assert one.headers['content-type'] == "application/json"
+    assert one.json() == registered_user.public().model_dump()
+    assert "hashed_password" not in one.json()
+    assert client.get(url='/users/all').status_code != 200
+
+
+@pytest.fixture(scope="module")
+def directory(make):
+    from ..backend.database import SessionLocal
+    from ..backend.logic.users import UserRepository
+    from ..backend.schemas.user import UserChangeDataSchema
+
+    users = make.users("zephyrine.one", "zephyrine.two", "zephyrine.three", "zephyrine.gone", "quillon")
+    db = SessionLocal()
+    repository = UserRepository(db)
+    renamed = repository.change_user_data(users[4].id, UserChangeDataSchema(name="Zephyrine Quillon"))
+    repository.remove_user(users[3].id)
+    db.close()
+
+    client.cookies.set("token", make.token(users[0]))
+    yield users[:3] + [renamed], users[3]
+    client.cookies.clear()
+
+
+def test_search_users_matches_name_and_email_prefixes(directory):
+    found, removed = directory
+
+    # Act
+    by_prefix = client.get('/users/search', params={"q": "zeph"})
+    by_email = client.get('/users/search', params={"q": "zephyrine.tw"})
+    anonymous = client.get('/users/search', params={"q": "zeph"}, cookies={"token": ""})
+
+    # Assert
+    assert by_prefix.status_code == 200
+    assert {user['id'] for user in by_prefix.json()['users']} == {user.id for user in found}
+    assert [user['id'] for user in by_email.json()['users']] == [found[1].id]
+    assert all("hashed_password" not in user for user in by_prefix.json()['users'])
+    assert removed.id not in {user['id'] for user in by_prefix.json()['users']}
+    assert anonymous.status_code == 401
+
+
+def test_search_users_pages_without_repeats(directory):
+    found, _ = directory
+
+    # Act
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = client.get('/users/search', params={"q": "zeph", "limit": 1, **({"cursor": cursor} if cursor else {})})
+        seen += [user['id'] for user in page.json()['users']]
+        cursor, pages = page.json()['next_cursor'], pages + 1
+        if cursor is None:
+            break
+
+    # Assert
+    assert sorted(seen) == sorted(user.id for user in found)
+    assert pages == len(found)
+
+
+@pytest.mark.parametrize("cursor", ["not a cursor", "WyJhIiwgImIiXQ"])
+def test_search_users_rejects_malformed_cursor(directory, cursor: str):
+    # Act
+    response = client.get('/users/search', params={"q": "zeph", "cursor": cursor})
+
+    # Assert
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_password_hasher_rejects_when_saturated():
+    import asyncio
+    from ..backend.logic.passwords import PasswordHasher
+
+    # Arrange
+    hasher = PasswordHasher(max_workers=1, max_pending=1)
+
+    # Act
+    results = await asyncio.gather(hasher.hash('123123123'), hasher.hash('123123123'), return_exceptions=True)
+    hasher.shutdown()
+
+    # Assert
+    assert isinstance(results[0], str)
+    assert isinstance(results[1], ServerBusyError)
+    assert hasher.stats()['rejected'] == 1
+
+
+@pytest.mark.asyncio
+async def test_password_hasher_does_not_fork_the_server():
+    from ..backend.logic.passwords import PasswordHasher, verify_password
+
+    # Arrange
+    hasher = PasswordHasher(max_workers=1)
+
+    # Act
+    hashed_password = await hasher.hash('123123123')
+    hasher.shutdown()
+
+    # Assert
+    assert hasher.stats()['start_method'] in ("forkserver", "spawn")
+    assert verify_password('123123123', hashed_password)